@@ -1,19 +1,42 @@
+import io
 import os
+import tempfile
 import time
 import uuid
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, send_from_directory, g
 from flask_cors import CORS
 from flask_migrate import Migrate
 from anthropic import Anthropic
 from dotenv import load_dotenv
 from functools import wraps
 from werkzeug.utils import secure_filename
-from PIL import Image
+from sqlalchemy import select, inspect as sa_inspect
 from models import db, ChatMessage, MessageAttachment, User, Feedback, UserProfile, DocumentUpload, AdminMessage, SupportChat
 import blob_storage
+import content_store
+import storage
+from blob_cache import BlobCacheError, blob_cache, is_immutable_name
+from reaper import DeletionReaper, document_expires_at, tombstone_documents
 from bridge_log import log_bridge_event, read_bridge_logs
+from db_pool import get_profile_name, engine_options, instrument_engine, pool_stats
+from unit_of_work import commit_unit_of_work
+from write_buffer import WriteBuffer
+from thumbnails import ThumbnailJob, ThumbnailWorker, thumbnail_filename, thumbnail_mime_type
+from blob_upload import open_reader, stream_to_file
+from history_cache import get_conversation_history
+from model_router import MODEL_MODES, route_model, create_with_fallback
+from support_inbox import get_admin_inbox, DEFAULT_PAGE_SIZE
+from message_history import parse_page_args, get_chat_history_page, get_support_chat_page
+from support_counters import ADMIN_COUNTER_KEY, user_counter_key, get_unread_counter, counter_etag
+from support_events import open_support_event_stream
+from read_receipts import mark_conversation_read
+from request_timing import (
+    span, start_request_timings, end_request_timings, get_request_timings,
+    current_timings_dict, submit_with_timings, instrument_sqlalchemy
+)
 from chroma_client import (
     get_collection, add_document_chunks, query_documents,
     delete_document, delete_user_documents
@@ -48,24 +71,20 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Connection pooling for PostgreSQL (serverless optimization)
-if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql://'):
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_size': 3,
-        'pool_recycle': 60,  # Recycle connections every 60 seconds
-        'pool_pre_ping': True,  # Check connection health before use
-        'max_overflow': 5,
-        'pool_timeout': 30,
-        'connect_args': {
-            'connect_timeout': 10,
-            'keepalives': 1,
-            'keepalives_idle': 30,
-            'keepalives_interval': 10,
-            'keepalives_count': 5
-        }
-    }
+# Connection pooling per deployment profile (see db_pool.py)
+db_pool_profile = get_profile_name(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], db_pool_profile)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
+# Backend new uploads are written to: Vercel Blob or local disk (STORAGE_BACKEND, see storage.py)
+file_storage = storage.init_app(app)
+# Let a fronting Apache/lighttpd send files (X-Sendfile); otherwise the WSGI server's sendfile is used
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', 'false').lower() == 'true'
+# Pages listen on the SSE endpoints instead of polling; each open stream holds a WSGI
+# worker, so this is off unless served by asgi.py (which turns it on) or set explicitly
+app.config['SUPPORT_EVENTS_SSE'] = os.environ.get('SUPPORT_EVENTS_SSE', 'false').lower() == 'true'
+# uuid- and hash-named uploads never change, so browsers and CDNs may keep them for a year
+IMMUTABLE_MAX_AGE = 31536000
 
 CORS(app)
 
@@ -77,25 +96,38 @@ def request_entity_too_large(error):
 # Initialize database
 db.init_app(app)
 migrate = Migrate(app, db)
+instrument_sqlalchemy()
+with app.app_context():
+    instrument_engine(db.engine, db_pool_profile)
+
+@app.before_request
+def begin_request_timing():
+    # The ASGI server binds one collector across all phases of an async turn
+    if get_request_timings() is None:
+        g.request_timing_token = start_request_timings()
+
+@app.after_request
+def add_server_timing_header(response):
+    timings = get_request_timings()
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing_header()
+    return response
+
+@app.context_processor
+def inject_support_events_sse():
+    return {'support_events_sse': app.config['SUPPORT_EVENTS_SSE']}
+
+@app.teardown_request
+def finish_request_timing(exc):
+    token = g.pop('request_timing_token', None)
+    if token is not None:
+        end_request_timings(token)
 
 def db_commit_with_retry(max_retries=3):
-    """Commit database changes with retry logic for connection errors."""
-    for attempt in range(max_retries):
-        try:
-            db.session.commit()
-            return True
-        except Exception as e:
-            error_str = str(e).lower()
-            if 'ssl' in error_str or 'connection' in error_str or 'closed' in error_str:
-                print(f"DB commit attempt {attempt + 1} failed: {e}")
-                db.session.rollback()
-                if attempt < max_retries - 1:
-                    # Close and recreate the connection
-                    db.session.remove()
-                    time.sleep(0.5)  # Brief delay before retry
-                    continue
-            raise
-    return False
+    """Commit, replaying the unit of work on transient database errors (see unit_of_work.py)."""
+    with span('commit'):
+        commit_unit_of_work(db.session, attempts=max_retries)
+    return True
 
 def get_anthropic_client():
     """Get Anthropic client - creates fresh instance for serverless compatibility."""
@@ -113,13 +145,35 @@ def get_opus_model():
 def get_default_model():
     return os.environ.get("ANTHROPIC_MODEL", get_haiku_model())
 
+def get_model_mode():
+    """Model mode for the current session: haiku, opus or auto."""
+    mode = session.get("chat_model", os.environ.get("CHAT_MODEL_MODE", "haiku"))
+    return mode if mode in MODEL_MODES else "haiku"
+
 def get_active_model():
-    """Resolve active chat model for current session."""
-    model_choice = session.get("chat_model", "haiku")
-    if model_choice == "opus":
+    """Resolve active chat model for current session (the fast model in auto mode)."""
+    if get_model_mode() == "opus":
         return get_opus_model()
     return get_default_model()
 
+def route_chat_model(prompt, context_chars=0):
+    """Pick the model for a chat request from the session's mode and latency SLO."""
+    route = route_model(
+        get_model_mode(),
+        get_default_model(),
+        get_opus_model(),
+        prompt_chars=len(prompt or ""),
+        context_chars=context_chars,
+        latency_slo_ms=session.get("latency_slo_ms")
+    )
+    g.chat_route = route
+    return route
+
+def routed_model(route=None):
+    """Model to log for the current request: the routed one once routing has run."""
+    route = route or g.get('chat_route')
+    return route.model if route else get_active_model()
+
 def extract_anthropic_text(response):
     """Extract combined text from Anthropic response blocks."""
     text_parts = []
@@ -156,19 +210,29 @@ def generate_unique_filename(original_filename):
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     return f"{name}_{timestamp}_{unique_id}{ext}"
 
-def create_thumbnail(image_path, thumbnail_path, size=(150, 150)):
-    """Create a thumbnail for image files"""
-    try:
-        with Image.open(image_path) as img:
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            img.save(thumbnail_path, optimize=True, quality=85)
-            return True
-    except Exception as e:
-        print(f"Error creating thumbnail: {e}")
-        return False
+def spool_thumbnail_source(file, filename):
+    """Copy an uploaded image to a temporary file the thumbnail workers can open. Returns its path."""
+    fd, path = tempfile.mkstemp(prefix='thumbsrc_', suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    with open_reader(file.stream) as reader:
+        stream_to_file(reader, path)
+    return path
+
+def process_uploaded_file(file, message, thumbnail_sources=None):
+    """
+    Save an uploaded file to the storage backend (Vercel Blob or local disk).
+
+    With the content store on, the file is stored once per distinct content
+    (content_store.py) and the attachment holds a reference to it
+    (content_sha256) that must be released if the row is never written.
+
+    Thumbnails are not made here: for images, (attachment, source_path,
+    is_temporary) is appended to `thumbnail_sources`, and the turn queues
+    the jobs once the attachment is committed (see queue_thumbnails()).
 
-def process_uploaded_file(file, message_id):
-    """Process and save uploaded file to Vercel Blob storage"""
+    Returns the unsaved MessageAttachment linked to `message`, for the
+    request's write buffer, or None if the file was rejected or failed.
+    """
     if not file or not allowed_file(file.filename):
         return None
 
@@ -178,61 +242,43 @@ def process_uploaded_file(file, message_id):
 
         # Get MIME type
         mime_type = file.content_type or mimetypes.guess_type(file.filename)[0] or 'application/octet-stream'
+        wants_thumbnail = mime_type.startswith('image/') and thumbnail_sources is not None
 
-        # Upload to Vercel Blob (or fallback to local storage)
-        if blob_storage.is_blob_configured():
-            # Upload to Blob storage
-            blob_path = blob_storage.generate_blob_path('attachments', filename)
-            file_url, file_size = blob_storage.upload_file(file, blob_path, mime_type)
-            file_path = file_url  # Store blob URL as file_path
-
-            # Create thumbnail for images
-            thumbnail_url = None
-            if mime_type.startswith('image/'):
-                file.seek(0)  # Reset file pointer
-                thumbnail_path = blob_storage.generate_blob_path('thumbnails', f"thumb_{filename}")
-                thumbnail_url = blob_storage.upload_thumbnail(file, thumbnail_path)
-                file.seek(0)  # Reset again
-
-            # Create database record
-            attachment = MessageAttachment(
-                message_id=message_id,
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_url,  # Blob URL
-                file_size=file_size,
-                mime_type=mime_type,
-                thumbnail_path=thumbnail_url  # Blob URL for thumbnail
-            )
+        content_sha256 = None
+
+        # Store in Vercel Blob or on local disk (see storage.py)
+        if content_store.is_enabled():
+            # One shared object per distinct content; the turn releases it if the row isn't written
+            file.stream.seek(0)
+            stored = content_store.store_stream(file.stream, file.filename, mime_type)
+            file_path, file_size, content_sha256 = stored.location, stored.size, stored.sha256
         else:
-            # Fallback to local storage (for development)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'attachments', filename)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            file.save(file_path)
-            file_size = os.path.getsize(file_path)
-
-            # Create thumbnail for images
-            thumbnail_path = None
-            if mime_type.startswith('image/'):
-                thumbnail_filename = f"thumb_{filename}"
-                thumbnail_full_path = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails', thumbnail_filename)
-                os.makedirs(os.path.dirname(thumbnail_full_path), exist_ok=True)
-                if create_thumbnail(file_path, thumbnail_full_path):
-                    thumbnail_path = thumbnail_filename
-                else:
-                    thumbnail_path = None
-
-            attachment = MessageAttachment(
-                message_id=message_id,
-                filename=filename,
-                original_filename=file.filename,
-                file_path=file_path,
-                file_size=file_size,
-                mime_type=mime_type,
-                thumbnail_path=thumbnail_path
+            # Blob URL or local path, per STORAGE_BACKEND (storage.py)
+            file.stream.seek(0)
+            stored = file_storage.save_stream(
+                file.stream, blob_storage.generate_blob_path('attachments', filename), mime_type
             )
+            file_path, file_size = stored.location, stored.size
+
+        if wants_thumbnail:
+            # Thumbnail workers read a local copy of the upload
+            thumbnail_source = storage.backend_for(file_path).local_path(file_path)
+            temporary = thumbnail_source is None
+            if temporary:
+                thumbnail_source = spool_thumbnail_source(file, filename)
+
+        attachment = MessageAttachment(
+            message=message,
+            filename=filename,
+            original_filename=file.filename,
+            file_path=file_path,
+            file_size=file_size,
+            mime_type=mime_type,
+            content_sha256=content_sha256
+        )
+        if wants_thumbnail:
+            thumbnail_sources.append((attachment, thumbnail_source, temporary))
 
-        db.session.add(attachment)
         return attachment
 
     except Exception as e:
@@ -241,10 +287,72 @@ def process_uploaded_file(file, message_id):
         traceback.print_exc()
         return None
 
+def store_thumbnails(job, renders):
+    """
+    Store a rendered thumbnail set with the storage backend and point
+    the attachment's thumbnail_path at the smallest size. Runs on a
+    thumbnail finisher thread.
+    """
+    paths = {}
+    thumbnails_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'thumbnails')
+    for render in renders:
+        name = thumbnail_filename(job.stem, render['width'], render['format'])
+        # Every size and format of a thumbnail shares one shard directory on local disk
+        location = file_storage.save_bytes(
+            render['data'], blob_storage.generate_blob_path('thumbnails', name),
+            thumbnail_mime_type(render['format']), shard=job.stem
+        )
+        if not storage.is_remote(location):
+            # Local thumbnails are kept relative to /uploads/thumbnails/
+            location = os.path.relpath(location, thumbnails_folder).replace(os.sep, '/')
+        paths[(render['width'], render['format'])] = location
+
+    # The smallest size in the original-style format (JPEG/PNG) is the default thumbnail
+    primary = min((key for key in paths if key[1] != 'WEBP'), key=lambda key: key[0])
+    with app.app_context():
+        MessageAttachment.query.filter_by(id=job.attachment_id).update(
+            {'thumbnail_path': paths[primary], 'is_processed': True}, synchronize_session=False
+        )
+        commit_unit_of_work(db.session, source='thumbnails')
+
+thumbnail_worker = ThumbnailWorker(store_thumbnails)
+
+# Deletes the Chroma chunks and files of deleted documents after the response (see reaper.py)
+deletion_reaper = DeletionReaper(app)
+
+def discard_thumbnail_sources(thumbnail_sources):
+    """Remove the temporary image copies of a turn whose rows weren't written."""
+    for _, source_path, temporary in thumbnail_sources:
+        if temporary and os.path.exists(source_path):
+            os.remove(source_path)
+
+def queue_thumbnails(thumbnail_sources):
+    """Queue thumbnail jobs for a turn's committed image attachments."""
+    for attachment, source_path, temporary in thumbnail_sources:
+        # The identity survives the commit's expiry, so this doesn't reload the row
+        attachment_id = sa_inspect(attachment).identity[0]
+        thumbnail_worker.submit(ThumbnailJob(
+            attachment_id=attachment_id,
+            source_path=source_path,
+            stem=os.path.splitext(attachment.filename)[0],
+            temporary=temporary
+        ))
+
 # =============================================================================
 # Document RAG Helper Functions
 # =============================================================================
 
+# Worker pool for independent RAG pipeline stages (extraction, embedding,
+# chunk insert, blob upload, retrieval). Workers never touch db.session.
+_rag_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('RAG_PIPELINE_WORKERS', '4')),
+    thread_name_prefix='rag-pipeline'
+)
+
+def submit_pipeline_stage(fn, *args, **kwargs):
+    """Run a pipeline stage on the worker pool; its spans record into the request's timings."""
+    return submit_with_timings(_rag_executor, fn, *args, **kwargs)
+
 def allowed_document_file(filename):
     """Check if document file type is allowed for RAG"""
     ALLOWED_DOC_EXTENSIONS = {
@@ -263,90 +371,137 @@ def get_or_create_thread(session_id):
 def save_document_upload(user_id, session_id, file, chroma_doc_id, chunk_count):
     """Save document upload record to database and Vercel Blob storage"""
     try:
-        filename = generate_unique_filename(file.filename)
-        mime_type = file.content_type or mimetypes.guess_type(file.filename)[0]
-
-        # Upload to Vercel Blob (or fallback to local storage)
-        if blob_storage.is_blob_configured():
-            # Upload to Blob storage
-            blob_path = blob_storage.generate_blob_path('documents', filename)
-            file_url, file_size = blob_storage.upload_file(file, blob_path, mime_type)
-            file_path = file_url  # Store blob URL
-        else:
-            # Fallback to local storage (for development)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'documents', filename)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            file.save(file_path)
-            file_size = os.path.getsize(file_path)
-
-        # Create database record
-        doc = DocumentUpload(
-            user_id=user_id,
-            session_id=session_id,
-            filename=filename,
-            original_filename=file.filename,
-            file_size=file_size,
-            mime_type=mime_type,
-            chroma_doc_id=chroma_doc_id,
-            chunk_count=chunk_count,
-            file_path=file_path  # Blob URL or local path
+        filename, mime_type, file_path, file_size, content_sha256 = store_document_stream(
+            file.filename, file.content_type, open_reader(file.stream)
+        )
+    except Exception as e:
+        print(f"Error saving document upload: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+    return save_document_record(
+        user_id, session_id, filename, file.filename, mime_type,
+        file_path, file_size, chroma_doc_id, chunk_count, content_sha256
+    )
+
+
+def store_document_content(original_filename, content_type, file_content):
+    """
+    Store raw document bytes in Vercel Blob (or local storage).
+
+    Does not touch the database session, so it is safe to run on a worker thread.
+
+    Returns:
+        Tuple of (filename, mime_type, file_path, file_size, content_sha256)
+    """
+    return store_document_stream(original_filename, content_type, io.BytesIO(file_content))
+
+
+def store_document_stream(original_filename, content_type, stream):
+    """
+    Store a document from a readable stream with the storage backend (Vercel Blob or local disk).
+
+    The stream is copied in parts, never read whole into memory, and is
+    closed afterwards. With the content store on, a document whose content
+    is already stored isn't uploaded again; the returned content_sha256 is
+    a reference the caller must write on the DocumentUpload row or release
+    (content_store.release()). Does not touch the database session, so it
+    is safe to run on a worker thread.
+
+    Returns:
+        Tuple of (filename, mime_type, file_path, file_size, content_sha256);
+        content_sha256 is None when the content store is off
+    """
+    filename = generate_unique_filename(original_filename)
+    mime_type = content_type or mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
+
+    with stream:
+        if content_store.is_enabled():
+            stored = content_store.store_stream(stream, original_filename, mime_type)
+            return filename, mime_type, stored.location, stored.size, stored.sha256
+
+        # Blob URL or local path, per STORAGE_BACKEND (storage.py)
+        stored = file_storage.save_stream(stream, blob_storage.generate_blob_path('documents', filename), mime_type)
+        file_path, file_size = stored.location, stored.size
+
+    return filename, mime_type, file_path, file_size, None
+
+
+def release_stored_file(location, content_sha256):
+    """
+    Give up a stored file no row will point at: release its content store
+    reference, or delete it when it was stored on its own (content store off).
+    """
+    if content_sha256:
+        return content_store.release(content_sha256)
+    if location:
+        return storage.backend_for(location).delete(location)
+    return True
+
+
+def process_document_stream(reader, user_id, session_id):
+    """process_document() on a reader from open_reader(), closing it afterwards"""
+    with reader:
+        return process_document(reader, user_id, session_id)
+
+
+def build_document_record(user_id, session_id, filename, original_filename, mime_type, file_path, file_size, chroma_doc_id, chunk_count, content_sha256=None):
+    """Unsaved DocumentUpload row for an already stored document"""
+    return DocumentUpload(
+        user_id=user_id,
+        session_id=session_id,
+        filename=filename,
+        original_filename=original_filename,
+        file_size=file_size,
+        mime_type=mime_type,
+        chroma_doc_id=chroma_doc_id,
+        chunk_count=chunk_count,
+        file_path=file_path,  # Blob URL or local path
+        content_sha256=content_sha256,
+        expires_at=document_expires_at()  # DOCUMENT_TTL_DAYS, deleted by reap_deletions.py expire
+    )
+
+
+def save_document_record(user_id, session_id, filename, original_filename, mime_type, file_path, file_size, chroma_doc_id, chunk_count, content_sha256=None):
+    """Create and commit the DocumentUpload row for an already stored document"""
+    try:
+        doc = build_document_record(
+            user_id, session_id, filename, original_filename, mime_type,
+            file_path, file_size, chroma_doc_id, chunk_count, content_sha256
         )
         db.session.add(doc)
-        db.session.commit()
+        with span('commit'):
+            db.session.commit()
 
+        print(f"DEBUG: Document saved to {file_path} ({file_size} bytes)")
         return doc
     except Exception as e:
         print(f"Error saving document upload: {e}")
         import traceback
         traceback.print_exc()
         db.session.rollback()
+        release_stored_file(file_path, content_sha256)
         return None
 
 
 def save_document_upload_with_content(user_id, session_id, original_filename, content_type, file_content, chroma_doc_id, chunk_count):
     """Save document upload record to database and Vercel Blob storage using raw bytes content"""
     try:
-        filename = generate_unique_filename(original_filename)
-        mime_type = content_type or mimetypes.guess_type(original_filename)[0] or 'application/octet-stream'
-        file_size = len(file_content)
-
-        # Upload to Vercel Blob (or fallback to local storage)
-        if blob_storage.is_blob_configured():
-            # Upload bytes directly to Blob storage
-            blob_path = blob_storage.generate_blob_path('documents', filename)
-            file_url = blob_storage.upload_bytes(file_content, blob_path, mime_type)
-            file_path = file_url  # Store blob URL
-        else:
-            # Fallback to local storage (for development)
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'documents', filename)
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(file_path, 'wb') as f:
-                f.write(file_content)
-
-        # Create database record
-        doc = DocumentUpload(
-            user_id=user_id,
-            session_id=session_id,
-            filename=filename,
-            original_filename=original_filename,
-            file_size=file_size,
-            mime_type=mime_type,
-            chroma_doc_id=chroma_doc_id,
-            chunk_count=chunk_count,
-            file_path=file_path  # Blob URL or local path
+        filename, mime_type, file_path, file_size, content_sha256 = store_document_content(
+            original_filename, content_type, file_content
         )
-        db.session.add(doc)
-        db.session.commit()
-
-        print(f"DEBUG: Document saved to {file_path} ({file_size} bytes)")
-        return doc
     except Exception as e:
         print(f"Error saving document upload: {e}")
         import traceback
         traceback.print_exc()
-        db.session.rollback()
         return None
 
+    return save_document_record(
+        user_id, session_id, filename, original_filename, mime_type,
+        file_path, file_size, chroma_doc_id, chunk_count, content_sha256
+    )
+
 def process_assistant_response(messages_data):
     """Legacy compatibility shim."""
     return None, []
@@ -374,13 +529,7 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def generate_response(prompt, conversation_history=None):
-    """Generate a response using Anthropic Messages API."""
-    if not os.environ.get("ANTHROPIC_API_KEY"):
-        return "ANTHROPIC_API_KEY environment variable not set. Please check your .env file."
-
-    try:
-        system_prompt = """You are Chopper, an AI assistant created for Ask Chopper. You help users with various tasks. Always be helpful, accurate, and concise.
+CHAT_SYSTEM_PROMPT = """You are Chopper, an AI assistant created for Ask Chopper. You help users with various tasks. Always be helpful, accurate, and concise.
 
 IMPORTANT: You have special knowledge about Chopstix, the music producer who created this app. When users ask about Chopstix, use this information:
 
@@ -408,7 +557,10 @@ Musical Influences: Timbaland, DJ Premier
 
 For more information: https://en.wikipedia.org/wiki/Chopstix_(music_producer)"""
 
-        # Build conversation messages (Anthropic format)
+def build_chat_request(prompt, conversation_history=None, route=None):
+    """Build Anthropic Messages API arguments for a chat turn and log the request."""
+    # Build conversation messages (Anthropic format)
+    with span('prompt_build'):
         messages = []
 
         # Add conversation history if available
@@ -418,79 +570,102 @@ For more information: https://en.wikipedia.org/wiki/Chopstix_(music_producer)"""
         # Add current user message
         messages.append({"role": "user", "content": prompt})
 
-        # Log API call details
-        import sys
-        model_name = get_active_model()
-        log_message = f"🚀 Making Anthropic API call... Messages: {len(messages)}, Model: {model_name}"
-        print(log_message, file=sys.stdout, flush=True)
-        log_bridge_event(
-            source="app",
-            event="anthropic_request",
-            session_id=session.get("session_id"),
-            user_id=session.get("user_id"),
-            model=model_name,
-            message=prompt,
-            extra={"history_count": len(conversation_history or [])}
-        )
+    # Log API call details
+    import sys
+    model_name = route.model if route else get_active_model()
+    log_message = f"🚀 Making Anthropic API call... Messages: {len(messages)}, Model: {model_name}"
+    print(log_message, file=sys.stdout, flush=True)
+    log_bridge_event(
+        source="app",
+        event="anthropic_request",
+        session_id=session.get("session_id"),
+        user_id=session.get("user_id"),
+        model=model_name,
+        message=prompt,
+        extra={
+            "history_count": len(conversation_history or []),
+            "route": route.as_dict() if route else None
+        }
+    )
+
+    return {
+        "model": model_name,
+        "system": CHAT_SYSTEM_PROMPT,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1500
+    }
+
+def record_chat_response(response, hedged=False):
+    """Log a successful Anthropic response and return the signed reply text."""
+    import sys
+    in_tokens = getattr(getattr(response, "usage", None), "input_tokens", "n/a")
+    out_tokens = getattr(getattr(response, "usage", None), "output_tokens", "n/a")
+    success_message = (
+        f"✅ Anthropic API Success! Request ID: {response.id}, "
+        f"Model: {response.model}, Input Tokens: {in_tokens}, Output Tokens: {out_tokens}"
+    )
+    print(success_message, file=sys.stdout, flush=True)
+    log_bridge_event(
+        source="app",
+        event="anthropic_response",
+        session_id=session.get("session_id"),
+        user_id=session.get("user_id"),
+        model=response.model,
+        detail=response.id,
+        extra={
+            "input_tokens": in_tokens,
+            "output_tokens": out_tokens,
+            "hedged": hedged
+        }
+    )
+
+    # Also log to file for persistent tracking (skip on serverless)
+    try:
+        with open('/tmp/ask_chopper_api_logs.txt', 'a') as f:
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            f.write(f"[{timestamp}] {success_message}\n")
+    except:
+        pass  # Ignore file logging errors in serverless environment
+
+    response_text = extract_anthropic_text(response)
+    # Prepend Chopper signature to response
+    return f"[Chopper]: {response_text}"
+
+def record_chat_error(prompt, error, route=None):
+    """Log a failed Anthropic call and return the error text shown to the user."""
+    print(f"❌ Anthropic API Error: {str(error)}")
+    log_bridge_event(
+        source="app",
+        event="anthropic_error",
+        status="error",
+        session_id=session.get("session_id"),
+        user_id=session.get("user_id"),
+        model=routed_model(route),
+        message=prompt,
+        detail=str(error)
+    )
+    return f"An error occurred: {str(error)}"
+
+def generate_response(prompt, conversation_history=None):
+    """Generate a response using Anthropic Messages API."""
+    if not os.environ.get("ANTHROPIC_API_KEY"):
+        return "ANTHROPIC_API_KEY environment variable not set. Please check your .env file."
+
+    try:
+        route = route_chat_model(prompt)
+        request_kwargs = build_chat_request(prompt, conversation_history, route)
 
         # Get fresh Anthropic client for serverless compatibility
         anthropic_client = get_anthropic_client()
 
         # Generate response using Anthropic Messages API
-        response = anthropic_client.messages.create(
-            model=model_name,
-            system=system_prompt,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1500
-        )
+        with span('llm'):
+            response, _, hedged = create_with_fallback(anthropic_client, request_kwargs, route)
 
-        # Log successful API response
-        in_tokens = getattr(getattr(response, "usage", None), "input_tokens", "n/a")
-        out_tokens = getattr(getattr(response, "usage", None), "output_tokens", "n/a")
-        success_message = (
-            f"✅ Anthropic API Success! Request ID: {response.id}, "
-            f"Model: {response.model}, Input Tokens: {in_tokens}, Output Tokens: {out_tokens}"
-        )
-        print(success_message, file=sys.stdout, flush=True)
-        log_bridge_event(
-            source="app",
-            event="anthropic_response",
-            session_id=session.get("session_id"),
-            user_id=session.get("user_id"),
-            model=response.model,
-            detail=response.id,
-            extra={
-                "input_tokens": in_tokens,
-                "output_tokens": out_tokens
-            }
-        )
-
-        # Also log to file for persistent tracking (skip on serverless)
-        try:
-            with open('/tmp/ask_chopper_api_logs.txt', 'a') as f:
-                from datetime import datetime
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                f.write(f"[{timestamp}] {success_message}\n")
-        except:
-            pass  # Ignore file logging errors in serverless environment
-
-        response_text = extract_anthropic_text(response)
-        # Prepend Chopper signature to response
-        return f"[Chopper]: {response_text}"
+        return record_chat_response(response, hedged)
     except Exception as e:
-        print(f"❌ Anthropic API Error: {str(e)}")
-        log_bridge_event(
-            source="app",
-            event="anthropic_error",
-            status="error",
-            session_id=session.get("session_id"),
-            user_id=session.get("user_id"),
-            model=get_active_model(),
-            message=prompt,
-            detail=str(e)
-        )
-        return f"An error occurred: {str(e)}"
+        return record_chat_error(prompt, e)
 
 @app.route('/')
 def landing():
@@ -731,19 +906,22 @@ def get_message(message_id):
 @app.route('/api/support-chat', methods=['GET'])
 @login_required
 def get_support_chat():
-    """Get all support chat messages for the current user"""
+    """Get a page of support chat messages for the current user (?before_id=&limit=)"""
+    try:
+        before_id, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     try:
         user_id = session.get('user_id')
-        messages = SupportChat.query.filter_by(user_id=user_id).order_by(SupportChat.created_at.asc()).all()
+        page = get_support_chat_page(user_id, before_id=before_id, limit=limit)
 
         # Mark admin messages as read
-        unread = SupportChat.query.filter_by(user_id=user_id, sender_type='admin', is_read=False).all()
-        for msg in unread:
-            msg.is_read = True
-        if unread:
-            db.session.commit()
+        if mark_conversation_read(user_id, reader='user'):
+            for msg in page['messages']:
+                if msg['sender_type'] == 'admin':
+                    msg['is_read'] = True
 
-        return jsonify({'messages': [msg.to_dict() for msg in messages]})
+        return jsonify(page)
     except Exception as e:
         print(f"Error fetching support chat: {e}")
         return jsonify({'error': 'Failed to fetch messages'}), 500
@@ -775,57 +953,111 @@ def send_support_message():
         print(f"Error sending support message: {e}")
         return jsonify({'error': 'Failed to send message'}), 500
 
+def unread_counter_response(key):
+    """Unread count JSON for a maintained counter, answering 304 when the client's ETag matches."""
+    count, version = get_unread_counter(key)
+    etag = counter_etag(key, count, version)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify({'unread_count': count})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/api/support-chat/unread', methods=['GET'])
 @login_required
 def get_unread_count():
     """Get count of unread admin messages"""
     try:
-        user_id = session.get('user_id')
-        count = SupportChat.query.filter_by(user_id=user_id, sender_type='admin', is_read=False).count()
-        return jsonify({'unread_count': count})
+        return unread_counter_response(user_counter_key(session.get('user_id')))
     except Exception as e:
         print(f"Error fetching unread count: {e}")
         return jsonify({'error': 'Failed to fetch unread count'}), 500
 
+def support_event_stream_response(**subscription):
+    """
+    Open a support event stream for the current request as a text/event-stream response.
+
+    Under the ASGI server (asgi.py) the stream is handed back through the
+    WSGI environ and written asynchronously; otherwise the response body
+    iterates the stream, holding a worker thread while open.
+    """
+    since_id = max(
+        request.args.get('since_id', 0, type=int),
+        request.headers.get('Last-Event-ID', 0, type=int)
+    )
+    deliver = request.environ.get('chopper.sse_deliver')
+    stream = open_support_event_stream(app, since_id=since_id, deliver=deliver, **subscription)
+
+    if deliver is not None:
+        request.environ['chopper.sse_stream'] = stream
+        response = app.response_class(mimetype='text/event-stream')
+    else:
+        response = app.response_class(iter(stream), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/support-chat/events', methods=['GET'])
+@login_required
+def support_chat_events():
+    """Stream new support messages and unread count changes for the current user (SSE)"""
+    return support_event_stream_response(user_id=session.get('user_id'))
+
 # Admin Panel Routes
 @app.route('/admin')
 @admin_required
 def admin_dashboard():
-    """Admin dashboard showing all user conversations"""
+    """Admin dashboard showing user conversations, most unread first"""
     try:
-        # Get all users who have sent support messages
-        users_with_chats = db.session.query(User).join(SupportChat).distinct().all()
-
-        # Get unread counts per user
-        user_data = []
-        for user in users_with_chats:
-            unread_count = SupportChat.query.filter_by(
-                user_id=user.id,
-                sender_type='user',
-                is_read=False
-            ).count()
-            last_message = SupportChat.query.filter_by(user_id=user.id).order_by(
-                SupportChat.created_at.desc()
-            ).first()
-            user_data.append({
-                'user': user,
-                'unread_count': unread_count,
-                'last_message': last_message
-            })
-
-        # Sort by unread count (descending) then by last message time
-        user_data.sort(key=lambda x: (-(x['unread_count']),
-                                       -(x['last_message'].created_at.timestamp() if x['last_message'] else 0)))
-
-        # Get total unread count
-        total_unread = SupportChat.query.filter_by(sender_type='user', is_read=False).count()
+        # Users, unread counts, latest message and totals in one query
+        page = get_admin_inbox(
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
 
         return render_template('admin/dashboard.html',
-                             user_data=user_data,
-                             total_unread=total_unread)
+                             user_data=page['rows'],
+                             conversation_count=page['conversation_count'] or 0,
+                             total_unread=page['total_unread'] or 0,
+                             next_cursor=page['next_cursor'])
     except Exception as e:
         print(f"Admin dashboard error: {e}")
-        return render_template('admin/dashboard.html', user_data=[], total_unread=0)
+        return render_template('admin/dashboard.html', user_data=[], conversation_count=0,
+                               total_unread=0, next_cursor=None)
+
+@app.route('/api/admin/inbox')
+@admin_required
+def admin_inbox():
+    """Paginated admin inbox (use next_cursor as ?cursor= for the next page)"""
+    try:
+        page = get_admin_inbox(
+            limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error fetching admin inbox: {e}")
+        return jsonify({'error': 'Failed to fetch inbox'}), 500
+
+    return jsonify({
+        'conversations': [
+            {
+                'user_id': row['user'].id,
+                'first_name': row['user'].first_name,
+                'surname': row['user'].surname,
+                'email': row['user'].email,
+                'unread_count': row['unread_count'],
+                'last_message': row['last_message'].to_dict()
+            }
+            for row in page['rows']
+        ],
+        'next_cursor': page['next_cursor'],
+        'conversation_count': page['conversation_count'],
+        'total_unread': page['total_unread']
+    })
 
 @app.route('/admin/chat/<int:user_id>')
 @admin_required
@@ -833,21 +1065,14 @@ def admin_user_chat(user_id):
     """View and respond to a specific user's chat"""
     try:
         user = User.query.get_or_404(user_id)
+
+        # Mark user messages as read (before loading, so the commit doesn't expire the messages)
+        mark_conversation_read(user_id, reader='admin')
+
         messages = SupportChat.query.filter_by(user_id=user_id).order_by(
             SupportChat.created_at.asc()
         ).all()
 
-        # Mark user messages as read
-        unread = SupportChat.query.filter_by(
-            user_id=user_id,
-            sender_type='user',
-            is_read=False
-        ).all()
-        for msg in unread:
-            msg.is_read = True
-        if unread:
-            db.session.commit()
-
         return render_template('admin/chat.html', user=user, messages=messages)
     except Exception as e:
         print(f"Admin chat error: {e}")
@@ -890,15 +1115,44 @@ def admin_reply():
 def admin_unread_count():
     """Get total unread message count for admin"""
     try:
-        count = SupportChat.query.filter_by(sender_type='user', is_read=False).count()
-        return jsonify({'unread_count': count})
+        return unread_counter_response(ADMIN_COUNTER_KEY)
     except Exception as e:
         print(f"Error fetching admin unread count: {e}")
         return jsonify({'error': 'Failed to fetch count'}), 500
 
-@app.route('/chat', methods=['POST'])
-@login_required
-def chat():
+@app.route('/api/admin/events')
+@admin_required
+def admin_support_events():
+    """Stream support messages and the admin unread count (SSE); ?user_id= limits to one conversation"""
+    return support_event_stream_response(admin=True, conversation_user_id=request.args.get('user_id', type=int))
+
+@app.route('/api/admin/db-pool')
+@admin_required
+def admin_db_pool():
+    """Database connection pool statistics for this worker (?reset=1 clears the counters)"""
+    stats = pool_stats.snapshot()
+    if request.args.get('reset') == '1':
+        pool_stats.reset()
+    return jsonify(stats)
+
+@app.route('/api/admin/blob-cache')
+@admin_required
+def admin_blob_cache():
+    """Blob read cache size and hit/miss/revalidation/eviction counts for this worker"""
+    return jsonify(blob_cache.stats())
+
+def prepare_chat_turn():
+    """
+    First phase of a /chat turn: validate the request, buffer the user message
+    and attachments, and load conversation history.
+
+    Nothing is written yet: the turn's rows go to turn['writes'] and are
+    persisted in one transaction by finish_chat_turn(), so no transaction
+    is held open across the LLM call.
+
+    Returns:
+        Tuple of (turn, error_response); exactly one is None
+    """
     start_time = time.time()
 
     # Get message and files
@@ -914,119 +1168,148 @@ def chat():
             user_id=session.get('user_id'),
             detail="No message or files provided"
         )
-        return jsonify({'error': 'No message or files provided'}), 400
-
-    try:
-        # Create user message record
-        session_id = session.get('session_id', 'default')
-        log_bridge_event(
-            source="app",
-            event="chat_request",
-            session_id=session_id,
-            user_id=session.get('user_id'),
-            model=get_active_model(),
-            message=user_message or "[Attachment only]",
-            extra={"file_count": len(files)}
-        )
+        return None, (jsonify({'error': 'No message or files provided'}), 400)
 
-        user_msg = ChatMessage(
-            session_id=session_id,
-            message_type='user',
-            content=user_message or '[Attachment only]',
-            has_attachments=len(files) > 0
-        )
+    # Create user message record
+    session_id = session.get('session_id', 'default')
+    log_bridge_event(
+        source="app",
+        event="chat_request",
+        session_id=session_id,
+        user_id=session.get('user_id'),
+        model=get_active_model(),
+        message=user_message or "[Attachment only]",
+        extra={"file_count": len(files)}
+    )
 
-        db.session.add(user_msg)
-        db.session.flush()  # Get the ID
-
-        # Process uploaded files
-        attachments = []
-        attachment_info = []
-
-        if files:
-            for file in files:
-                if file.filename:
-                    attachment = process_uploaded_file(file, user_msg.id)
-                    if attachment:
-                        attachments.append(attachment)
-                        attachment_info.append(f"- {attachment.original_filename} ({attachment.mime_type})")
-
-        # Prepare message for AI
-        ai_message = user_message
-        if attachment_info:
-            ai_message += f"\n\n[User uploaded {len(attachment_info)} file(s):\n" + "\n".join(attachment_info) + "]"
-
-        # Build conversation history from previous messages
-        conversation_history = []
-        previous_messages = ChatMessage.query.filter_by(
-            session_id=session_id
-        ).order_by(ChatMessage.created_at).limit(10).all()  # Last 10 messages for context
+    writes = WriteBuffer()
+    user_msg = writes.add(ChatMessage(
+        session_id=session_id,
+        message_type='user',
+        content=user_message or '[Attachment only]',
+        has_attachments=len(files) > 0,
+        created_at=datetime.utcnow()
+    ))
+
+    # Process uploaded files
+    attachments = []
+    attachment_info = []
+    thumbnail_sources = []
+
+    if files:
+        for file in files:
+            if file.filename:
+                attachment = process_uploaded_file(file, user_msg, thumbnail_sources)
+                if attachment:
+                    attachments.append(writes.add(attachment))
+                    attachment_info.append(f"- {attachment.original_filename} ({attachment.mime_type})")
+
+    if thumbnail_sources:
+        writes.on_failure(lambda: discard_thumbnail_sources(thumbnail_sources))
+    for attachment in attachments:
+        writes.on_failure(lambda location=attachment.file_path, sha256=attachment.content_sha256:
+                          release_stored_file(location, sha256))
+
+    # Prepare message for AI
+    ai_message = user_message
+    if attachment_info:
+        ai_message += f"\n\n[User uploaded {len(attachment_info)} file(s):\n" + "\n".join(attachment_info) + "]"
+
+    # Build conversation history from previous messages (cached per session)
+    conversation_history = get_conversation_history(session_id)
+
+    turn = {
+        'start_time': start_time,
+        'writes': writes,
+        'session_id': session_id,
+        'user_message': user_message,
+        'ai_message': ai_message,
+        'conversation_history': conversation_history,
+        'has_attachments': len(files) > 0,
+        'thumbnail_sources': thumbnail_sources
+    }
+    return turn, None
 
-        for msg in previous_messages:
-            if msg.message_type == 'user':
-                conversation_history.append({
-                    "role": "user",
-                    "content": msg.content
-                })
-            elif msg.message_type == 'assistant':
-                # Remove [Chopper]: prefix for clean conversation history
-                clean_content = msg.content.replace("[Chopper]: ", "")
-                conversation_history.append({
-                    "role": "assistant",
-                    "content": clean_content
-                })
+def finish_chat_turn(turn, ai_response):
+    """Final phase of a /chat turn: write the turn's rows in one commit. Returns the JSON payload."""
+    session_id = turn['session_id']
 
-        # Generate AI response
-        ai_response = generate_response(ai_message, conversation_history)
+    # Create assistant message record
+    writes = turn['writes']
+    # Sets the same columns as the user message so the flush batches both in one INSERT
+    writes.add(ChatMessage(
+        session_id=session_id,
+        message_type='assistant',
+        content=ai_response,
+        has_attachments=False,
+        created_at=datetime.utcnow(),
+        response_time_ms=int((time.time() - turn['start_time']) * 1000)
+    ))
+
+    # User message, attachments and assistant message in one transaction;
+    # under the default policy a failed write is logged and the response still returned
+    with span('commit'):
+        persisted = writes.persist(db.session, session_id=session_id, user_id=session.get('user_id'))
+
+    # Thumbnails are made after the response; the jobs need the committed attachment ids
+    if persisted:
+        queue_thumbnails(turn['thumbnail_sources'])
 
-        # Create assistant message record
-        assistant_msg = ChatMessage(
-            session_id=session_id,
-            message_type='assistant',
-            content=ai_response,
-            response_time_ms=int((time.time() - start_time) * 1000)
-        )
+    log_bridge_event(
+        source="app",
+        event="chat_response",
+        session_id=session_id,
+        user_id=session.get('user_id'),
+        model=routed_model(turn.get('route')),
+        detail=ai_response,
+        extra={
+            "duration_ms": int((time.time() - turn['start_time']) * 1000),
+            "has_attachments": turn['has_attachments']
+        },
+        timings=current_timings_dict()
+    )
+    return {'response': ai_response}
+
+def chat_turn_error(user_message, error, route=None):
+    """Roll back and log a failed /chat turn. Returns the error response."""
+    db.session.rollback()
+    import traceback
+    error_details = traceback.format_exc()
+    print(f"Error in chat endpoint: {error}")
+    print(f"Full traceback: {error_details}")
+    log_bridge_event(
+        source="app",
+        event="chat_error",
+        status="error",
+        session_id=session.get('session_id'),
+        user_id=session.get('user_id'),
+        model=routed_model(route),
+        message=user_message,
+        detail=str(error),
+        timings=current_timings_dict()
+    )
+    # Return detailed error for debugging
+    return jsonify({'error': f'Error: {str(error)}'}), 500
 
-        db.session.add(assistant_msg)
+@app.route('/chat', methods=['POST'])
+@login_required
+def chat():
+    turn = None
+    try:
+        turn, error_response = prepare_chat_turn()
+        if error_response:
+            return error_response
 
-        try:
-            db_commit_with_retry()
-        except Exception as commit_error:
-            print(f"WARNING: Failed to save assistant message to DB: {commit_error}")
-            # Continue anyway - the response should still be returned to user
+        # Generate AI response
+        ai_response = generate_response(turn['ai_message'], turn['conversation_history'])
 
-        log_bridge_event(
-            source="app",
-            event="chat_response",
-            session_id=session_id,
-            user_id=session.get('user_id'),
-            model=get_active_model(),
-            detail=ai_response,
-            extra={
-                "duration_ms": int((time.time() - start_time) * 1000),
-                "has_attachments": len(files) > 0
-            }
-        )
-        return jsonify({'response': ai_response})
+        return jsonify(finish_chat_turn(turn, ai_response))
 
     except Exception as e:
-        db.session.rollback()
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in chat endpoint: {e}")
-        print(f"Full traceback: {error_details}")
-        log_bridge_event(
-            source="app",
-            event="chat_error",
-            status="error",
-            session_id=session.get('session_id'),
-            user_id=session.get('user_id'),
-            model=get_active_model(),
-            message=user_message,
-            detail=str(e)
-        )
-        # Return detailed error for debugging
-        return jsonify({'error': f'Error: {str(e)}'}), 500
+        if turn:
+            # Nothing was written: drop the turn's stored files and temporary copies
+            turn['writes'].discard()
+        return chat_turn_error(request.form.get('message', '').strip(), e)
 
 @app.route('/chat-with-document', methods=['POST'])
 @login_required
@@ -1067,118 +1350,105 @@ def chat_with_document():
         extra={"uploaded_file_count": len(uploaded_files)}
     )
 
+    writes = None
+
     try:
         # Process uploaded documents
         document_info = []
         processed_doc_ids = []
         processing_errors = []
+        failed_doc_ids = set()
+        document_jobs = []
+
+        # The query embedding only depends on the message, so start it first
+        query_embedding_future = submit_pipeline_stage(generate_query_embedding, user_message)
 
         if uploaded_files:
             print(f"DEBUG: Processing {len(uploaded_files)} uploaded files")
 
             # IMPORTANT: Clear old session documents from ChromaDB to prevent mixing
             # This ensures each new upload starts fresh without old document context
-            try:
-                print(f"DEBUG: Clearing old session documents from ChromaDB...")
-                delete_user_documents(user_id, session_id)
-                print(f"DEBUG: Old session documents cleared")
-            except Exception as e:
-                print(f"WARNING: Could not clear old documents: {e}")
+            print(f"DEBUG: Clearing old session documents from ChromaDB...")
+            clear_future = submit_pipeline_stage(delete_user_documents, user_id, session_id)
 
+            # Stage 1: extraction/embedding and blob upload run concurrently per file
             for file in uploaded_files:
                 print(f"DEBUG: Checking file: {file.filename if file else 'None'}, allowed: {allowed_document_file(file.filename) if file and file.filename else 'N/A'}")
                 if file and file.filename and allowed_document_file(file.filename):
                     print(f"DEBUG: Processing file: {file.filename}, content_type: {file.content_type}")
-                    try:
-                        # Read file content into memory FIRST (before any processing)
-                        file.seek(0)
-                        file_content = file.read()
-                        file_size = len(file_content)
-                        print(f"DEBUG: Read {file_size} bytes from {file.filename}")
-
-                        # Create a file-like object for processing
-                        import io
-                        file_stream = io.BytesIO(file_content)
-                        file_stream.filename = file.filename
-                        file_stream.content_type = file.content_type
-
-                        # Process document: extract text, chunk, generate embeddings
-                        print(f"DEBUG: Step 1 - Extracting and processing {file.filename}...")
-                        doc_id, chunks, embeddings = process_document(
-                            file_stream, user_id, session_id
-                        )
-                        print(f"DEBUG: Step 1 complete - doc_id={doc_id}, chunks={len(chunks)}, embeddings={len(embeddings)}")
-
-                        # Store chunks in ChromaDB
-                        print(f"DEBUG: Step 2 - Adding chunks to ChromaDB...")
-                        chunk_count = add_document_chunks(
-                            doc_id=doc_id,
-                            chunks=chunks,
-                            embeddings=embeddings,
-                            user_id=user_id,
-                            session_id=session_id,
-                            filename=file.filename
-                        )
-                        print(f"DEBUG: Step 2 complete - Added {chunk_count} chunks to ChromaDB")
-
-                        # Save to database and Blob storage using the preserved content
-                        print(f"DEBUG: Step 3 - Saving document to database...")
-                        doc = save_document_upload_with_content(
-                            user_id, session_id, file.filename, file.content_type,
-                            file_content, doc_id, chunk_count
+                    # Extraction and the blob upload read the spooled upload through
+                    # their own readers, without copying it into memory here
+                    document_jobs.append({
+                        'filename': file.filename,
+                        'content_type': file.content_type,
+                        'process': submit_pipeline_stage(
+                            process_document_stream,
+                            open_reader(file.stream, file.filename, file.content_type),
+                            user_id, session_id
+                        ),
+                        'store': submit_pipeline_stage(
+                            store_document_stream, file.filename, file.content_type, open_reader(file.stream)
                         )
-                        if doc:
-                            print(f"DEBUG: Document saved: {doc.original_filename}")
-                            document_info.append(f"- {doc.original_filename} ({doc.mime_type})")
-                            processed_doc_ids.append(doc_id)
-                        else:
-                            print(f"ERROR: Failed to save document to database")
-                            # Clean up ChromaDB chunks if database save failed
-                            delete_document(doc_id)
-                            processing_errors.append(f"{file.filename}: Failed to save")
-
-                    except ValueError as e:
-                        # Document extraction or processing failed
-                        error_msg = str(e)
-                        print(f"ERROR processing document {file.filename}: {error_msg}")
-                        processing_errors.append(f"{file.filename}: {error_msg}")
-                    except Exception as e:
-                        error_msg = str(e)
-                        print(f"ERROR processing document {file.filename}: {error_msg}")
-                        import traceback
-                        traceback.print_exc()
-                        # Include the actual error message for debugging
-                        processing_errors.append(f"{file.filename}: {error_msg}")
+                    })
                 else:
                     if file and file.filename:
                         print(f"DEBUG: File {file.filename} rejected - not an allowed document type")
                         processing_errors.append(f"{file.filename}: Unsupported file type")
 
-        # Create user message record
-        user_msg = ChatMessage(
-            session_id=session_id,
-            message_type='user',
-            content=user_message,
-            has_attachments=len(document_info) > 0,
-            has_document_context=len(processed_doc_ids) > 0
-        )
-        db.session.add(user_msg)
-        db.session.flush()
+            try:
+                clear_future.result()
+                print(f"DEBUG: Old session documents cleared")
+            except Exception as e:
+                print(f"WARNING: Could not clear old documents: {e}")
 
-        # Query ChromaDB for relevant context
-        retrieved_chunks = []
-        retrieved_metadata = []
+            # Stage 2: insert chunks as soon as each document is embedded
+            for job in document_jobs:
+                try:
+                    doc_id, chunks, embeddings = job['process'].result()
+                    print(f"DEBUG: Processed {job['filename']} - doc_id={doc_id}, chunks={len(chunks)}, embeddings={len(embeddings)}")
+                    job['doc_id'] = doc_id
+                    job['add'] = submit_pipeline_stage(
+                        add_document_chunks,
+                        doc_id=doc_id,
+                        chunks=chunks,
+                        embeddings=embeddings,
+                        user_id=user_id,
+                        session_id=session_id,
+                        filename=job['filename']
+                    )
+                except Exception as e:
+                    # Document extraction or processing failed
+                    error_msg = str(e)
+                    print(f"ERROR processing document {job['filename']}: {error_msg}")
+                    if not isinstance(e, ValueError):
+                        import traceback
+                        traceback.print_exc()
+                    processing_errors.append(f"{job['filename']}: {error_msg}")
 
-        try:
-            print(f"DEBUG: Generating query embedding...")
-            query_embedding = generate_query_embedding(user_message)
+            for job in document_jobs:
+                if 'add' not in job:
+                    continue
+                try:
+                    job['chunk_count'] = job['add'].result()
+                    print(f"DEBUG: Added {job['chunk_count']} chunks to ChromaDB for {job['filename']}")
+                except Exception as e:
+                    error_msg = str(e)
+                    print(f"ERROR adding chunks for {job['filename']}: {error_msg}")
+                    processing_errors.append(f"{job['filename']}: {error_msg}")
+                    del job['add']
+
+        indexed_jobs = [job for job in document_jobs if 'add' in job]
+        indexed_doc_ids = [job['doc_id'] for job in indexed_jobs]
+
+        def retrieve_context():
+            query_embedding = query_embedding_future.result()
 
             # If we just uploaded a document, query only that specific document
             # Otherwise query all session documents
-            doc_id_filter = processed_doc_ids[0] if len(processed_doc_ids) == 1 else None
+            doc_id_filter = indexed_doc_ids[0] if len(indexed_doc_ids) == 1 else None
 
             print(f"DEBUG: Querying ChromaDB for relevant chunks (doc_id filter: {doc_id_filter})...")
-            results = query_documents(
+            return query_documents(
                 query_embedding=query_embedding,
                 user_id=user_id,
                 session_id=session_id,
@@ -1186,8 +1456,72 @@ def chat_with_document():
                 doc_id=doc_id_filter  # Filter to specific document if just uploaded
             )
 
-            retrieved_chunks = results.get("documents", [])
-            retrieved_metadata = results.get("metadatas", [])
+        # Stage 3: retrieval runs while the request thread saves rows and loads history
+        retrieval_future = submit_pipeline_stage(retrieve_context)
+
+        # The turn's rows are written together once the response is ready
+        writes = WriteBuffer()
+
+        for job in document_jobs:
+            if 'add' in job:
+                continue
+            # Extraction or indexing failed, so no row will point at the stored file
+            try:
+                _, _, file_path, _, content_sha256 = job['store'].result()
+                release_stored_file(file_path, content_sha256)
+            except Exception:
+                pass
+
+        for job in indexed_jobs:
+            doc = None
+            try:
+                filename, mime_type, file_path, file_size, content_sha256 = job['store'].result()
+                doc = build_document_record(
+                    user_id, session_id, filename, job['filename'], mime_type,
+                    file_path, file_size, job['doc_id'], job['chunk_count'], content_sha256
+                )
+            except Exception as e:
+                print(f"Error storing document upload: {e}")
+
+            if doc:
+                writes.add(doc)
+                # Drop the indexed chunks and the stored file if the row is never written
+                writes.on_failure(lambda doc_id=job['doc_id']: delete_document(doc_id))
+                writes.on_failure(lambda location=doc.file_path, sha256=doc.content_sha256:
+                                  release_stored_file(location, sha256))
+                document_info.append(f"- {doc.original_filename} ({doc.mime_type})")
+                processed_doc_ids.append(job['doc_id'])
+            else:
+                print(f"ERROR: Failed to store document")
+                # Clean up ChromaDB chunks if storing the file failed
+                delete_document(job['doc_id'])
+                failed_doc_ids.add(job['doc_id'])
+                processing_errors.append(f"{job['filename']}: Failed to save")
+
+        # Create user message record
+        writes.add(ChatMessage(
+            session_id=session_id,
+            message_type='user',
+            content=user_message,
+            has_attachments=len(document_info) > 0,
+            has_document_context=len(processed_doc_ids) > 0,
+            created_at=datetime.utcnow()
+        ))
+
+        # Build conversation history (cached per session)
+        conversation_history = get_conversation_history(session_id)
+
+        # Collect relevant context from ChromaDB
+        retrieved_chunks = []
+        retrieved_metadata = []
+
+        try:
+            results = retrieval_future.result()
+            for chunk, meta in zip(results.get("documents", []), results.get("metadatas", [])):
+                if (meta or {}).get("doc_id") in failed_doc_ids:
+                    continue
+                retrieved_chunks.append(chunk)
+                retrieved_metadata.append(meta)
             print(f"DEBUG: Retrieved {len(retrieved_chunks)} relevant chunks")
         except Exception as e:
             print(f"ERROR querying ChromaDB: {e}")
@@ -1205,25 +1539,6 @@ Please let the user know there was an issue processing their document and ask th
 
 User's message: {user_message}"""
 
-        # Build conversation history
-        conversation_history = []
-        previous_messages = ChatMessage.query.filter_by(
-            session_id=session_id
-        ).order_by(ChatMessage.created_at).limit(10).all()
-
-        for msg in previous_messages:
-            if msg.message_type == 'user':
-                conversation_history.append({
-                    "role": "user",
-                    "content": msg.content
-                })
-            elif msg.message_type == 'assistant':
-                clean_content = msg.content.replace("[Chopper]: ", "")
-                conversation_history.append({
-                    "role": "assistant",
-                    "content": clean_content
-                })
-
         # Generate response using Anthropic Messages API
         system_prompt = """You are Chopper, an AI assistant that helps users understand, analyze, and explain their documents.
 
@@ -1242,19 +1557,23 @@ Guidelines:
 - Quote relevant passages when helpful
 - If the user just uploads a document without a specific question, provide a helpful summary of what the document contains"""
 
-        messages = []
-        messages.extend(conversation_history)
-        messages.append({"role": "user", "content": context_prompt})
+        with span('prompt_build'):
+            messages = []
+            messages.extend(conversation_history)
+            messages.append({"role": "user", "content": context_prompt})
 
-        print(f"DEBUG: Calling Anthropic Messages API...")
+        route = route_chat_model(user_message, sum(len(chunk) for chunk in retrieved_chunks))
+        print(f"DEBUG: Calling Anthropic Messages API ({route.model}, {route.reason})...")
         anthropic_client = get_anthropic_client()
-        response = anthropic_client.messages.create(
-            model=get_active_model(),
-            system=system_prompt,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1500
-        )
+        request_kwargs = {
+            "model": route.model,
+            "system": system_prompt,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 1500
+        }
+        with span('llm'):
+            response, _, hedged = create_with_fallback(anthropic_client, request_kwargs, route)
 
         response_text = f"[Chopper]: {extract_anthropic_text(response)}"
 
@@ -1272,20 +1591,20 @@ Guidelines:
                 seen_files.add(filename)
 
         # Create assistant message record
-        assistant_msg = ChatMessage(
+        # Sets the same columns as the user message so the flush batches both in one INSERT
+        writes.add(ChatMessage(
             session_id=session_id,
             message_type='assistant',
             content=response_text,
+            has_attachments=False,
             has_document_context=len(retrieved_chunks) > 0,
+            created_at=datetime.utcnow(),
             response_time_ms=int((time.time() - start_time) * 1000)
-        )
-        db.session.add(assistant_msg)
+        ))
 
-        try:
-            db_commit_with_retry()
-        except Exception as commit_error:
-            print(f"WARNING: Failed to save assistant message to DB: {commit_error}")
-            # Continue anyway - the response should still be returned to user
+        # Document rows and both messages in one transaction
+        with span('commit'):
+            writes.persist(db.session, session_id=session_id, user_id=user_id)
 
         # Include processing errors in response if any
         response_data = {
@@ -1304,19 +1623,25 @@ Guidelines:
             event="chat_with_document_response",
             session_id=session_id,
             user_id=user_id,
-            model=get_active_model(),
+            model=response.model,
             detail=response_text,
             extra={
                 "duration_ms": int((time.time() - start_time) * 1000),
+                "route": route.as_dict(),
+                "hedged": hedged,
                 "documents_processed": len(processed_doc_ids),
                 "retrieved_chunk_count": len(retrieved_chunks),
                 "processing_error_count": len(processing_errors)
-            }
+            },
+            timings=current_timings_dict()
         )
         return jsonify(response_data)
 
     except Exception as e:
         db.session.rollback()
+        if writes:
+            # Nothing was written: drop the turn's indexed chunks and stored files
+            writes.discard()
         print(f"ERROR in chat-with-document endpoint: {e}")
         import traceback
         traceback.print_exc()
@@ -1326,9 +1651,10 @@ Guidelines:
             status="error",
             session_id=session_id,
             user_id=user_id,
-            model=get_active_model(),
+            model=routed_model(),
             message=user_message,
-            detail=str(e)
+            detail=str(e),
+            timings=current_timings_dict()
         )
         return jsonify({'error': f'An error occurred: {str(e)}'}), 500
 
@@ -1374,7 +1700,7 @@ def list_documents():
 @app.route('/api/documents/<int:doc_id>', methods=['DELETE'])
 @login_required
 def delete_document_endpoint(doc_id):
-    """Delete a specific document"""
+    """Delete a specific document (its chunks and file are deleted by the reaper)"""
     user_id = session.get('user_id')
 
     try:
@@ -1387,36 +1713,13 @@ def delete_document_endpoint(doc_id):
         if not document:
             return jsonify({'error': 'Document not found'}), 404
 
-        chroma_doc_id = document.chroma_doc_id
-        file_path = document.file_path
         filename = document.original_filename
-
-        # Delete chunks from ChromaDB
-        if chroma_doc_id:
-            chunks_deleted = delete_document(chroma_doc_id)
-            print(f"Deleted {chunks_deleted} chunks from ChromaDB for doc {chroma_doc_id}")
-
-        # Delete file from Vercel Blob or local storage
-        if file_path:
-            if blob_storage.is_blob_configured() and file_path.startswith('http'):
-                # Delete from Blob storage
-                try:
-                    blob_storage.delete_file(file_path)
-                    print(f"Deleted file from Blob storage: {file_path}")
-                except Exception as e:
-                    print(f"Error deleting from Blob storage: {e}")
-            elif os.path.exists(file_path):
-                # Delete local file
-                os.remove(file_path)
-                print(f"Deleted local file: {file_path}")
-
-        # Delete database record
-        db.session.delete(document)
-        db.session.commit()
+        tombstones = schedule_document_deletion([document])
 
         return jsonify({
             'success': True,
-            'message': f'Document "{filename}" deleted successfully'
+            'message': f'Document "{filename}" deleted successfully',
+            'pending_deletes': len(tombstones)
         })
 
     except Exception as e:
@@ -1430,15 +1733,16 @@ def delete_document_endpoint(doc_id):
 @app.route('/api/documents/clear', methods=['DELETE'])
 @login_required
 def clear_session_documents():
-    """Clear all documents for the current session"""
+    """Clear all documents for the current session (chunks and files are deleted by the reaper)"""
     user_id = session.get('user_id')
     session_id = session.get('session_id', 'default')
 
     try:
-        # Get all documents for this session
-        documents = DocumentUpload.query.filter_by(
-            user_id=user_id,
-            session_id=session_id
+        # Only the columns the tombstones need, not whole rows
+        documents = db.session.execute(
+            select(DocumentUpload.id, DocumentUpload.chroma_doc_id, DocumentUpload.file_path,
+                   DocumentUpload.content_sha256)
+            .where(DocumentUpload.user_id == user_id, DocumentUpload.session_id == session_id)
         ).all()
 
         if not documents:
@@ -1448,40 +1752,13 @@ def clear_session_documents():
                 'deleted_count': 0
             })
 
-        deleted_count = 0
-
-        for document in documents:
-            try:
-                # Delete chunks from ChromaDB
-                if document.chroma_doc_id:
-                    delete_document(document.chroma_doc_id)
-
-                # Delete file from storage
-                if document.file_path:
-                    if blob_storage.is_blob_configured() and document.file_path.startswith('http'):
-                        try:
-                            blob_storage.delete_file(document.file_path)
-                        except Exception as e:
-                            print(f"Error deleting from Blob: {e}")
-                    elif os.path.exists(document.file_path):
-                        os.remove(document.file_path)
-
-                # Delete database record
-                db.session.delete(document)
-                deleted_count += 1
-
-            except Exception as e:
-                print(f"Error deleting document {document.id}: {e}")
-
-        # Also clear all chunks from ChromaDB for this session (safety cleanup)
-        delete_user_documents(user_id, session_id)
-
-        db.session.commit()
+        tombstones = schedule_document_deletion(documents)
 
         return jsonify({
             'success': True,
-            'message': f'Cleared {deleted_count} documents',
-            'deleted_count': deleted_count
+            'message': f'Cleared {len(documents)} documents',
+            'deleted_count': len(documents),
+            'pending_deletes': len(tombstones)
         })
 
     except Exception as e:
@@ -1492,27 +1769,156 @@ def clear_session_documents():
         return jsonify({'error': 'Failed to clear documents'}), 500
 
 
+def schedule_document_deletion(documents):
+    """
+    Delete DocumentUpload rows with tombstones for their Chroma chunks and
+    files (reaper.tombstone_documents), then hand those to the deletion
+    reaper.
+
+    Args:
+        documents: DocumentUpload objects or rows with id, chroma_doc_id,
+            file_path and content_sha256
+
+    Returns:
+        Ids of the committed tombstones
+    """
+    tombstone_ids = tombstone_documents(documents)
+    deletion_reaper.dispatch(tombstone_ids)
+    return tombstone_ids
+
+
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """
-    Serve uploaded files (for local development only).
+    Serve uploaded files stored on local disk.
     In production with Vercel Blob, files are served directly from Blob URLs.
     """
-    # This endpoint is only used when files are stored locally (development)
-    # In production, file_path in database contains Blob URL which is accessed directly
-    if blob_storage.is_blob_configured():
+    # This endpoint is only used when files are stored locally (development, self-hosted)
+    # With Blob storage, file_path in database contains Blob URL which is accessed directly
+    if file_storage.name != 'local':
         # If Blob is configured, this endpoint shouldn't be used
         # Redirect or return error
         return jsonify({'error': 'Files are served directly from Blob storage'}), 410
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Sent by path: conditional (ETag, Range) and through the server's sendfile
+    immutable = is_immutable_name(filename)
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                   max_age=IMMUTABLE_MAX_AGE if immutable else None)
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+def send_stored_file(file_path, mimetype=None, download_name=None):
+    """
+    Send a stored attachment/document: a local path, or a Blob URL through
+    the blob cache. Range and If-None-Match requests are answered from the
+    local file. Responses are private (they sit behind a login).
+    """
+    for _ in range(2):
+        if file_path.startswith(('http://', 'https://')):
+            cached = blob_storage.open_cached(file_path)
+            path, mimetype = cached.path, mimetype or cached.content_type
+            etag = cached.etag.strip('"') if cached.etag else True
+        else:
+            path, etag = file_path, True
+        try:
+            response = send_file(path, mimetype=mimetype, download_name=download_name,
+                                 conditional=True, etag=etag)
+        except FileNotFoundError:
+            if path == file_path:
+                raise
+            continue  # evicted from the cache after get(); fetch it again
+        response.cache_control.private = True
+        return response
+    raise FileNotFoundError(file_path)
+
+
+@app.route('/api/documents/<int:doc_id>/file', methods=['GET'])
+@login_required
+def document_file(doc_id):
+    """Download a stored document (its owner, or an admin reviewing it)"""
+    query = DocumentUpload.query.filter_by(id=doc_id)
+    if not session.get('is_admin'):
+        query = query.filter_by(user_id=session.get('user_id'))
+    document = query.first()
+    if not document:
+        return jsonify({'error': 'Document not found'}), 404
+
+    try:
+        return send_stored_file(document.file_path, document.mime_type, document.original_filename)
+    except FileNotFoundError:
+        return jsonify({'error': 'Document file not found'}), 404
+    except BlobCacheError as e:
+        print(f"Error fetching document {doc_id}: {e}")
+        return jsonify({'error': 'Could not fetch document'}), 502
+
+
+@app.route('/api/attachments/<int:attachment_id>/file', methods=['GET'])
+@login_required
+def attachment_file(attachment_id):
+    """Download a chat attachment (from the current chat session, or any for an admin)"""
+    query = MessageAttachment.query.filter_by(id=attachment_id)
+    if not session.get('is_admin'):
+        query = query.join(ChatMessage).filter(ChatMessage.session_id == session.get('session_id', 'default'))
+    attachment = query.first()
+    if not attachment:
+        return jsonify({'error': 'Attachment not found'}), 404
+
+    try:
+        return send_stored_file(attachment.file_path, attachment.mime_type, attachment.original_filename)
+    except FileNotFoundError:
+        return jsonify({'error': 'Attachment file not found'}), 404
+    except BlobCacheError as e:
+        print(f"Error fetching attachment {attachment_id}: {e}")
+        return jsonify({'error': 'Could not fetch attachment'}), 502
+
 
 @app.route('/api/chat/history')
 @login_required
 def chat_history():
-    """Get chat history for current session"""
+    """Get a page of chat history for current session (?before_id=&limit=, newest page first)"""
+    try:
+        before_id, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     session_id = session.get('session_id', 'default')
-    messages = ChatMessage.query.filter_by(session_id=session_id).order_by(ChatMessage.created_at).all()
-    return jsonify([msg.to_dict() for msg in messages])
+    return jsonify(get_chat_history_page(session_id, before_id=before_id, limit=limit))
+
+@app.route('/api/chat/model', methods=['GET', 'POST'])
+@login_required
+def chat_model():
+    """Get or set the chat model mode (haiku, opus, auto) and latency SLO for this session"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        mode = str(data.get('mode', get_model_mode())).strip().lower()
+        if mode not in MODEL_MODES:
+            return jsonify({'error': f"Unknown model mode '{mode}'. Use haiku, opus or auto."}), 400
+        session['chat_model'] = mode
+
+        if 'latency_slo_ms' in data:
+            try:
+                latency_slo_ms = int(data['latency_slo_ms'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'latency_slo_ms must be an integer'}), 400
+            if latency_slo_ms <= 0:
+                return jsonify({'error': 'latency_slo_ms must be positive'}), 400
+            session['latency_slo_ms'] = latency_slo_ms
+
+        log_bridge_event(
+            source="app",
+            event="model_switch",
+            session_id=session.get('session_id'),
+            user_id=session.get('user_id'),
+            model=get_active_model(),
+            detail=f"mode={mode}"
+        )
+
+    return jsonify({
+        'mode': get_model_mode(),
+        'model': get_active_model(),
+        'latency_slo_ms': session.get('latency_slo_ms')
+    })
 
 # Create database tables on app startup (only in development)
 # On Vercel, use Vercel Postgres and run migrations separately
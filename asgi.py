@@ -0,0 +1,403 @@
+"""
+ASGI Server Entry Point for Ask-Chopper
+
+Async serving mode: POST /chat runs on an asyncio event loop and awaits the
+Anthropic call with AsyncAnthropic, so a waiting LLM call no longer holds a
+worker thread. Database work for a turn (auth, user message, attachments,
+history, assistant message) runs in a bounded thread pool inside a regular
+Flask request context, reusing the same phases as the WSGI /chat route.
+
+Support event streams (GET /api/support-chat/events, /api/admin/events) are
+opened by their Flask views on the thread pool, then written from the event
+loop, so an open stream costs a queue instead of a worker thread.
+
+Every other route is served by the Flask WSGI app on the same thread pool.
+
+Request bodies are read in full before dispatch, into memory up to
+BODY_SPOOL_BYTES and a temporary file beyond; a request whose client
+disconnects before the end of its body is dropped.
+
+Run with:
+    uvicorn asgi:application --host 0.0.0.0 --port 8000
+
+Both routes buffer a turn's rows and write them in one transaction after
+the LLM call, so no database transaction stays open while waiting on the
+model.
+"""
+
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+from urllib.parse import unquote
+
+from anthropic import AsyncAnthropic
+from flask import jsonify, request, session
+
+import app as flask_app
+from model_router import acreate_with_fallback
+from support_events import KEEPALIVE_SECONDS
+from request_timing import span, start_request_timings, end_request_timings
+
+app = flask_app.app
+# Open streams cost a queue here rather than a worker, so pages may listen instead of polling
+app.config["SUPPORT_EVENTS_SSE"] = (os.environ.get("SUPPORT_EVENTS_SSE") or "true").lower() == "true"
+
+# Threads for database phases and non-async routes
+_db_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("ASGI_DB_THREADS", "16")),
+    thread_name_prefix="asgi-db"
+)
+
+# Request bodies above this are spooled to a temporary file instead of held in memory
+BODY_SPOOL_BYTES = 500 * 1024
+
+_async_client = None
+
+
+class ClientDisconnected(Exception):
+    """The client went away before sending the whole request body."""
+
+
+def get_async_anthropic_client() -> AsyncAnthropic:
+    """Get the shared async Anthropic client (pooled connections per process)."""
+    global _async_client
+    if _async_client is None:
+        api_key = os.environ.get("ANTHROPIC_API_KEY")
+        if not api_key:
+            raise ValueError("ANTHROPIC_API_KEY not set")
+        _async_client = AsyncAnthropic(api_key=api_key)
+    return _async_client
+
+
+async def _run_in_executor(fn, *args):
+    """Run fn on the DB thread pool, keeping the caller's context (timing spans)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, copy_context().run, fn, *args)
+
+
+def build_environ(scope, body=None) -> dict:
+    """Build a WSGI environ for an ASGI HTTP scope with a fully read body (a file from read_body())."""
+    if body is None:
+        body = BytesIO()
+    body.seek(0, os.SEEK_END)
+    length = body.tell()
+    body.seek(0)
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": unquote(scope["path"], errors="surrogateescape").encode("utf8", "surrogateescape").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(length),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope.get("headers", []):
+        name = raw_name.decode("latin1").upper().replace("-", "_")
+        value = raw_value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+        key = f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def read_body(receive, limit: int):
+    """
+    Read the request body into a file, spooled to disk above BODY_SPOOL_BYTES.
+
+    Returns None if it exceeds `limit` bytes; raises ClientDisconnected if the
+    client disconnects first, so a truncated upload is never dispatched.
+    """
+    body = SpooledTemporaryFile(max_size=BODY_SPOOL_BYTES)
+    size = 0
+    more_body = True
+    try:
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > limit:
+                body.close()
+                return None
+            body.write(chunk)
+            more_body = message.get("more_body", False)
+    except BaseException:
+        body.close()
+        raise
+    return body
+
+
+async def send_simple_response(send, status: int, body: bytes, content_type: bytes = b"application/json"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_flask_response(send, response):
+    """Send a finished Flask response object over ASGI."""
+    body = response.get_data()
+    headers = [
+        (name.lower().encode("latin1"), value.encode("latin1"))
+        for name, value in response.headers.items()
+        if name.lower() != "content-length"
+    ]
+    headers.append((b"content-length", str(len(body)).encode()))
+    await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _finalize_response(rv):
+    """Turn a view return value into a response with after_request hooks applied."""
+    response = app.make_response(rv)
+    return app.process_response(response)
+
+
+def _prepare_phase(environ):
+    """Auth, buffered user message and attachments, history. Returns (response, turn, request_kwargs)."""
+    with app.request_context(environ):
+        rv = app.preprocess_request()
+        if rv is not None:
+            return _finalize_response(rv), None, None
+        if not session.get("authenticated"):
+            return _finalize_response((jsonify({"error": "Authentication required"}), 401)), None, None
+
+        turn = None
+        try:
+            turn, error_response = flask_app.prepare_chat_turn()
+            if error_response:
+                return _finalize_response(error_response), None, None
+            if not os.environ.get("ANTHROPIC_API_KEY"):
+                return None, turn, None
+            turn["route"] = flask_app.route_chat_model(turn["ai_message"])
+            request_kwargs = flask_app.build_chat_request(
+                turn["ai_message"], turn["conversation_history"], turn["route"]
+            )
+            return None, turn, request_kwargs
+        except Exception as e:
+            if turn:
+                # Nothing was written: drop the turn's stored files and temporary copies
+                turn["writes"].discard()
+            return _finalize_response(flask_app.chat_turn_error(request.form.get("message", "").strip(), e)), None, None
+
+
+def _finish_phase(environ, turn, llm_response, llm_error, hedged=False):
+    """Record the assistant message for a completed LLM call. Returns the response."""
+    with app.request_context(environ):
+        try:
+            if llm_response is not None:
+                ai_response = flask_app.record_chat_response(llm_response, hedged)
+            elif llm_error is not None:
+                ai_response = flask_app.record_chat_error(turn["ai_message"], llm_error, turn.get("route"))
+            else:
+                ai_response = "ANTHROPIC_API_KEY environment variable not set. Please check your .env file."
+            return _finalize_response(jsonify(flask_app.finish_chat_turn(turn, ai_response)))
+        except Exception as e:
+            # A no-op once finish_chat_turn() has persisted the rows
+            turn["writes"].discard()
+            return _finalize_response(flask_app.chat_turn_error(turn["user_message"], e, turn.get("route")))
+
+
+async def chat_endpoint(scope, receive, send):
+    """Async POST /chat."""
+    try:
+        body = await read_body(receive, app.config["MAX_CONTENT_LENGTH"])
+    except ClientDisconnected:
+        return
+    if body is None:
+        await send_simple_response(send, 413, b'{"error": "File too large. Maximum size is 50MB"}')
+        return
+
+    environ = build_environ(scope, body)
+    token = start_request_timings()
+    try:
+        response, turn, request_kwargs = await _run_in_executor(_prepare_phase, environ)
+        if response is None:
+            llm_response = None
+            llm_error = None
+            hedged = False
+            if request_kwargs is not None:
+                try:
+                    with span("llm"):
+                        llm_response, _, hedged = await acreate_with_fallback(
+                            get_async_anthropic_client(), request_kwargs, turn["route"]
+                        )
+                except Exception as e:
+                    llm_error = e
+            environ["wsgi.input"].seek(0)
+            response = await _run_in_executor(_finish_phase, environ, turn, llm_response, llm_error, hedged)
+        await send_flask_response(send, response)
+    finally:
+        end_request_timings(token)
+        body.close()
+
+
+EVENT_STREAM_PATHS = ("/api/support-chat/events", "/api/admin/events")
+
+
+def _events_phase(environ):
+    """Run the events view (auth, replay). Returns (stream, response); stream is None on refusal."""
+    with app.request_context(environ):
+        response = app.full_dispatch_request()
+        return environ.get("chopper.sse_stream"), response
+
+
+async def _wait_for_disconnect(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def events_endpoint(scope, receive, send):
+    """Async support event stream (SSE)."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    environ = build_environ(scope)
+    # Called from whichever thread publishes (commit, LISTEN or poll thread)
+    environ["chopper.sse_deliver"] = lambda evt: loop.call_soon_threadsafe(events.put_nowait, evt)
+
+    stream, response = await _run_in_executor(_events_phase, environ)
+    if stream is None:
+        await send_flask_response(send, response)
+        return
+
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(receive))
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin1"), value.encode("latin1"))
+                for name, value in response.headers.items()
+                if name.lower() != "content-length"
+            ],
+        })
+        for chunk in stream.opening_chunks():
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+
+        while not stream.expired() and not disconnected.done():
+            getter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected}, timeout=KEEPALIVE_SECONDS, return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter in done:
+                chunk = stream.render(getter.result())
+            else:
+                getter.cancel()
+                chunk = None if disconnected.done() else ": keepalive\n\n"
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        disconnected.cancel()
+        stream.close()
+
+
+def _run_wsgi(environ, loop, queue):
+    """Run the Flask WSGI app on a worker thread, streaming output to `queue`."""
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def start_response(status, headers, exc_info=None):
+        put(("start", int(status.split(" ", 1)[0]), headers))
+        return lambda data: put(("body", data))
+
+    result = None
+    try:
+        result = app.wsgi_app(environ, start_response)
+        for data in result:
+            if data:
+                put(("body", data))
+    except Exception as e:
+        put(("error", e))
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+        environ["wsgi.input"].close()
+        put(("end", None))
+
+
+async def wsgi_endpoint(scope, receive, send):
+    """Serve any other route through the Flask WSGI app without blocking the loop."""
+    try:
+        body = await read_body(receive, app.config["MAX_CONTENT_LENGTH"] + 1024 * 1024)
+    except ClientDisconnected:
+        return
+    if body is None:
+        await send_simple_response(send, 413, b'{"error": "File too large. Maximum size is 50MB"}')
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    loop.run_in_executor(_db_executor, _run_wsgi, build_environ(scope, body), loop, queue)
+
+    started = False
+    while True:
+        kind, *payload = await queue.get()
+        if kind == "start":
+            status, headers = payload
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(k.lower().encode("latin1"), v.encode("latin1")) for k, v in headers],
+            })
+            started = True
+        elif kind == "body":
+            await send({"type": "http.response.body", "body": payload[0], "more_body": True})
+        elif kind == "error":
+            print(f"ERROR in WSGI bridge: {payload[0]}")
+            if not started:
+                await send_simple_response(send, 500, b'{"error": "Internal server error"}')
+                return
+        else:
+            if started:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application."""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] == "POST" and scope["path"] == "/chat":
+        await chat_endpoint(scope, receive, send)
+    elif scope["method"] == "GET" and scope["path"] in EVENT_STREAM_PATHS:
+        await events_endpoint(scope, receive, send)
+    else:
+        await wsgi_endpoint(scope, receive, send)
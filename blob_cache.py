@@ -0,0 +1,311 @@
+"""
+Local Disk Cache for Blob Reads in Ask-Chopper
+
+Files stored in Vercel Blob are only reachable over HTTP. BlobCache is a
+read-through cache in front of those URLs for server-side reads (serving
+a stored document or attachment to its owner or an admin):
+
+    - A miss downloads the object once into BLOB_CACHE_DIR, streamed to
+      disk in chunks; concurrent misses for the same URL share one
+      download.
+    - Entries are evicted least recently used first once the cache holds
+      more than BLOB_CACHE_MAX_MB. Recency is the data file's mtime, which
+      every hit touches, so the order survives restarts and is shared by
+      the workers using the directory.
+    - Entries are revalidated against Blob after
+      BLOB_CACHE_REVALIDATE_SECONDS with If-None-Match on the stored ETag;
+      a 304 keeps the file. Names that never change content (uuid-named
+      uploads and content-addressed objects, see is_immutable_name()) are
+      never revalidated.
+
+Cached files are plain files, so routes hand them to send_file(), which
+answers Range and If-None-Match requests and uses sendfile where the
+server supports it.
+"""
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlparse
+
+import requests
+
+# Serverless instances can only write under /tmp
+CACHE_DIR = os.environ.get("BLOB_CACHE_DIR") or (
+    os.path.join(tempfile.gettempdir(), "chopper_blob_cache") if os.environ.get("VERCEL")
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "blob_cache")
+)
+CACHE_MAX_BYTES = int(float(os.environ.get("BLOB_CACHE_MAX_MB", "512")) * 1024 * 1024)
+REVALIDATE_SECONDS = float(os.environ.get("BLOB_CACHE_REVALIDATE_SECONDS", "300"))
+REQUEST_TIMEOUT = int(os.environ.get("BLOB_REQUEST_TIMEOUT", "60"))
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# generate_unique_filename() names (name_YYYYmmdd_HHMMSS_<8 hex>.ext, also behind thumb_<w>_)
+# and content-addressed objects (objects/ab/<sha256>.ext) are never rewritten with other content
+_IMMUTABLE_NAME_RE = re.compile(
+    r"(?:_\d{8}_\d{6}_[0-9a-f]{8}(?:\.[A-Za-z0-9]+)?|(?:^|/)objects/[0-9a-f]{2}/[0-9a-f]{64}(?:\.[A-Za-z0-9]+)?)$"
+)
+
+
+class BlobCacheError(Exception):
+    """An object could not be fetched from Blob storage."""
+
+
+class CachedBlob(NamedTuple):
+    """A cached object: a local file with the metadata Blob returned for it."""
+    path: str
+    size: int
+    etag: Optional[str]
+    content_type: str
+
+
+def is_immutable_name(name: str) -> bool:
+    """True for file names and URLs whose content never changes (see module docstring)."""
+    return bool(_IMMUTABLE_NAME_RE.search(urlparse(name).path if "://" in name else name))
+
+
+class BlobCache:
+    """
+    Size-bounded LRU disk cache of Blob objects, keyed by URL.
+
+    Args:
+        directory: Where cached files and their .json metadata are kept
+        max_bytes: Total size of cached files before the least recently used are evicted
+        revalidate_seconds: Age after which a mutable entry is checked with If-None-Match
+        timeout: Seconds per HTTP request
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES,
+                 revalidate_seconds: float = REVALIDATE_SECONDS, timeout: int = REQUEST_TIMEOUT):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._index: Optional["OrderedDict[str, int]"] = None  # key -> size, least recent first
+        self._size = 0
+        self._fetch_locks: Dict[str, threading.Lock] = {}
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+
+    @property
+    def _http(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    # -- Paths and metadata ------------------------------------------------
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._data_path(key) + ".json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if os.path.getsize(self._data_path(key)) != meta["size"]:
+                return None
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        path = self._data_path(key) + ".json"
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def _entry(self, meta: dict, key: str) -> CachedBlob:
+        return CachedBlob(self._data_path(key), meta["size"], meta.get("etag"),
+                          meta.get("content_type") or "application/octet-stream")
+
+    # -- LRU index ---------------------------------------------------------
+
+    def _load_index(self) -> None:
+        """Build the LRU order from the files on disk (called with the lock held)."""
+        entries = []
+        try:
+            prefixes = os.listdir(self.directory)
+        except OSError:
+            prefixes = []
+        for prefix in prefixes:
+            try:
+                names = os.listdir(os.path.join(self.directory, prefix))
+            except OSError:
+                continue
+            for name in names:
+                if len(name) != 64:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, prefix, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name, stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._size = sum(self._index.values())
+
+    def _touch(self, key: str, size: int) -> None:
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            self._size += size - self._index.pop(key, 0)
+            self._index[key] = size
+        try:
+            os.utime(self._data_path(key))
+        except OSError:
+            pass
+
+    def _evict(self, keep: str) -> None:
+        """Remove least recently used entries until the cache fits (never `keep`)."""
+        with self._lock:
+            victims = []
+            for key in list(self._index):
+                if self._size <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                self._size -= self._index.pop(key)
+                victims.append(key)
+            self.evictions += len(victims)
+        for key in victims:
+            # Open handles (a response being sent) keep reading the unlinked file
+            for path in (self._data_path(key), self._data_path(key) + ".json"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _forget(self, key: str) -> None:
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._size -= self._index.pop(key)
+
+    # -- Reads -------------------------------------------------------------
+
+    def get(self, url: str, immutable: Optional[bool] = None) -> CachedBlob:
+        """
+        Local copy of a Blob object, downloading or revalidating it if needed.
+
+        Args:
+            url: Blob URL
+            immutable: Skip revalidation; defaults to is_immutable_name(url)
+
+        Returns:
+            CachedBlob(path, size, etag, content_type)
+
+        Raises:
+            BlobCacheError if the object can't be fetched
+        """
+        if immutable is None:
+            immutable = is_immutable_name(url)
+        key = self._key(url)
+        meta = self._read_meta(key)
+        if meta and (immutable or time.time() - meta.get("validated_at", 0) < self.revalidate_seconds):
+            self.hits += 1
+            self._touch(key, meta["size"])
+            return self._entry(meta, key)
+
+        with self._lock:
+            fetch_lock = self._fetch_locks.setdefault(key, threading.Lock())
+        with fetch_lock:
+            try:
+                # Another thread may have fetched it while we waited
+                meta = self._read_meta(key)
+                if meta and (immutable or time.time() - meta.get("validated_at", 0) < self.revalidate_seconds):
+                    self.hits += 1
+                    self._touch(key, meta["size"])
+                    return self._entry(meta, key)
+                return self._fetch(url, key, meta)
+            finally:
+                with self._lock:
+                    self._fetch_locks.pop(key, None)
+
+    def _fetch(self, url: str, key: str, meta: Optional[dict]) -> CachedBlob:
+        headers = {"If-None-Match": meta["etag"]} if meta and meta.get("etag") else {}
+        try:
+            response = self._http.get(url, headers=headers, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            raise BlobCacheError(f"Could not fetch {url}: {e}") from e
+
+        with response:
+            if response.status_code == 304 and meta:
+                self.revalidations += 1
+                meta["validated_at"] = time.time()
+                self._write_meta(key, meta)
+                self._touch(key, meta["size"])
+                return self._entry(meta, key)
+            if response.status_code != 200:
+                raise BlobCacheError(f"Could not fetch {url}: HTTP {response.status_code}")
+
+            self.misses += 1
+            path = self._data_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            size = 0
+            try:
+                with open(tmp_path, "wb") as f:
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp_path, path)
+            except (OSError, requests.RequestException) as e:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise BlobCacheError(f"Could not fetch {url}: {e}") from e
+
+        meta = {
+            "url": url,
+            "size": size,
+            "etag": response.headers.get("ETag"),
+            "content_type": response.headers.get("Content-Type"),
+            "validated_at": time.time(),
+        }
+        self._write_meta(key, meta)
+        self._touch(key, size)
+        self._evict(keep=key)
+        return self._entry(meta, key)
+
+    def invalidate(self, url: str) -> None:
+        """Drop a cached object (after it is deleted or replaced in Blob)."""
+        key = self._key(url)
+        self._forget(key)
+        for path in (self._data_path(key), self._data_path(key) + ".json"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            if self._index is None:
+                self._load_index()
+            return {
+                "directory": self.directory,
+                "entries": len(self._index),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+            }
+
+
+blob_cache = BlobCache()
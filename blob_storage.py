@@ -1,18 +1,49 @@
 """
 Vercel Blob Storage Helper
 Provides file upload/download functionality using Vercel Blob storage.
+BlobStorage exposes it as a StorageBackend (see storage.py).
 """
 
 import os
-import io
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 from werkzeug.datastructures import FileStorage
 from vercel_blob import put, head, delete
-from PIL import Image
+from request_timing import timed
+from blob_upload import ContentMismatchError, VercelBlobTransport
+from multipart_upload import MultipartUploader, UploadStateStore
+from thumbnails import make_thumbnail, thumbnail_mime_type
+from blob_cache import blob_cache
+from storage import StorageBackend, StorageError, StoredFile
 
 # Get Blob token from environment
 BLOB_TOKEN = os.environ.get('BLOB_READ_WRITE_TOKEN', '')
 
+# delete_files(): URLs per Blob delete call, and calls in flight at once
+DELETE_BATCH_SIZE = int(os.environ.get('BLOB_DELETE_BATCH_SIZE', '100'))
+DELETE_CONCURRENCY = max(1, int(os.environ.get('BLOB_DELETE_CONCURRENCY', '4')))
+
+# Streaming uploads go through our own parallel, resumable multipart uploader
+# (see multipart_upload.py)
+_upload_state = UploadStateStore()
+_uploader = MultipartUploader(VercelBlobTransport(BLOB_TOKEN), state_store=_upload_state)
+
+def prune_upload_state() -> int:
+    """
+    Remove multipart upload state older than BLOB_UPLOAD_STATE_TTL_HOURS.
+
+    Most uploads use unique paths and are never resumed, so the state of a
+    failed one is only removed here. Runs at startup and from
+    reap_deletions.py run.
+
+    Returns:
+        Number of state files removed
+    """
+    return _upload_state.prune()
+
+# Serverless instances have no cron; their /tmp is pruned whenever one starts
+prune_upload_state()
+
 def is_blob_configured() -> bool:
     """Check if Vercel Blob is configured"""
     return bool(BLOB_TOKEN)
@@ -21,6 +52,9 @@ def upload_file(file: FileStorage, path: str, content_type: Optional[str] = None
     """
     Upload a file to Vercel Blob storage.
 
+    The file is streamed from its (spooled) upload stream in parts uploaded
+    in parallel, so memory use doesn't grow with the file size.
+
     Args:
         file: FileStorage object from Flask request
         path: Path/key for the file in blob storage (e.g., 'audio/filename.mp3')
@@ -32,45 +66,51 @@ def upload_file(file: FileStorage, path: str, content_type: Optional[str] = None
     Raises:
         Exception if upload fails
     """
-    if not is_blob_configured():
-        raise Exception("Vercel Blob storage not configured. Set BLOB_READ_WRITE_TOKEN environment variable.")
+    # Detect content type if not provided
+    if not content_type:
+        content_type = file.content_type or 'application/octet-stream'
 
-    try:
-        # Read file content
-        file_content = file.read()
-        file_size = len(file_content)
+    file.stream.seek(0)
+    blob_url, file_size, _ = upload_stream(file.stream, path, content_type)
+    return blob_url, file_size
 
-        # Detect content type if not provided
-        if not content_type:
-            content_type = file.content_type or 'application/octet-stream'
+@timed("blob_upload")
+def upload_stream(stream, path: str, content_type: str = 'application/octet-stream',
+                  sha256: Optional[str] = None) -> Tuple[str, int, str]:
+    """
+    Upload a readable stream to Vercel Blob storage in parallel parts.
 
-        # Use multipart upload for files larger than 4MB
-        use_multipart = file_size > 4 * 1024 * 1024
+    Failed part uploads are retried with backoff; if the upload still fails,
+    uploading the same path again resumes from the parts already stored.
 
-        # Upload to Vercel Blob (correct API usage)
-        response = put(
-            path,  # First positional argument
-            file_content,  # Second positional argument (bytes)
-            options={
-                'access': 'public',
-                'token': BLOB_TOKEN,
-                'addRandomSuffix': False,
-                'contentType': content_type
-            },
-            multipart=use_multipart,
-            timeout=120  # Increase timeout for large files
-        )
+    Args:
+        stream: Binary stream, read from its current position to the end
+        path: Path/key for the file in blob storage
+        content_type: MIME type of the data
+        sha256: Expected digest, checked before the path is written
 
-        blob_url = response['url']
+    Returns:
+        Tuple of (blob_url, file_size, sha256 hex digest)
 
-        return blob_url, file_size
+    Raises:
+        ContentMismatchError if the data doesn't match sha256
+        Exception if upload fails
+    """
+    if not is_blob_configured():
+        raise Exception("Vercel Blob storage not configured. Set BLOB_READ_WRITE_TOKEN environment variable.")
+
+    try:
+        return _uploader.upload(stream, path, content_type, sha256)
 
+    except ContentMismatchError:
+        raise
     except Exception as e:
         import traceback
         error_msg = f"Failed to upload file to Blob storage: {e}\n{traceback.format_exc()}"
         print(error_msg)
         raise Exception(error_msg)
 
+@timed("blob_upload")
 def upload_bytes(data: bytes, path: str, content_type: str = 'application/octet-stream') -> str:
     """
     Upload raw bytes to Vercel Blob storage.
@@ -109,6 +149,7 @@ def upload_bytes(data: bytes, path: str, content_type: str = 'application/octet-
         print(error_msg)
         raise Exception(error_msg)
 
+@timed("thumbnail")
 def upload_thumbnail(image_path_or_file, thumbnail_path: str, size: Tuple[int, int] = (150, 150)) -> Optional[str]:
     """
     Create and upload a thumbnail to Vercel Blob storage.
@@ -125,27 +166,9 @@ def upload_thumbnail(image_path_or_file, thumbnail_path: str, size: Tuple[int, i
         return None
 
     try:
-        # Open image
-        if isinstance(image_path_or_file, str):
-            img = Image.open(image_path_or_file)
-        else:
-            img = Image.open(image_path_or_file)
-
-        # Create thumbnail
-        img.thumbnail(size, Image.Resampling.LANCZOS)
-
-        # Save to bytes buffer
-        buffer = io.BytesIO()
-        img_format = img.format or 'JPEG'
-        img.save(buffer, format=img_format, optimize=True, quality=85)
-        thumbnail_data = buffer.getvalue()
-
-        # Upload thumbnail
-        content_type = f"image/{img_format.lower()}"
-        if img_format.upper() == 'JPEG':
-            content_type = 'image/jpeg'
-        elif img_format.upper() == 'PNG':
-            content_type = 'image/png'
+        # Scaled decode, metadata stripped, smaller of JPEG/PNG (see thumbnails.py)
+        thumbnail_data, img_format = make_thumbnail(image_path_or_file, max(size))
+        content_type = thumbnail_mime_type(img_format)
 
         blob_url = upload_bytes(thumbnail_data, thumbnail_path, content_type)
 
@@ -155,6 +178,7 @@ def upload_thumbnail(image_path_or_file, thumbnail_path: str, size: Tuple[int, i
         print(f"Error creating/uploading thumbnail: {e}")
         return None
 
+@timed("blob_delete")
 def delete_file(blob_url: str) -> bool:
     """
     Delete a file from Vercel Blob storage.
@@ -170,11 +194,64 @@ def delete_file(blob_url: str) -> bool:
 
     try:
         delete(url=blob_url, options={'token': BLOB_TOKEN})
+        blob_cache.invalidate(blob_url)
         return True
     except Exception as e:
         print(f"Error deleting blob: {e}")
         return False
 
+@timed("blob_delete")
+def delete_files(blob_urls: Sequence[str], batch_size: int = DELETE_BATCH_SIZE,
+                 concurrency: int = DELETE_CONCURRENCY) -> List[str]:
+    """
+    Delete many files from Vercel Blob storage.
+
+    The Blob delete API takes a list of URLs, so the files are deleted
+    batch_size per request, with up to `concurrency` requests at a time.
+
+    Args:
+        blob_urls: Full URLs of the blobs to delete
+        batch_size: URLs per delete request
+        concurrency: Delete requests in flight at once
+
+    Returns:
+        URLs that could not be deleted (every URL of a failed batch)
+    """
+    urls = list(dict.fromkeys(blob_urls))
+    if not urls:
+        return []
+    if not is_blob_configured():
+        return urls
+
+    batches = [urls[i:i + batch_size] for i in range(0, len(urls), batch_size)]
+
+    def delete_batch(batch):
+        try:
+            delete(url=batch, options={'token': BLOB_TOKEN})
+        except Exception as e:
+            print(f"Error deleting {len(batch)} blob(s): {e}")
+            return batch
+        for blob_url in batch:
+            blob_cache.invalidate(blob_url)
+        return []
+
+    if len(batches) == 1:
+        return delete_batch(batches[0])
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches)), thread_name_prefix='blob-delete') as pool:
+        return [blob_url for failed in pool.map(delete_batch, batches) for blob_url in failed]
+
+def open_cached(blob_url: str):
+    """
+    Local copy of a blob through the read-through disk cache (blob_cache.py).
+
+    Returns:
+        CachedBlob(path, size, etag, content_type)
+
+    Raises:
+        BlobCacheError if the blob can't be fetched
+    """
+    return blob_cache.get(blob_url)
+
 def get_file_info(blob_url: str) -> Optional[dict]:
     """
     Get metadata about a file in Vercel Blob storage.
@@ -217,3 +294,38 @@ def generate_blob_path(category: str, filename: str) -> str:
     filename = filename.strip('/')
 
     return f"{category}/{filename}"
+
+
+class BlobStorage(StorageBackend):
+    """Vercel Blob as a StorageBackend; locations are Blob URLs."""
+
+    name = 'blob'
+
+    def save_stream(self, stream, name: str, content_type: str = 'application/octet-stream',
+                    sha256: Optional[str] = None, shard: Optional[str] = None) -> StoredFile:
+        # Blob keys need no sharding; `shard` only matters on local disk
+        try:
+            blob_url, size, digest = upload_stream(stream, name, content_type, sha256)
+        except ContentMismatchError as e:
+            raise StorageError(f"Content of {name} changed while it was stored") from e
+        return StoredFile(blob_url, size, digest)
+
+    def save_bytes(self, data: bytes, name: str, content_type: str = 'application/octet-stream',
+                   shard: Optional[str] = None) -> str:
+        return upload_bytes(data, name, content_type)
+
+    def delete(self, location: str) -> bool:
+        return delete_file(location)
+
+    def delete_many(self, locations: Sequence[str]) -> List[str]:
+        return delete_files(locations)
+
+    def local_path(self, location: str) -> Optional[str]:
+        # Reads go through open_cached(), which may download
+        return None
+
+    def exists(self, location: str) -> bool:
+        # A failed HEAD counts as missing; callers only re-upload then
+        return get_file_info(location) is not None
+
+blob_backend = BlobStorage()
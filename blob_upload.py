@@ -0,0 +1,353 @@
+"""
+Streaming Blob Uploads for Ask-Chopper
+
+Blob API transports and stream helpers used by the multipart uploader
+(multipart_upload.py):
+
+    VercelBlobTransport - the Vercel Blob HTTP API (single PUT and the
+                          create / upload part / complete multipart calls)
+    LocalBlobTransport  - the same calls against a local directory, with
+                          optional simulated latency, bandwidth and
+                          failures, for tests and benchmarks
+
+Transports make one attempt per call; retries and backoff are the
+uploader's job. Failures raise BlobUploadError with `retryable` set for
+connection errors, timeouts, 429 and 5xx responses.
+
+Werkzeug spools uploads over 500 KB to a temporary file. open_reader()
+gives each consumer of that file (blob upload, text extraction) its own
+read position on it, so they can run on different threads without
+copying the upload into memory first.
+"""
+
+import hashlib
+import io
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import requests
+
+API_BASE_URL = "https://blob.vercel-storage.com"
+API_VERSION = "10"
+CACHE_MAX_AGE = "31536000"
+
+# Blob multipart parts must be at least 5 MB, except the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+REQUEST_TIMEOUT = int(os.environ.get("BLOB_REQUEST_TIMEOUT", "60"))
+
+# Statuses worth retrying besides 5xx
+_RETRYABLE_STATUSES = (408, 429)
+
+# Copy size for local storage writes
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobUploadError(Exception):
+    """A Blob API call failed; `retryable` is False when repeating it can't help."""
+
+    def __init__(self, message: str, retryable: bool = False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class ContentMismatchError(BlobUploadError):
+    """The uploaded data didn't have the expected sha256; nothing was written under the path."""
+
+
+class BlobTransport:
+    """Blob storage calls used by the multipart uploader."""
+
+    def put(self, path: str, data: bytes, content_type: str) -> Dict[str, Any]:
+        """Single-request upload. Returns the blob (url, pathname, ...)."""
+        raise NotImplementedError
+
+    def create_multipart(self, path: str, content_type: str) -> Tuple[str, str]:
+        """Start a multipart upload. Returns (upload_id, key)."""
+        raise NotImplementedError
+
+    def upload_part(self, path: str, upload_id: str, key: str, part_number: int, data: bytes,
+                    content_type: str) -> str:
+        """Upload one part (numbered from 1). Returns its etag."""
+        raise NotImplementedError
+
+    def complete_multipart(self, path: str, upload_id: str, key: str, parts: List[Dict[str, Any]],
+                           content_type: str) -> Dict[str, Any]:
+        """Finish a multipart upload from its parts' numbers and etags. Returns the blob."""
+        raise NotImplementedError
+
+
+class VercelBlobTransport(BlobTransport):
+    """Vercel Blob API client (one HTTP session per thread)."""
+
+    def __init__(self, token: str, base_url: str = API_BASE_URL, timeout: int = REQUEST_TIMEOUT):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @property
+    def _http(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _headers(self, content_type: str, **extra: str) -> Dict[str, str]:
+        headers = {
+            "access": "public",
+            "authorization": f"Bearer {self.token}",
+            "x-api-version": API_VERSION,
+            "x-content-type": content_type,
+            "x-cache-control-max-age": CACHE_MAX_AGE,
+            # Content-addressed objects (content_store.py) can be written again with the same bytes
+            "x-allow-overwrite": "1",
+        }
+        headers.update(extra)
+        return headers
+
+    def _request(self, method: str, endpoint: str, path: str, headers: Dict[str, str], **kwargs) -> Dict[str, Any]:
+        url = f"{self.base_url}/{endpoint}"
+        try:
+            response = self._http.request(
+                method, url, params={"pathname": path}, headers=headers, timeout=self.timeout, **kwargs
+            )
+        except requests.RequestException as e:
+            raise BlobUploadError(f"Blob API request failed: {e}", retryable=True) from e
+
+        if response.status_code != 200:
+            status = response.status_code
+            raise BlobUploadError(
+                f"Blob API error {status}: {response.text[:300]}",
+                retryable=status >= 500 or status in _RETRYABLE_STATUSES
+            )
+        return response.json()
+
+    def put(self, path: str, data: bytes, content_type: str) -> Dict[str, Any]:
+        return self._request("PUT", "", path, self._headers(content_type), data=data)
+
+    def create_multipart(self, path: str, content_type: str) -> Tuple[str, str]:
+        result = self._request("POST", "mpu", path, self._headers(content_type, **{"x-mpu-action": "create"}))
+        if "uploadId" not in result or "key" not in result:
+            raise BlobUploadError(f"Unexpected multipart create response: {result}")
+        return result["uploadId"], result["key"]
+
+    def upload_part(self, path: str, upload_id: str, key: str, part_number: int, data: bytes,
+                    content_type: str) -> str:
+        headers = self._headers(content_type, **{
+            "x-mpu-action": "upload",
+            "x-mpu-upload-id": upload_id,
+            "x-mpu-key": quote(key),
+            "x-mpu-part-number": str(part_number),
+            "Content-Type": "application/octet-stream",
+        })
+        result = self._request("POST", "mpu", path, headers, data=data)
+        if "etag" not in result:
+            raise BlobUploadError(f"Part {part_number} upload returned no etag: {result}")
+        return result["etag"]
+
+    def complete_multipart(self, path: str, upload_id: str, key: str, parts: List[Dict[str, Any]],
+                           content_type: str) -> Dict[str, Any]:
+        headers = self._headers(content_type, **{
+            "x-mpu-action": "complete",
+            "x-mpu-upload-id": upload_id,
+            "x-mpu-key": quote(key),
+        })
+        return self._request("POST", "mpu", path, headers, json=parts)
+
+
+class LocalBlobTransport(BlobTransport):
+    """
+    Blob calls served from a local directory, for tests and benchmarks.
+
+    Each call can be slowed to look like a network request (`latency`
+    seconds plus the data at `bandwidth_mbps` per connection) and made to
+    fail at random (`failure_rate`, raised as a retryable error). Sleeping
+    releases the GIL, so parallel uploads overlap like real ones.
+
+    Args:
+        root: Directory blobs are written under
+        latency: Seconds added to every call
+        bandwidth_mbps: Per-connection upload speed in megabits/s (None: unlimited)
+        failure_rate: Chance (0-1) that a put or part upload fails
+        seed: Random seed for failures
+    """
+
+    def __init__(self, root: str, latency: float = 0.0, bandwidth_mbps: Optional[float] = None,
+                 failure_rate: float = 0.0, seed: Optional[int] = None):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self.bandwidth_mbps = bandwidth_mbps
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {"put": 0, "create": 0, "upload": 0, "complete": 0}
+
+    def _simulate(self, action: str, nbytes: int = 0, can_fail: bool = False) -> None:
+        with self._lock:
+            self.calls[action] += 1
+            fail = can_fail and self._random.random() < self.failure_rate
+        delay = self.latency
+        if self.bandwidth_mbps:
+            delay += nbytes * 8 / (self.bandwidth_mbps * 1_000_000)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise BlobUploadError(f"Simulated {action} failure", retryable=True)
+
+    def _blob(self, path: str, size: int) -> Dict[str, Any]:
+        return {"url": f"file://{os.path.join(self.root, path)}", "pathname": path, "size": size}
+
+    def _part_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, ".multipart", upload_id)
+
+    def put(self, path: str, data: bytes, content_type: str) -> Dict[str, Any]:
+        self._simulate("put", len(data), can_fail=True)
+        dest = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            f.write(data)
+        return self._blob(path, len(data))
+
+    def create_multipart(self, path: str, content_type: str) -> Tuple[str, str]:
+        self._simulate("create")
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._part_dir(upload_id))
+        return upload_id, f"local/{path}"
+
+    def upload_part(self, path: str, upload_id: str, key: str, part_number: int, data: bytes,
+                    content_type: str) -> str:
+        self._simulate("upload", len(data), can_fail=True)
+        part_dir = self._part_dir(upload_id)
+        if not os.path.isdir(part_dir):
+            raise BlobUploadError(f"Unknown multipart upload {upload_id}")
+        with open(os.path.join(part_dir, f"{part_number:05d}"), "wb") as f:
+            f.write(data)
+        return hashlib.md5(data).hexdigest()
+
+    def complete_multipart(self, path: str, upload_id: str, key: str, parts: List[Dict[str, Any]],
+                           content_type: str) -> Dict[str, Any]:
+        self._simulate("complete")
+        part_dir = self._part_dir(upload_id)
+        if not os.path.isdir(part_dir):
+            raise BlobUploadError(f"Unknown multipart upload {upload_id}")
+
+        dest = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        size = 0
+        with open(dest, "wb") as out:
+            for part in sorted(parts, key=lambda p: p["partNumber"]):
+                with open(os.path.join(part_dir, f"{part['partNumber']:05d}"), "rb") as f:
+                    data = f.read()
+                if hashlib.md5(data).hexdigest() != part["etag"]:
+                    raise BlobUploadError(f"Part {part['partNumber']} etag mismatch")
+                out.write(data)
+                size += len(data)
+        shutil.rmtree(part_dir)
+        return self._blob(path, size)
+
+
+def read_part(stream, size: int, prefix: bytes = b"") -> bytes:
+    """Read up to `size` bytes (fewer only at the end of the stream)."""
+    chunks = [prefix] if prefix else []
+    remaining = size - len(prefix)
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return chunks[0] if len(chunks) == 1 else b"".join(chunks)
+
+
+def stream_to_file(stream, file_path: str) -> Tuple[int, str]:
+    """
+    Copy a stream to a local file in chunks.
+
+    Returns:
+        Tuple of (size, sha256 hex digest)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "wb") as f:
+        while True:
+            chunk = stream.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+    return size, digest.hexdigest()
+
+
+class _PositionalReader(io.RawIOBase):
+    """Reads a file descriptor with pread at its own offset; owns a dup of the descriptor."""
+
+    def __init__(self, fd: int):
+        super().__init__()
+        self._fd = os.dup(fd)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def fileno(self) -> int:
+        # Lets the document processor memory-map the upload instead of reading it
+        return self._fd
+
+    def readinto(self, buffer) -> int:
+        data = os.pread(self._fd, len(buffer), self._pos)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def readall(self) -> bytes:
+        data = os.pread(self._fd, max(0, os.fstat(self._fd).st_size - self._pos), self._pos)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += os.fstat(self._fd).st_size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+
+def open_reader(stream, filename: Optional[str] = None, content_type: Optional[str] = None):
+    """
+    Independent reader over an uploaded file's stream, starting at byte 0.
+
+    Disk-backed streams are read with pread through a duplicated descriptor,
+    so the reader has its own position and stays valid after the request
+    closes the upload. Small in-memory uploads are wrapped in a BytesIO.
+    filename and content_type are copied onto the reader for the document
+    processor.
+    """
+    try:
+        # SpooledTemporaryFile moves to disk on fileno(); in-memory spools are at most 500 KB
+        reader = _PositionalReader(stream.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        position = stream.tell()
+        stream.seek(0)
+        reader = io.BytesIO(stream.read())
+        stream.seek(position)
+    reader.filename = filename
+    reader.content_type = content_type
+    return reader
@@ -36,6 +36,7 @@ def log_bridge_event(
     message: Optional[str] = None,
     detail: Optional[str] = None,
     extra: Optional[Dict[str, Any]] = None,
+    timings: Optional[Dict[str, Any]] = None,
 ) -> None:
     payload = {
         "ts": datetime.now(timezone.utc).isoformat(),
@@ -50,6 +51,8 @@ def log_bridge_event(
         "detail": _truncate(detail),
         "extra": extra or {},
     }
+    if timings:
+        payload["timings"] = timings
 
     try:
         log_path = get_bridge_log_path()
@@ -7,7 +7,10 @@ Uses direct HTTP API to avoid Python version compatibility issues.
 
 import os
 import httpx
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Sequence
+
+from request_timing import timed
 
 # Singleton client instance
 _http_client = None
@@ -15,6 +18,10 @@ _collection_id = None
 
 COLLECTION_NAME = "ask_chopper_documents"
 
+# delete_documents(): doc_ids per delete request, and requests in flight at once
+DELETE_BATCH_SIZE = int(os.environ.get("CHROMA_DELETE_BATCH_SIZE", "100"))
+DELETE_CONCURRENCY = max(1, int(os.environ.get("CHROMA_DELETE_CONCURRENCY", "4")))
+
 
 def _get_http_client():
     """Get or create HTTP client for Chroma Cloud API."""
@@ -119,6 +126,7 @@ def get_collection():
     return CollectionInfo(collection_id)
 
 
+@timed("vector_add")
 def add_document_chunks(
     doc_id: str,
     chunks: List[str],
@@ -176,6 +184,7 @@ def add_document_chunks(
     return len(chunks)
 
 
+@timed("vector_query")
 def query_documents(
     query_embedding: List[float],
     user_id: int,
@@ -250,6 +259,7 @@ def query_documents(
         return {"documents": [], "metadatas": [], "distances": []}
 
 
+@timed("vector_delete")
 def delete_document(doc_id: str) -> int:
     """
     Delete all chunks for a specific document.
@@ -278,6 +288,54 @@ def delete_document(doc_id: str) -> int:
         return 0
 
 
+@timed("vector_delete")
+def delete_documents(doc_ids: Sequence[str], batch_size: int = DELETE_BATCH_SIZE,
+                     concurrency: int = DELETE_CONCURRENCY) -> List[str]:
+    """
+    Delete all chunks of many documents.
+
+    One delete request removes the chunks of batch_size documents (a
+    doc_id $in filter); up to `concurrency` requests run at a time.
+
+    Args:
+        doc_ids: Document IDs to delete
+        batch_size: Document IDs per delete request
+        concurrency: Delete requests in flight at once
+
+    Returns:
+        Document IDs whose chunks could not be deleted
+    """
+    ids = list(dict.fromkeys(doc_ids))
+    if not ids:
+        return []
+
+    try:
+        client = _get_http_client()
+        tenant, database = _get_config()
+        collection_id = _ensure_collection()
+    except Exception as e:
+        print(f"Delete error: {e}")
+        return ids
+
+    url = f"/api/v2/tenants/{tenant}/databases/{database}/collections/{collection_id}/delete"
+    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    def delete_batch(batch):
+        try:
+            response = client.post(url, json={"where": {"doc_id": {"$in": batch}}})
+            response.raise_for_status()
+            return []
+        except Exception as e:
+            print(f"Delete error ({len(batch)} documents): {e}")
+            return batch
+
+    if len(batches) == 1:
+        return delete_batch(batches[0])
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(batches)), thread_name_prefix="chroma-delete") as pool:
+        return [doc_id for failed in pool.map(delete_batch, batches) for doc_id in failed]
+
+
+@timed("vector_delete")
 def delete_user_documents(user_id: int, session_id: str = None) -> int:
     """
     Delete all documents for a user (optionally filtered by session).
@@ -0,0 +1,221 @@
+"""
+Content-Addressed File Storage for Ask-Chopper
+
+Attachments and documents are stored once per distinct content: the
+object name is the file's sha256 (objects/<2 hex>/<sha256><ext>), so the
+same file uploaded by many users, or uploaded to /chat-with-document again,
+is written to the storage backend (storage.py) once.
+
+Reference counting:
+    blob_objects has one row per stored object with its ref_count, the
+    number of MessageAttachment / DocumentUpload rows whose content_sha256
+    points at it (archived attachments in chat_messages_archive keep
+    theirs too, so archiving doesn't drop a reference).
+
+    store_stream() acquires a reference and release() drops one. Both run
+    in their own short transaction on the engine, outside the request's
+    session, so a reference is counted before the row that owns it is
+    written: the caller must either commit the owning row or release the
+    reference (the chat turns do this with WriteBuffer.on_failure()). A
+    missed release only leaves a count too high, which keeps a file
+    around; it never deletes one that is still used.
+
+    The object is deleted when its count reaches zero. The physical delete
+    happens while the row is still locked, so a concurrent upload of the
+    same content waits and then uploads it again. An upload that wrote the
+    object before that delete checks it is still there once its own
+    reference is counted, and writes it again if not. If the delete fails,
+    the row stays at ref_count 0 and the next upload of that content
+    stores it again.
+
+Rows written before content addressing have no content_sha256 and keep
+their own per-upload file; their delete paths are unchanged.
+
+Set CONTENT_STORE_ENABLED=false to go back to one file per upload.
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from typing import BinaryIO, NamedTuple, Optional
+
+from sqlalchemy import delete, insert, update
+from sqlalchemy.exc import IntegrityError
+
+import storage
+from blob_upload import COPY_CHUNK_SIZE
+from models import db, BlobObject
+
+CONTENT_STORE_ENABLED = os.environ.get('CONTENT_STORE_ENABLED', 'true').lower() == 'true'
+OBJECT_PREFIX = 'objects'
+
+
+class StoredObject(NamedTuple):
+    """A reference acquired by store_stream()."""
+    sha256: str
+    size: int
+    location: str  # Blob URL or local path
+    deduplicated: bool  # the content was already stored
+
+
+def is_enabled() -> bool:
+    return CONTENT_STORE_ENABLED
+
+
+def hash_stream(stream: BinaryIO) -> tuple:
+    """
+    sha256 and size of a stream from its current position to the end.
+    The stream is left where it started.
+
+    Returns:
+        Tuple of (sha256 hex digest, size)
+    """
+    start = stream.tell()
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(start)
+    return digest.hexdigest(), size
+
+
+def object_name(sha256: str, filename: str) -> str:
+    """Storage name of an object: objects/ab/ab12...ef.pdf (the extension only helps browsers)."""
+    ext = os.path.splitext(filename)[1].lower()
+    return f"{OBJECT_PREFIX}/{sha256[:2]}/{sha256}{ext}"
+
+
+def _write_content(stream: BinaryIO, name: str, content_type: str, sha256: str) -> str:
+    """Store the stream under `name`, checking it still hashes to sha256. Returns the location."""
+    return storage.get_storage().save_stream(stream, name, content_type, sha256=sha256).location
+
+
+def _delete_content(location: str) -> bool:
+    return storage.backend_for(location).delete(location)
+
+
+def _acquire_existing(sha256: str) -> Optional[str]:
+    """Add a reference to a stored object. Returns its location, or None if it isn't stored."""
+    with db.engine.begin() as conn:
+        return conn.execute(
+            update(BlobObject)
+            .where(BlobObject.sha256 == sha256, BlobObject.ref_count > 0)
+            .values(ref_count=BlobObject.ref_count + 1, updated_at=datetime.utcnow())
+            .returning(BlobObject.location)
+        ).scalar()
+
+
+def _acquire_new(sha256: str, size: int, content_type: str, location: str) -> str:
+    """
+    Record a just-written object with one reference. If another request
+    stored the same content meanwhile (or a failed delete left its row at
+    zero), count the reference on that row instead. Returns the location.
+    """
+    now = datetime.utcnow()
+    values = dict(sha256=sha256, size=size, content_type=content_type, location=location,
+                  ref_count=1, created_at=now, updated_at=now)
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(insert(BlobObject).values(**values))
+            return location
+        except IntegrityError:
+            pass
+        # Both uploads wrote the same bytes under the same name, so either location serves
+        stored = _acquire_existing(sha256)
+        if stored:
+            return stored
+        with db.engine.begin() as conn:
+            revived = conn.execute(
+                update(BlobObject)
+                .where(BlobObject.sha256 == sha256, BlobObject.ref_count == 0)
+                .values(ref_count=1, location=location, size=size, updated_at=now)
+            ).rowcount
+        if revived:
+            return location
+    raise RuntimeError(f"Could not record stored object {sha256}")
+
+
+def _set_location(sha256: str, location: str) -> None:
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(BlobObject)
+            .where(BlobObject.sha256 == sha256)
+            .values(location=location, updated_at=datetime.utcnow())
+        )
+
+
+def store_stream(stream: BinaryIO, filename: str, content_type: str) -> StoredObject:
+    """
+    Store a stream's content once and acquire a reference to it.
+
+    The stream is hashed first (read from its current position to the
+    end); if the content is already stored nothing is uploaded. The caller
+    owns the returned reference: set content_sha256 on the row that uses it
+    and commit the row, or call release().
+
+    Args:
+        stream: Seekable binary stream
+        filename: Original filename (its extension is kept on the object)
+        content_type: MIME type stored with the object
+
+    Returns:
+        StoredObject(sha256, size, location, deduplicated)
+    """
+    start = stream.tell()
+    sha256, size = hash_stream(stream)
+    location = _acquire_existing(sha256)
+    if location:
+        return StoredObject(sha256, size, location, True)
+
+    name = object_name(sha256, filename)
+    location = _acquire_new(sha256, size, content_type, _write_content(stream, name, content_type, sha256))
+    # Until our reference was counted, another request releasing the same content
+    # could delete the object we had just written; now that we hold one, nothing can
+    if not storage.backend_for(location).exists(location):
+        print(f"WARNING: Object {sha256} was deleted while it was stored; storing it again")
+        stream.seek(start)
+        location = _write_content(stream, name, content_type, sha256)
+        _set_location(sha256, location)
+    return StoredObject(sha256, size, location, False)
+
+
+def release(sha256: Optional[str], conn=None) -> bool:
+    """
+    Drop one reference to an object, deleting the object at zero.
+
+    Call after the owning row is deleted (and committed), or instead of
+    writing it. Pass `conn` to release inside the caller's transaction
+    (the deletion reaper commits it with the tombstone's removal).
+    Returns True if the object was deleted.
+    """
+    if not sha256:
+        return False
+    if conn is None:
+        with db.engine.begin() as conn:
+            return _release(conn, sha256)
+    return _release(conn, sha256)
+
+
+def _release(conn, sha256: str) -> bool:
+    row = conn.execute(
+        update(BlobObject)
+        .where(BlobObject.sha256 == sha256, BlobObject.ref_count > 0)
+        .values(ref_count=BlobObject.ref_count - 1, updated_at=datetime.utcnow())
+        .returning(BlobObject.ref_count, BlobObject.location)
+    ).first()
+    if row is None:
+        print(f"WARNING: Released unknown or unreferenced object {sha256}")
+        return False
+    if row.ref_count > 0:
+        return False
+    # Still holding the row lock: a concurrent store of this content waits for us
+    if not _delete_content(row.location):
+        print(f"WARNING: Could not delete object {sha256}; left at ref_count 0")
+        return False
+    conn.execute(delete(BlobObject).where(BlobObject.sha256 == sha256, BlobObject.ref_count == 0))
+    return True
@@ -0,0 +1,267 @@
+"""
+Database Engine Pooling for Ask-Chopper
+
+Engine options come from a named profile (DB_POOL_PROFILE):
+
+    serverless - short-lived functions (Vercel): one pooled connection plus
+                 a little overflow, pre-ping on checkout because a frozen
+                 function's connections are often dead when it thaws
+    server     - long-lived gunicorn/uvicorn workers: a pool sized for the
+                 worker's threads, LIFO checkout so idle connections age
+                 out, recycled every 30 minutes; TCP keepalives instead of
+                 a ping per checkout
+    sqlite     - WAL journal, synchronous=NORMAL and a busy timeout so
+                 concurrent writers wait instead of failing
+
+The default is sqlite for SQLite URLs, serverless when VERCEL is set and
+server otherwise. DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+DB_POOL_RECYCLE and DB_POOL_PRE_PING override individual settings.
+
+Pools are instrumented: checkout wait time, overflow use, timeouts, new
+connections, recycles and invalidations are kept in pool_stats, served to
+the admin and logged to the bridge log every DB_POOL_LOG_SECONDS.
+"""
+
+import os
+import time
+from collections import deque
+from threading import Lock
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+from bridge_log import log_bridge_event
+
+PROFILES = ("serverless", "server", "sqlite")
+
+LOG_INTERVAL_SECONDS = int(os.environ.get("DB_POOL_LOG_SECONDS", "300"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("DB_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Checkout waits kept for percentiles
+WAIT_SAMPLES = 1000
+
+_POSTGRES_CONNECT_ARGS = {
+    'connect_timeout': 10,
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 5
+}
+
+_PROFILE_OPTIONS = {
+    'serverless': {
+        'pool_size': 1,
+        'max_overflow': 2,
+        'pool_timeout': 10,
+        'pool_recycle': 300,
+        'pool_pre_ping': True,
+    },
+    'server': {
+        'pool_size': 10,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': 1800,
+        'pool_pre_ping': False,
+        'pool_use_lifo': True,
+    },
+    'sqlite': {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+    },
+}
+
+
+class PoolStats:
+    """Counters for one engine's pool, updated from pool events."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.profile = None
+        self.pool = None
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._last_logged = time.monotonic()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.checkouts = 0
+            self.overflow_checkouts = 0
+            self.peak_checked_out = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.reconnects = 0
+            self.invalidations = 0
+            self.total_wait_ms = 0.0
+            self.max_wait_ms = 0.0
+            self._waits.clear()
+
+    def record_wait(self, wait_ms: float, timed_out: bool = False) -> None:
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self._waits.append(wait_ms)
+
+    def record_checked_out(self, checked_out: int, size: int) -> None:
+        with self._lock:
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+            if checked_out > size:
+                self.overflow_checkouts += 1
+
+    def record_connect(self, reconnect: bool) -> None:
+        with self._lock:
+            self.connects += 1
+            if reconnect:
+                self.reconnects += 1
+
+    def record_invalidation(self) -> None:
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            pool = self.pool
+            data = {
+                'profile': self.profile,
+                'checkouts': self.checkouts,
+                'wait_ms_avg': round(self.total_wait_ms / self.checkouts, 2) if self.checkouts else 0.0,
+                'wait_ms_p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0.0,
+                'wait_ms_max': round(self.max_wait_ms, 2),
+                'timeouts': self.timeouts,
+                'overflow_checkouts': self.overflow_checkouts,
+                'peak_checked_out': self.peak_checked_out,
+                'connects': self.connects,
+                # Reconnects of an existing pool slot not caused by an invalidation are recycles
+                'recycles': max(0, self.reconnects - self.invalidations),
+                'invalidations': self.invalidations,
+            }
+        if isinstance(pool, QueuePool):
+            data.update({
+                'pool_size': pool.size(),
+                'max_overflow': pool._max_overflow,
+                'checked_out': pool.checkedout(),
+                'idle': pool.checkedin(),
+                'overflow': max(0, pool.overflow()),
+            })
+        return data
+
+    def maybe_log(self) -> None:
+        """Log a snapshot to the bridge log if the interval has passed."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_logged < LOG_INTERVAL_SECONDS:
+                return
+            self._last_logged = now
+        log_bridge_event(source="app", event="db_pool", extra=self.snapshot())
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_wait((time.perf_counter() - started) * 1000, timed_out=True)
+            raise
+        pool_stats.record_wait((time.perf_counter() - started) * 1000)
+        return connection
+
+
+def get_profile_name(database_uri: str) -> str:
+    configured = os.environ.get("DB_POOL_PROFILE", "").strip().lower()
+    if configured:
+        if configured not in PROFILES:
+            raise ValueError(f"Unknown DB_POOL_PROFILE '{configured}'. Use {', '.join(PROFILES)}.")
+        return configured
+    if database_uri.startswith("sqlite"):
+        return "sqlite"
+    return "serverless" if os.environ.get("VERCEL") else "server"
+
+
+def _env_override(options: Dict[str, Any], key: str, env_name: str, cast) -> None:
+    value = os.environ.get(env_name, "").strip()
+    if value:
+        options[key] = cast(value)
+
+
+def engine_options(database_uri: str, profile: Optional[str] = None) -> Dict[str, Any]:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a database URI.
+
+    Args:
+        database_uri: SQLALCHEMY_DATABASE_URI
+        profile: Profile name; defaults to get_profile_name()
+
+    Returns:
+        Engine options dict
+    """
+    profile = profile or get_profile_name(database_uri)
+    options = dict(_PROFILE_OPTIONS[profile])
+
+    if database_uri.startswith("sqlite"):
+        if database_uri in ("sqlite://", "sqlite:///:memory:"):
+            # In-memory databases are per connection; keep SQLAlchemy's default pool
+            return {}
+        options['connect_args'] = {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}
+    else:
+        options['connect_args'] = dict(_POSTGRES_CONNECT_ARGS)
+
+    _env_override(options, 'pool_size', "DB_POOL_SIZE", int)
+    _env_override(options, 'max_overflow', "DB_MAX_OVERFLOW", int)
+    _env_override(options, 'pool_timeout', "DB_POOL_TIMEOUT", float)
+    _env_override(options, 'pool_recycle', "DB_POOL_RECYCLE", int)
+    _env_override(options, 'pool_pre_ping', "DB_POOL_PRE_PING", lambda v: v.lower() in ("1", "true", "yes"))
+
+    options['poolclass'] = TimedQueuePool
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine, profile: str) -> None:
+    """Attach pool statistics (and SQLite pragmas) to an engine created with engine_options()."""
+    pool_stats.profile = profile
+    pool_stats.pool = engine.pool
+
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        reconnect = connection_record.record_info.get("connected", False)
+        connection_record.record_info["connected"] = True
+        pool_stats.record_connect(reconnect)
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool = engine.pool
+        if isinstance(pool, QueuePool):
+            pool_stats.record_checked_out(pool.checkedout(), pool.size())
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        pool_stats.maybe_log()
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.record_invalidation()
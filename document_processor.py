@@ -8,8 +8,11 @@ Supports PDF, DOCX, TXT, and various code/text file formats.
 import os
 import uuid
 import io
-from typing import Tuple, List, Optional
+import mmap
+from contextlib import contextmanager
+from typing import BinaryIO, Tuple, List, Optional
 from sentence_transformers import SentenceTransformer
+from request_timing import timed
 
 # Embedding model configuration (local model, no external API key required)
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
@@ -29,84 +32,154 @@ DEFAULT_CHUNK_SIZE = 1000  # characters - larger chunks for better context
 DEFAULT_OVERLAP = 100  # characters - more overlap for continuity
 
 
+@contextmanager
+def open_document(file):
+    """
+    The content of an uploaded file without copying it.
+
+    Yields (fileobj, view): a seekable file object for the parsers and a
+    read-only memoryview of the same bytes for text decoding. Disk-backed
+    files (the readers from blob_upload.open_reader(), spooled uploads) are
+    memory-mapped, so pages come from the page cache and nothing is read
+    into the Python heap; BytesIO and bytes are viewed in place. Other
+    streams are read once.
+    """
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        view = memoryview(file)
+        yield io.BytesIO(file) if isinstance(file, bytes) else _ViewReader(view), view
+        return
+    if getattr(file, 'stream', None) is not None and not isinstance(file, io.IOBase):
+        # Werkzeug FileStorage
+        file = file.stream
+
+    if isinstance(file, io.BytesIO):
+        view = file.getbuffer()
+        try:
+            yield _ViewReader(view), view
+        finally:
+            view.release()
+        return
+
+    try:
+        fd = file.fileno()
+        mapped = mmap.mmap(fd, 0, access=mmap.ACCESS_READ) if os.fstat(fd).st_size else None
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        mapped = None
+        fd = None
+    if mapped is not None:
+        view = memoryview(mapped)
+        try:
+            yield mapped, view
+        finally:
+            view.release()
+            mapped.close()
+        return
+    if fd is not None:
+        # An empty file (mmap can't map zero bytes)
+        yield io.BytesIO(b""), memoryview(b"")
+        return
+
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    content = file.read()
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    yield io.BytesIO(content), memoryview(content)
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable file object over a byte memoryview; a read copies only the bytes it returns."""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = max(0, min(len(buffer), len(self._view) - self._pos))
+        buffer[:size] = self._view[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+@timed("extraction")
 def extract_text(file, mime_type: str) -> str:
     """
     Extract text content from uploaded file.
 
+    The file is memory-mapped or viewed in place (see open_document()):
+    PDF and DOCX parsers read it as a file, text is decoded straight from
+    the mapping.
+
     Args:
-        file: File object (werkzeug FileStorage or file-like object)
+        file: File object (werkzeug FileStorage or file-like object), or bytes
         mime_type: MIME type of the file
 
     Returns:
         Extracted text content
     """
-    # Read file content - handle different file object types
-    try:
-        # Try to reset file pointer first
+    filename = (getattr(file, 'filename', None) or '').lower()
+
+    # Already text: nothing to decode
+    if hasattr(file, 'read') and isinstance(getattr(file, 'encoding', None), str):
         if hasattr(file, 'seek'):
             file.seek(0)
+        return file.read()
 
-        # Read content
-        if hasattr(file, 'read'):
-            content = file.read()
-        elif hasattr(file, 'stream'):
-            # Werkzeug FileStorage
-            file.stream.seek(0)
-            content = file.stream.read()
-        else:
-            raise ValueError("Unable to read file content")
+    try:
+        with open_document(file) as (document, view):
+            print(f"DEBUG extract_text: Mapped {len(view)} bytes from file")
+
+            # PDF extraction
+            if mime_type == "application/pdf" or filename.endswith('.pdf'):
+                return _extract_pdf(document, len(view))
+
+            # DOCX extraction
+            if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or \
+               filename.endswith('.docx'):
+                return _extract_docx(document, len(view))
 
-        # Ensure we have bytes
-        if isinstance(content, str):
-            content = content.encode('utf-8')
+            # DOC (older format) - try as text or show error
+            if mime_type == "application/msword" or filename.endswith('.doc'):
+                # .doc format requires python-docx-binary or antiword - fallback to error message
+                return "[Error: Legacy .doc format not fully supported. Please convert to .docx or .pdf]"
 
-        print(f"DEBUG extract_text: Read {len(content)} bytes from file")
+            # Plain text and code files, and the fallback for everything else
+            return _extract_text(view)
 
     except Exception as e:
         print(f"ERROR reading file: {e}")
         return f"[Error reading file: {str(e)}]"
 
-    # PDF extraction
-    if mime_type == "application/pdf" or (hasattr(file, 'filename') and file.filename.lower().endswith('.pdf')):
-        return _extract_pdf(content)
-
-    # DOCX extraction
-    if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document" or \
-       (hasattr(file, 'filename') and file.filename.lower().endswith('.docx')):
-        return _extract_docx(content)
-
-    # DOC (older format) - try as text or show error
-    if mime_type == "application/msword" or \
-       (hasattr(file, 'filename') and file.filename.lower().endswith('.doc')):
-        # .doc format requires python-docx-binary or antiword - fallback to error message
-        return "[Error: Legacy .doc format not fully supported. Please convert to .docx or .pdf]"
-
-    # Plain text and code files
-    text_mimes = [
-        "text/plain", "text/markdown", "text/html", "text/css",
-        "text/csv", "text/xml", "application/json", "application/xml",
-        "application/javascript", "text/javascript"
-    ]
-    text_extensions = ['.txt', '.md', '.py', '.js', '.json', '.csv', '.xml', '.html', '.css', '.yml', '.yaml']
-
-    if mime_type in text_mimes or \
-       (hasattr(file, 'filename') and any(file.filename.lower().endswith(ext) for ext in text_extensions)):
-        return _extract_text(content)
-
-    # Fallback: try to decode as text
-    return _extract_text(content)
-
 
-def _extract_pdf(content: bytes) -> str:
-    """Extract text from PDF content using pdfplumber (primary) or PyPDF2 (fallback)."""
-    print(f"DEBUG _extract_pdf: Processing PDF with {len(content)} bytes")
+def _extract_pdf(document: BinaryIO, size: int) -> str:
+    """Extract text from a PDF file object using pdfplumber (primary) or PyPDF2 (fallback)."""
+    print(f"DEBUG _extract_pdf: Processing PDF with {size} bytes")
 
     # Try pdfplumber first - better for complex PDFs
     try:
         import pdfplumber
 
         text_parts = []
-        with pdfplumber.open(io.BytesIO(content)) as pdf:
+        document.seek(0)
+        with pdfplumber.open(document) as pdf:
             print(f"DEBUG _extract_pdf: PDF has {len(pdf.pages)} pages (pdfplumber)")
 
             for page_num, page in enumerate(pdf.pages):
@@ -145,7 +218,8 @@ def _extract_pdf(content: bytes) -> str:
     try:
         from PyPDF2 import PdfReader
 
-        reader = PdfReader(io.BytesIO(content))
+        document.seek(0)
+        reader = PdfReader(document)
         print(f"DEBUG _extract_pdf: PDF has {len(reader.pages)} pages (PyPDF2)")
 
         text_parts = []
@@ -173,13 +247,14 @@ def _extract_pdf(content: bytes) -> str:
     return "[No extractable text found in PDF. The PDF may contain only images or scanned content.]"
 
 
-def _extract_docx(content: bytes) -> str:
-    """Extract text from DOCX content."""
+def _extract_docx(document: BinaryIO, size: int) -> str:
+    """Extract text from a DOCX file object."""
     try:
         from docx import Document
 
-        print(f"DEBUG _extract_docx: Processing DOCX with {len(content)} bytes")
-        doc = Document(io.BytesIO(content))
+        print(f"DEBUG _extract_docx: Processing DOCX with {size} bytes")
+        document.seek(0)
+        doc = Document(document)
         text_parts = []
 
         # Extract paragraphs
@@ -210,8 +285,8 @@ def _extract_docx(content: bytes) -> str:
         return f"[Error extracting DOCX text: {str(e)}]"
 
 
-def _extract_text(content: bytes) -> str:
-    """Extract text from plain text content."""
+def _extract_text(content) -> str:
+    """Extract text from plain text content (bytes or a memoryview, decoded without copying it first)."""
     print(f"DEBUG _extract_text: Processing text with {len(content)} bytes")
 
     # Try common encodings
@@ -219,18 +294,19 @@ def _extract_text(content: bytes) -> str:
 
     for encoding in encodings:
         try:
-            result = content.decode(encoding)
+            result = str(content, encoding)
             print(f"DEBUG _extract_text: Decoded with {encoding}, got {len(result)} chars")
             return result
         except (UnicodeDecodeError, LookupError):
             continue
 
     # Fallback: decode with errors ignored
-    result = content.decode('utf-8', errors='ignore')
+    result = str(content, 'utf-8', errors='ignore')
     print(f"DEBUG _extract_text: Fallback decode, got {len(result)} chars")
     return result
 
 
+@timed("chunking")
 def chunk_text(
     text: str,
     chunk_size: int = DEFAULT_CHUNK_SIZE,
@@ -280,6 +356,7 @@ def chunk_text(
     return chunks
 
 
+@timed("embedding")
 def generate_embeddings(texts: List[str]) -> List[List[float]]:
     """
     Generate embeddings for a list of texts using a local embedding model.
@@ -298,6 +375,7 @@ def generate_embeddings(texts: List[str]) -> List[List[float]]:
     return vectors
 
 
+@timed("embedding")
 def generate_query_embedding(query: str) -> List[float]:
     """
     Generate embedding for a single query string.
@@ -380,6 +458,7 @@ def estimate_tokens(text: str) -> int:
         return len(text) // 4
 
 
+@timed("prompt_build")
 def build_context_prompt(
     query: str,
     retrieved_chunks: List[str],
@@ -0,0 +1,313 @@
+"""
+Chat History Cache for Ask-Chopper
+
+Keeps each session's conversation history as pre-formatted Anthropic message
+dicts so a chat turn does not re-query and re-hydrate ChatMessage rows.
+
+The cache is write-through: ChatMessage inserts are appended to the cached
+history once their transaction commits, and any update or delete of a
+ChatMessage invalidates that session. Entries are evicted after
+CHAT_HISTORY_CACHE_TTL seconds of inactivity.
+
+Backends (CHAT_HISTORY_CACHE):
+    off     - always read from the database (default)
+    sqlite  - shared SQLite file at CHAT_HISTORY_CACHE_PATH (several workers
+              or processes on one machine)
+    memory  - in-process dict; only for a single process that is the only
+              writer of chat_messages, since it never sees other processes'
+              commits (other gunicorn workers, telegram_bot.py,
+              manage_retention.py) and would serve stale history until the TTL
+"""
+
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, ChatMessage
+
+# Number of messages sent to the model as conversation context
+HISTORY_LIMIT = 10
+
+CACHE_TTL_SECONDS = int(os.environ.get("CHAT_HISTORY_CACHE_TTL", "1800"))
+CACHE_MAX_SESSIONS = int(os.environ.get("CHAT_HISTORY_CACHE_MAX_SESSIONS", "1000"))
+
+_PENDING_KEY = "chat_history_pending"
+_INVALIDATED_KEY = "chat_history_invalidated"
+
+
+def format_history_message(message_type: str, content: str) -> Optional[Dict[str, str]]:
+    """Convert a stored chat message into an Anthropic message dict."""
+    if message_type == "user":
+        return {"role": "user", "content": content}
+    if message_type == "assistant":
+        # Remove [Chopper]: prefix for clean conversation history
+        return {"role": "assistant", "content": content.replace("[Chopper]: ", "")}
+    return None
+
+
+class MemoryHistoryBackend:
+    """In-process LRU of session histories with idle-time eviction."""
+
+    def __init__(self, ttl: int, max_sessions: int):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            item = self._entries.get(session_id)
+            if item is None:
+                return None
+            touched_at, history = item
+            now = time.monotonic()
+            if now - touched_at > self.ttl:
+                del self._entries[session_id]
+                return None
+            self._entries[session_id] = (now, history)
+            self._entries.move_to_end(session_id)
+            return list(history)
+
+    def set(self, session_id: str, history: List[Dict[str, str]]) -> None:
+        with self._lock:
+            self._entries[session_id] = (time.monotonic(), list(history))
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def append(self, session_id: str, entries: List[Dict[str, str]], limit: int) -> None:
+        with self._lock:
+            item = self._entries.get(session_id)
+            if item is None:
+                return
+            history = item[1]
+            history.extend(entries[:max(0, limit - len(history))])
+            self._entries[session_id] = (time.monotonic(), history)
+
+    def invalidate(self, session_id: str) -> None:
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteHistoryBackend:
+    """Session histories shared between worker processes through a SQLite file."""
+
+    def __init__(self, path: str, ttl: int, max_sessions: int):
+        self.path = path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._ops = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_history_cache ("
+                "session_id TEXT PRIMARY KEY, payload TEXT NOT NULL, touched_at REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _maybe_evict(self, conn) -> None:
+        self._ops += 1
+        if self._ops % 100:
+            return
+        conn.execute("DELETE FROM chat_history_cache WHERE touched_at < ?", (time.time() - self.ttl,))
+        conn.execute(
+            "DELETE FROM chat_history_cache WHERE session_id NOT IN ("
+            "SELECT session_id FROM chat_history_cache ORDER BY touched_at DESC LIMIT ?)",
+            (self.max_sessions,)
+        )
+
+    def get(self, session_id: str) -> Optional[List[Dict[str, str]]]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT payload FROM chat_history_cache WHERE session_id = ? AND touched_at >= ?",
+                (session_id, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE chat_history_cache SET touched_at = ? WHERE session_id = ?",
+                (now, session_id)
+            )
+            return json.loads(row[0])
+
+    def set(self, session_id: str, history: List[Dict[str, str]]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chat_history_cache (session_id, payload, touched_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(history), time.time())
+            )
+            self._maybe_evict(conn)
+
+    def append(self, session_id: str, entries: List[Dict[str, str]], limit: int) -> None:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT payload FROM chat_history_cache WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is not None:
+                    history = json.loads(row[0])
+                    history.extend(entries[:max(0, limit - len(history))])
+                    conn.execute(
+                        "UPDATE chat_history_cache SET payload = ?, touched_at = ? WHERE session_id = ?",
+                        (json.dumps(history), time.time(), session_id)
+                    )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def invalidate(self, session_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chat_history_cache WHERE session_id = ?", (session_id,))
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chat_history_cache")
+
+
+def _create_backend():
+    # Off unless chosen: a per-process cache goes stale as soon as another process writes
+    mode = (os.environ.get("CHAT_HISTORY_CACHE") or "off").strip().lower()
+
+    if mode == "sqlite":
+        path = os.environ.get("CHAT_HISTORY_CACHE_PATH", "").strip() or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "instance", "chat_history_cache.db"
+        )
+        return SQLiteHistoryBackend(path, CACHE_TTL_SECONDS, CACHE_MAX_SESSIONS)
+    if mode == "memory":
+        return MemoryHistoryBackend(CACHE_TTL_SECONDS, CACHE_MAX_SESSIONS)
+    return None
+
+
+_backend = _create_backend()
+
+
+def _safe_backend_call(method: str, *args):
+    """Run a backend operation; cache failures must never break a chat turn."""
+    if _backend is None:
+        return None
+    try:
+        return getattr(_backend, method)(*args)
+    except Exception as e:
+        print(f"WARNING: chat history cache {method} failed: {e}")
+        return None
+
+
+def _pending_for_session(session, session_id: str):
+    return [
+        (message_id, entry)
+        for pending_session_id, message_id, entry in session.info.get(_PENDING_KEY, [])
+        if pending_session_id == session_id
+    ]
+
+
+def get_conversation_history(session_id: str, limit: int = HISTORY_LIMIT) -> List[Dict[str, str]]:
+    """
+    Get conversation history for a chat session as Anthropic message dicts.
+
+    Messages flushed in the current (uncommitted) transaction are included,
+    matching what a direct query would return, but only committed messages
+    are stored in the cache.
+
+    Args:
+        session_id: Chat session ID
+        limit: Maximum number of messages to return
+
+    Returns:
+        List of {"role", "content"} dicts in chronological order
+    """
+    pending = _pending_for_session(db.session, session_id)
+    pending_entries = [entry for _, entry in pending]
+
+    if limit <= HISTORY_LIMIT:
+        cached = _safe_backend_call("get", session_id)
+        if cached is not None:
+            return (cached + pending_entries)[:limit]
+
+    # Pending rows are the newest in the session, so widening the window by
+    # their count still yields the first HISTORY_LIMIT committed messages
+    pending_ids = {message_id for message_id, _ in pending}
+    rows = db.session.query(
+        ChatMessage.id, ChatMessage.message_type, ChatMessage.content
+    ).filter_by(
+        session_id=session_id
+    ).order_by(ChatMessage.created_at).limit(max(limit, HISTORY_LIMIT) + len(pending_ids)).all()
+
+    history = []
+    committed = []
+    for message_id, message_type, content in rows:
+        entry = format_history_message(message_type, content)
+        if entry is None:
+            continue
+        history.append(entry)
+        if message_id not in pending_ids:
+            committed.append(entry)
+
+    _safe_backend_call("set", session_id, committed[:HISTORY_LIMIT])
+    return history[:limit]
+
+
+def invalidate_session_history(session_id: str) -> None:
+    """Drop the cached history for a session."""
+    _safe_backend_call("invalidate", session_id)
+
+
+def clear_history_cache() -> None:
+    """Drop all cached histories."""
+    _safe_backend_call("clear")
+
+
+@event.listens_for(Session, "after_flush")
+def _track_chat_message_writes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, ChatMessage):
+            entry = format_history_message(obj.message_type, obj.content)
+            if entry is not None:
+                session.info.setdefault(_PENDING_KEY, []).append((obj.session_id, obj.id, entry))
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ChatMessage):
+            session.info.setdefault(_INVALIDATED_KEY, set()).add(obj.session_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_chat_message_writes(session):
+    pending = session.info.pop(_PENDING_KEY, [])
+    invalidated = session.info.pop(_INVALIDATED_KEY, set())
+
+    appends = OrderedDict()
+    for session_id, _, entry in pending:
+        if session_id not in invalidated:
+            appends.setdefault(session_id, []).append(entry)
+
+    for session_id in invalidated:
+        invalidate_session_history(session_id)
+    for session_id, entries in appends.items():
+        _safe_backend_call("append", session_id, entries, HISTORY_LIMIT)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_chat_message_writes(session):
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_INVALIDATED_KEY, None)
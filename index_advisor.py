@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Index advisor for Ask-Chopper.
+
+Replays the app's hot query shapes against the configured database with
+EXPLAIN and reports:
+
+    - indexes declared on the models but missing from the database
+    - queries whose plan scans a whole table
+    - indexes on the app's tables that no replayed query uses
+    - queries that sort rows no index returns in order
+
+Read paths run through the app's own query functions while their SQL is
+captured (the transaction is rolled back afterwards); write statements are
+only EXPLAINed, never executed. PostgreSQL plans come from EXPLAIN (FORMAT
+JSON), SQLite plans from EXPLAIN QUERY PLAN. On PostgreSQL the unused index
+report also shows idx_scan from pg_stat_user_indexes, i.e. real usage since
+the statistics were last reset.
+
+Usage:
+    python3 index_advisor.py
+    python3 index_advisor.py --verbose   # print every plan
+"""
+
+import argparse
+import json
+import re
+import sys
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from sqlalchemy import event
+
+from app import app, db
+from models import ChatMessage, DocumentUpload, SupportChat
+from history_cache import get_conversation_history
+from message_history import get_chat_history_page, get_support_chat_page
+from read_receipts import mark_read_statement
+from support_inbox import get_admin_inbox
+
+SQLITE_INDEX_RE = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+
+
+def sample_values():
+    """Real ids from the database so plans reflect actual data; placeholders on an empty one."""
+    session_id = db.session.query(ChatMessage.session_id).order_by(ChatMessage.id.desc()).limit(1).scalar()
+    support_user_id = db.session.query(SupportChat.user_id).order_by(SupportChat.id.desc()).limit(1).scalar()
+    newest_support_id = db.session.query(db.func.max(SupportChat.id)).scalar() or 0
+    document = db.session.query(
+        DocumentUpload.user_id, DocumentUpload.session_id
+    ).order_by(DocumentUpload.id.desc()).first()
+    return {
+        'session_id': session_id or 'default',
+        'support_user_id': support_user_id or 1,
+        'newest_support_id': newest_support_id,
+        'document_user_id': document.user_id if document else 1,
+        'document_session_id': document.session_id if document else 'default',
+    }
+
+
+def read_workloads(values):
+    """(name, callable) pairs running the app's read queries."""
+    return [
+        ("chat history page", lambda: get_chat_history_page(values['session_id'])),
+        ("chat history older page", lambda: get_chat_history_page(values['session_id'], before_id=2 ** 31)),
+        ("conversation context", lambda: get_conversation_history(values['session_id'], limit=1000)),
+        ("support chat page", lambda: get_support_chat_page(values['support_user_id'])),
+        ("admin inbox", lambda: get_admin_inbox()),
+        ("session documents", lambda: DocumentUpload.query.filter_by(
+            user_id=values['document_user_id'], session_id=values['document_session_id']
+        ).order_by(DocumentUpload.uploaded_at.desc()).all()),
+        ("support event replay", lambda: db.session.query(SupportChat.id).filter(
+            SupportChat.id > values['newest_support_id'] - 200,
+            SupportChat.user_id == values['support_user_id']
+        ).order_by(SupportChat.id).limit(200).all()),
+    ]
+
+
+def write_statements(values):
+    """(name, statement) pairs for write paths; EXPLAINed only."""
+    return [
+        ("mark read (user)", mark_read_statement(values['support_user_id'], 'admin')),
+        ("mark read (admin)", mark_read_statement(values['support_user_id'], 'user')),
+    ]
+
+
+def capture_statements(workloads):
+    """Run each workload, recording the SQL it sends. Returns [(name, sql, params)]."""
+    captured = []
+    current = [None]
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if current[0] and not executemany and not statement.lstrip().upper().startswith("EXPLAIN"):
+            captured.append((current[0], statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        for name, run in workloads:
+            current[0] = name
+            try:
+                run()
+            except Exception as e:
+                print(f"⚠️  {name}: {e}")
+        current[0] = None
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+        db.session.rollback()
+    return captured
+
+
+def compile_statement(statement):
+    """Driver SQL and parameters for a SQLAlchemy statement."""
+    compiled = statement.compile(dialect=db.engine.dialect)
+    if compiled.positiontup is not None:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    return str(compiled), params
+
+
+def explain(connection, sql, params):
+    """
+    EXPLAIN a statement.
+
+    Returns:
+        (plan_lines, full_scans, indexes_used, sorts): full_scans holds table
+        names read without an index, sorts the number of sort steps
+    """
+    if connection.dialect.name == "postgresql":
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        lines, full_scans, used, sorts = [], [], set(), [0]
+
+        def walk(node, depth):
+            label = node["Node Type"]
+            if node.get("Relation Name"):
+                label += f" on {node['Relation Name']}"
+            if node.get("Index Name"):
+                label += f" using {node['Index Name']}"
+                used.add(node["Index Name"])
+            lines.append(f"{'  ' * depth}{label} (rows={node.get('Plan Rows')})")
+            if node["Node Type"] == "Seq Scan":
+                full_scans.append(node["Relation Name"])
+            if node["Node Type"] in ("Sort", "Incremental Sort"):
+                sorts[0] += 1
+            for child in node.get("Plans", []):
+                walk(child, depth + 1)
+
+        walk(plan[0]["Plan"], 0)
+        return lines, full_scans, used, sorts[0]
+
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params).all()
+    lines, full_scans, used, sorts = [], [], set(), 0
+    table_names = set(db.metadata.tables)
+    for row in rows:
+        detail = row[-1]
+        lines.append(detail)
+        used.update(SQLITE_INDEX_RE.findall(detail))
+        parts = detail.split()
+        if len(parts) >= 2 and parts[0] == "SCAN" and parts[1] in table_names and "USING" not in detail:
+            full_scans.append(parts[1])
+        if detail.startswith("USE TEMP B-TREE FOR ORDER BY"):
+            sorts += 1
+    return lines, full_scans, used, sorts
+
+
+def database_indexes(inspector):
+    """{index_name: (table, columns)} for the app's tables, as they exist in the database."""
+    indexes = {}
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        for index in inspector.get_indexes(table.name):
+            indexes[index['name']] = (table.name, index['column_names'])
+    return indexes
+
+
+def index_scan_counts(connection):
+    """idx_scan per index from pg_stat_user_indexes (PostgreSQL only)."""
+    if connection.dialect.name != "postgresql":
+        return {}
+    rows = connection.exec_driver_sql("SELECT indexrelname, idx_scan FROM pg_stat_user_indexes").all()
+    return {name: scans for name, scans in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check indexes against the app's query shapes")
+    parser.add_argument("--verbose", action="store_true", help="Print every query plan")
+    args = parser.parse_args()
+
+    with app.app_context():
+        inspector = db.inspect(db.engine)
+        existing = database_indexes(inspector)
+
+        print(f"Index advisor ({db.engine.dialect.name})\n")
+
+        missing = [
+            (index.name, table.name, [col.name for col in index.columns])
+            for table in db.metadata.sorted_tables
+            for index in table.indexes
+            if inspector.has_table(table.name) and index.name not in existing
+        ]
+        print("Declared indexes missing from the database:")
+        for name, table, columns in missing:
+            print(f"  ❌ {name} on {table}({', '.join(columns)})")
+        if missing:
+            print("  Run `flask db upgrade` or `python3 create_indexes.py`.")
+        else:
+            print("  ✅ none")
+
+        values = sample_values()
+        statements = capture_statements(read_workloads(values))
+        statements += [(name, *compile_statement(stmt)) for name, stmt in write_statements(values)]
+
+        used = set()
+        scans = []
+        sorted_statements = []
+        with db.engine.connect() as connection:
+            for name, sql, params in statements:
+                try:
+                    lines, full_scans, indexes_used, sorts = explain(connection, sql, params)
+                except Exception as e:
+                    print(f"⚠️  Could not EXPLAIN {name}: {str(e)[:80]}")
+                    continue
+                used |= indexes_used
+                for table in full_scans:
+                    scans.append((name, table))
+                if sorts:
+                    sorted_statements.append(name)
+                if args.verbose:
+                    print(f"\n{name}:\n  {' '.join(sql.split())[:200]}")
+                    for line in lines:
+                        print(f"    {line}")
+            scan_counts = index_scan_counts(connection)
+
+        print(f"\nFull table scans in {len(statements)} replayed statements:")
+        for name, table in sorted(set(scans)):
+            print(f"  ⚠️  {name}: scans {table}")
+        if not scans:
+            print("  ✅ none")
+        if scans and db.engine.dialect.name == "postgresql":
+            print("  (PostgreSQL seq-scans small tables on purpose; recheck on production-sized data.)")
+
+        print("\nSorts not served by an index (fine for small result sets):")
+        for name in sorted(set(sorted_statements)):
+            print(f"  ℹ️  {name}")
+        if not sorted_statements:
+            print("  ✅ none")
+
+        unused = sorted(name for name in existing if name not in used)
+        print("\nIndexes no replayed query uses:")
+        for name in unused:
+            table, columns = existing[name]
+            usage = f" - idx_scan={scan_counts[name]}" if name in scan_counts else ""
+            print(f"  ℹ️  {name} on {table}({', '.join(columns)}){usage}")
+        if not unused:
+            print("  ✅ none")
+
+        return not missing
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Archive and restore old chat history (see retention.py).
+
+Usage:
+    python3 manage_retention.py status
+    python3 manage_retention.py archive [--dry-run] [--table chat_messages] [--format jsonl|parquet|table]
+                                        [--batch-size 200] [--max-batches N] [--vacuum]
+    python3 manage_retention.py restore chat_messages <session_id>
+    python3 manage_retention.py restore support_chats <user_id>
+"""
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from app import app, db
+import retention
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Chat retention and archival")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("status", help="Show hot/archived row counts and groups due for archiving")
+
+    archive_parser = commands.add_parser("archive", help="Archive groups idle past their retention policy")
+    archive_parser.add_argument("--table", action="append", choices=sorted(retention.get_policies()),
+                                help="Table to archive (repeatable); default: every enabled policy")
+    archive_parser.add_argument("--format", choices=retention.FORMATS, help="Default: RETENTION_FORMAT")
+    archive_parser.add_argument("--batch-size", type=int, default=retention.BATCH_SIZE)
+    archive_parser.add_argument("--max-batches", type=int)
+    archive_parser.add_argument("--dry-run", action="store_true", help="Only count what would be archived")
+    archive_parser.add_argument("--vacuum", action="store_true", help="VACUUM (ANALYZE) afterwards (PostgreSQL)")
+
+    restore_parser = commands.add_parser("restore", help="Move an archived group back into its table")
+    restore_parser.add_argument("table", choices=sorted(retention.get_policies()))
+    restore_parser.add_argument("group", help="session_id (chat_messages) or user_id (support_chats)")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with app.app_context():
+        try:
+            if args.command == "status":
+                for table, info in retention.status().items():
+                    policy = f"{info['days']} days" if info['days'] > 0 else "disabled"
+                    print(f"{table} (retention: {policy})")
+                    print(f"  hot rows:      {info['hot_rows']}")
+                    print(f"  groups due:    {info['groups_due']}")
+                    table_rows = info['archived_table_rows']
+                    print(f"  archived rows: {info['archived_rows']} "
+                          f"(files: {info['archived_file_rows']}, "
+                          f"table: {table_rows if table_rows is not None else '-'})")
+                    if info['partitions']:
+                        print(f"  partitions:    {', '.join(info['partitions'])}")
+
+            elif args.command == "archive":
+                label = "Would archive" if args.dry_run else "Archived"
+                results = retention.archive(
+                    tables=args.table, fmt=args.format, dry_run=args.dry_run,
+                    batch_size=args.batch_size, max_batches=args.max_batches
+                )
+                for table, stats in results.items():
+                    print(f"✅ {table}: {label.lower()} {stats['groups']} groups, "
+                          f"{stats['rows']} rows in {stats['batches']} batches")
+                if args.vacuum and not args.dry_run:
+                    retention.vacuum_hot_tables()
+
+            elif args.command == "restore":
+                restored = retention.restore(args.table, args.group)
+                print(f"✅ Restored {restored} rows into {args.table}")
+            return True
+
+        except Exception as e:
+            print(f"\n❌ Retention {args.command} failed: {e}")
+            db.session.rollback()
+            return False
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,179 @@
+"""
+Message History Pages for Ask-Chopper
+
+Cursor-paginated reads of assistant chat history and support chat for the
+history APIs. A page is the newest `limit` messages older than `before_id`,
+returned oldest-first; `next_before_id` fetches the page before it.
+
+Pages are read as column rows rather than ORM objects. Attachments for a
+page are loaded with one IN query on the page's message ids (the query
+selectinload would issue) instead of one lazy load per message.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+
+from models import db, ChatMessage, MessageAttachment, SupportChat
+from thumbnails import thumbnail_variants
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+_CHAT_COLUMNS = (
+    ChatMessage.id,
+    ChatMessage.session_id,
+    ChatMessage.message_type,
+    ChatMessage.content,
+    ChatMessage.formatted_content,
+    ChatMessage.has_attachments,
+    ChatMessage.created_at
+)
+
+_ATTACHMENT_COLUMNS = (
+    MessageAttachment.id,
+    MessageAttachment.message_id,
+    MessageAttachment.filename,
+    MessageAttachment.original_filename,
+    MessageAttachment.file_size,
+    MessageAttachment.mime_type,
+    MessageAttachment.thumbnail_path,
+    MessageAttachment.uploaded_at
+)
+
+_SUPPORT_COLUMNS = (
+    SupportChat.id,
+    SupportChat.user_id,
+    SupportChat.sender_type,
+    SupportChat.message,
+    SupportChat.is_read,
+    SupportChat.created_at
+)
+
+
+def parse_page_args(args) -> Tuple[Optional[int], int]:
+    """
+    Read before_id and limit from request query args.
+
+    Args:
+        args: request.args
+
+    Returns:
+        (before_id, limit), limit clamped to 1..MAX_PAGE_SIZE
+
+    Raises:
+        ValueError: If either value is not an integer
+    """
+    before_id = args.get('before_id')
+    limit = args.get('limit')
+    try:
+        before_id = int(before_id) if before_id not in (None, '') else None
+        limit = int(limit) if limit not in (None, '') else DEFAULT_PAGE_SIZE
+    except ValueError as e:
+        raise ValueError("before_id and limit must be integers") from e
+    return before_id, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _page(id_column, filters, columns, before_id: Optional[int], limit: int) -> Tuple[List[Any], Optional[int]]:
+    """Newest `limit` rows before `before_id`, oldest-first, and the cursor for the previous page."""
+    query = select(*columns).where(*filters)
+    if before_id is not None:
+        query = query.where(id_column < before_id)
+    rows = db.session.execute(query.order_by(id_column.desc()).limit(limit + 1)).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    next_before_id = rows[0].id if has_more and rows else None
+    return rows, next_before_id
+
+
+def _attachments_by_message(message_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    attachments = defaultdict(list)
+    if not message_ids:
+        return attachments
+    rows = db.session.execute(
+        select(*_ATTACHMENT_COLUMNS)
+        .where(MessageAttachment.message_id.in_(message_ids))
+        .order_by(MessageAttachment.id)
+    )
+    for row in rows:
+        # Same shape as MessageAttachment.to_dict()
+        attachments[row.message_id].append({
+            'id': row.id,
+            'filename': row.filename,
+            'original_filename': row.original_filename,
+            'file_size': row.file_size,
+            'mime_type': row.mime_type,
+            'thumbnail_path': row.thumbnail_path,
+            'thumbnails': thumbnail_variants(row.thumbnail_path),
+            'uploaded_at': _isoformat(row.uploaded_at)
+        })
+    return attachments
+
+
+def get_chat_history_page(session_id: str, before_id: Optional[int] = None,
+                          limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Get one page of a chat session's messages with their attachments.
+
+    Args:
+        session_id: Chat session id
+        before_id: Only messages with a smaller id (next_before_id of the previous call)
+        limit: Page size
+
+    Returns:
+        Dict with 'messages' (ChatMessage.to_dict() shape, oldest first),
+        'next_before_id' and 'has_more'
+    """
+    rows, next_before_id = _page(
+        ChatMessage.id, [ChatMessage.session_id == session_id], _CHAT_COLUMNS, before_id, limit
+    )
+    attachments = _attachments_by_message([row.id for row in rows])
+
+    messages = [{
+        'id': row.id,
+        'session_id': row.session_id,
+        'message_type': row.message_type,
+        'content': row.content,
+        'formatted_content': row.formatted_content,
+        'has_attachments': row.has_attachments,
+        'created_at': _isoformat(row.created_at),
+        'attachments': attachments.get(row.id, [])
+    } for row in rows]
+
+    return {'messages': messages, 'next_before_id': next_before_id, 'has_more': next_before_id is not None}
+
+
+def get_support_chat_page(user_id: int, before_id: Optional[int] = None,
+                          limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """
+    Get one page of a user's support conversation.
+
+    Args:
+        user_id: User whose conversation to read
+        before_id: Only messages with a smaller id (next_before_id of the previous call)
+        limit: Page size
+
+    Returns:
+        Dict with 'messages' (SupportChat.to_dict() shape, oldest first),
+        'next_before_id' and 'has_more'
+    """
+    rows, next_before_id = _page(
+        SupportChat.id, [SupportChat.user_id == user_id], _SUPPORT_COLUMNS, before_id, limit
+    )
+    messages = [{
+        'id': row.id,
+        'user_id': row.user_id,
+        'sender_type': row.sender_type,
+        'message': row.message,
+        'is_read': row.is_read,
+        'created_at': _isoformat(row.created_at)
+    } for row in rows]
+
+    return {'messages': messages, 'next_before_id': next_before_id, 'has_more': next_before_id is not None}
@@ -0,0 +1,37 @@
+"""Add deletion_tombstones for deferred storage deletes
+
+Revision ID: 3d9f6c2a8b41
+Revises: e4a7b2c91f36
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3d9f6c2a8b41'
+down_revision = 'e4a7b2c91f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'deletion_tombstones',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('target', sa.String(length=500), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        if_not_exists=True
+    )
+    op.create_index('ix_deletion_tombstones_due', 'deletion_tombstones', ['next_attempt_at', 'id'],
+                    if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_deletion_tombstones_due', table_name='deletion_tombstones', if_exists=True)
+    op.drop_table('deletion_tombstones')
@@ -0,0 +1,42 @@
+"""Add composite indexes for hot chat, support and document queries
+
+Revision ID: 5b7e2d9c4a18
+Revises: 981431e3c2b0
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2d9c4a18'
+down_revision = '981431e3c2b0'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_chat_messages_session_created', 'chat_messages', ['session_id', 'created_at']),
+    ('ix_message_attachments_message_id', 'message_attachments', ['message_id']),
+    ('ix_support_chats_user_sender_read', 'support_chats', ['user_id', 'sender_type', 'is_read']),
+    ('ix_document_uploads_user_session_uploaded', 'document_uploads', ['user_id', 'session_id', 'uploaded_at']),
+]
+
+# Single-column indexes from the old create_indexes.py that the composites above lead with
+SUPERSEDED_INDEXES = [
+    ('idx_chat_messages_session_id', 'chat_messages'),
+    ('idx_message_attachments_message_id', 'message_attachments'),
+    ('idx_document_uploads_user_id', 'document_uploads'),
+]
+
+
+def upgrade():
+    # Tables may have been created by db.create_all() with these indexes already
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, if_not_exists=True)
+    for name, table in SUPERSEDED_INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
+
+
+def downgrade():
+    for name, table, columns in INDEXES:
+        op.drop_index(name, table_name=table, if_exists=True)
@@ -0,0 +1,77 @@
+"""Add archive tables for chat and support chat retention
+
+Revision ID: 7c3f1a9e5d20
+Revises: 5b7e2d9c4a18
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7c3f1a9e5d20'
+down_revision = '5b7e2d9c4a18'
+branch_labels = None
+depends_on = None
+
+
+def _partition_kwargs():
+    # Range-partitioned by month on PostgreSQL; retention.py adds the monthly partitions
+    if op.get_bind().dialect.name == 'postgresql':
+        return {'postgresql_partition_by': 'RANGE (created_at)'}
+    return {}
+
+
+def _create_default_partition(table):
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT')
+
+
+def upgrade():
+    op.create_table(
+        'chat_messages_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('session_id', sa.String(length=100), nullable=False),
+        sa.Column('message_type', sa.String(length=20), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('formatted_content', sa.Text(), nullable=True),
+        sa.Column('has_attachments', sa.Boolean(), nullable=True),
+        sa.Column('openai_thread_id', sa.String(length=100), nullable=True),
+        sa.Column('openai_message_id', sa.String(length=100), nullable=True),
+        sa.Column('response_time_ms', sa.Integer(), nullable=True),
+        sa.Column('thread_id', sa.String(length=100), nullable=True),
+        sa.Column('run_id', sa.String(length=100), nullable=True),
+        sa.Column('has_document_context', sa.Boolean(), nullable=True),
+        sa.Column('attachments', sa.JSON(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        if_not_exists=True,
+        **_partition_kwargs()
+    )
+    op.create_index('ix_chat_messages_archive_session', 'chat_messages_archive', ['session_id'], if_not_exists=True)
+    _create_default_partition('chat_messages_archive')
+
+    op.create_table(
+        'support_chats_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('sender_type', sa.String(length=20), nullable=False),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('is_read', sa.Boolean(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id', 'created_at'),
+        if_not_exists=True,
+        **_partition_kwargs()
+    )
+    op.create_index('ix_support_chats_archive_user', 'support_chats_archive', ['user_id'], if_not_exists=True)
+    _create_default_partition('support_chats_archive')
+
+
+def downgrade():
+    # Dropping a partitioned table drops its partitions
+    op.drop_index('ix_support_chats_archive_user', table_name='support_chats_archive', if_exists=True)
+    op.drop_table('support_chats_archive')
+    op.drop_index('ix_chat_messages_archive_session', table_name='chat_messages_archive', if_exists=True)
+    op.drop_table('chat_messages_archive')
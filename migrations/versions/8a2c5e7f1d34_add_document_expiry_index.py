@@ -0,0 +1,24 @@
+"""Add index on document_uploads.expires_at for the expired-document reaper
+
+Revision ID: 8a2c5e7f1d34
+Revises: 3d9f6c2a8b41
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8a2c5e7f1d34'
+down_revision = '3d9f6c2a8b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_document_uploads_expires_at', 'document_uploads', ['expires_at'],
+                    if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_document_uploads_expires_at', table_name='document_uploads', if_exists=True)
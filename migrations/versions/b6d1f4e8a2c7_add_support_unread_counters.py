@@ -0,0 +1,56 @@
+"""Add support_unread_counters and backfill them from support_chats
+
+Revision ID: b6d1f4e8a2c7
+Revises: 8a2c5e7f1d34
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b6d1f4e8a2c7'
+down_revision = '8a2c5e7f1d34'
+branch_labels = None
+depends_on = None
+
+# Same counters as support_counters.rebuild_unread_counters(); the marker row
+# tells the app they are complete, so it doesn't rebuild them on first use
+BACKFILL_SQL = (
+    "INSERT INTO support_unread_counters (counter_key, unread_count, version, updated_at) "
+    "SELECT 'user:' || CAST(user_id AS VARCHAR(20)), COUNT(*), 1, :now FROM support_chats "
+    "WHERE is_read = :unread AND sender_type = 'admin' AND user_id IS NOT NULL GROUP BY user_id",
+
+    "INSERT INTO support_unread_counters (counter_key, unread_count, version, updated_at) "
+    "SELECT 'admin', COUNT(*), 1, :now FROM support_chats "
+    "WHERE is_read = :unread AND sender_type = 'user'",
+
+    "INSERT INTO support_unread_counters (counter_key, unread_count, version, updated_at) "
+    "VALUES ('__built__', 0, 1, :now)",
+)
+
+
+def upgrade():
+    op.create_table(
+        'support_unread_counters',
+        sa.Column('counter_key', sa.String(length=50), nullable=False),
+        sa.Column('unread_count', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('counter_key'),
+        if_not_exists=True
+    )
+
+    # The table may have been created (and filled) by db.create_all() already
+    bind = op.get_bind()
+    if bind.execute(sa.text('SELECT COUNT(*) FROM support_unread_counters')).scalar():
+        return
+    params = {'now': datetime.utcnow(), 'unread': False}
+    for statement in BACKFILL_SQL:
+        bind.execute(sa.text(statement), params)
+
+
+def downgrade():
+    op.drop_table('support_unread_counters')
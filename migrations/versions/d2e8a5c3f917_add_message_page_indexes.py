@@ -0,0 +1,27 @@
+"""Add (session_id, id) and (user_id, id) indexes for the message pages
+
+Revision ID: d2e8a5c3f917
+Revises: b6d1f4e8a2c7
+Create Date: 2026-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd2e8a5c3f917'
+down_revision = 'b6d1f4e8a2c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_chat_messages_session_id_id', 'chat_messages', ['session_id', 'id'],
+                    if_not_exists=True)
+    op.create_index('ix_support_chats_user_id_id', 'support_chats', ['user_id', 'id'],
+                    if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_support_chats_user_id_id', table_name='support_chats', if_exists=True)
+    op.drop_index('ix_chat_messages_session_id_id', table_name='chat_messages', if_exists=True)
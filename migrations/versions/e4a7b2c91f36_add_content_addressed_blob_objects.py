@@ -0,0 +1,49 @@
+"""Add blob_objects and content_sha256 for content-addressed file storage
+
+Revision ID: e4a7b2c91f36
+Revises: 7c3f1a9e5d20
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7b2c91f36'
+down_revision = '7c3f1a9e5d20'
+branch_labels = None
+depends_on = None
+
+OWNER_TABLES = ('message_attachments', 'document_uploads')
+
+
+def _has_column(table, column):
+    return column in {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade():
+    op.create_table(
+        'blob_objects',
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('content_type', sa.String(length=100), nullable=True),
+        sa.Column('location', sa.String(length=500), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('sha256'),
+        if_not_exists=True
+    )
+
+    # Tables may have been created by db.create_all() with the column already
+    for table in OWNER_TABLES:
+        if not _has_column(table, 'content_sha256'):
+            op.add_column(table, sa.Column('content_sha256', sa.String(length=64), nullable=True))
+        op.create_index(f'ix_{table}_content_sha256', table, ['content_sha256'], if_not_exists=True)
+
+
+def downgrade():
+    for table in OWNER_TABLES:
+        op.drop_index(f'ix_{table}_content_sha256', table_name=table, if_exists=True)
+        op.drop_column(table, 'content_sha256')
+    op.drop_table('blob_objects')
@@ -0,0 +1,320 @@
+"""
+Model Router for Ask-Chopper
+
+Picks the chat model per request when a session is in "auto" mode:
+
+- Short prompts with little RAG context go to the fast model (Haiku).
+- Long prompts or large document context go to the strong model (Opus),
+  unless Opus' observed p95 latency already exceeds the session's latency
+  SLO.
+- An Opus call is hedged: if it hasn't answered (or has failed) by the time
+  the fast model would still fit inside the SLO, the same request is sent to
+  the fast model and whichever answers first is used.
+
+Observed latencies come from "llm_latency" events in the bridge log, so all
+workers and the Telegram bot share the same view.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from threading import BoundedSemaphore, Event, Lock
+from typing import Dict, List, Optional
+
+from bridge_log import get_bridge_log_path, log_bridge_event
+
+MODEL_MODES = ("haiku", "opus", "auto")
+
+LATENCY_SLO_MS = int(os.environ.get("CHAT_LATENCY_SLO_MS", "10000"))
+LONG_PROMPT_CHARS = int(os.environ.get("MODEL_ROUTER_LONG_PROMPT_CHARS", "1500"))
+LARGE_CONTEXT_CHARS = int(os.environ.get("MODEL_ROUTER_LARGE_CONTEXT_CHARS", "6000"))
+MIN_HEDGE_MS = int(os.environ.get("MODEL_ROUTER_MIN_HEDGE_MS", "1500"))
+
+# Latency samples: how many per model, how much of the log to scan, how often
+STATS_WINDOW = 200
+STATS_MIN_SAMPLES = 5
+STATS_REFRESH_SECONDS = 60
+STATS_TAIL_BYTES = 1024 * 1024
+
+HEDGE_THREADS = int(os.environ.get("MODEL_ROUTER_HEDGE_THREADS", "8"))
+
+# A call only goes to the pool when a slot is free, so it starts at once
+# instead of waiting behind other hedged calls; without a slot it isn't hedged
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="model-hedge")
+_hedge_slots = BoundedSemaphore(HEDGE_THREADS)
+_background_tasks = set()
+
+
+class RouteDecision:
+    """Which model to call for a request, and when to hedge to the fallback."""
+
+    def __init__(self, model: str, reason: str, fallback_model: Optional[str] = None,
+                 hedge_after_ms: Optional[int] = None):
+        self.model = model
+        self.reason = reason
+        self.fallback_model = fallback_model
+        self.hedge_after_ms = hedge_after_ms
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "model": self.model,
+            "reason": self.reason,
+            "fallback_model": self.fallback_model,
+            "hedge_after_ms": self.hedge_after_ms,
+        }
+
+
+class LatencyStats:
+    """Per-model LLM latency samples read from the bridge log."""
+
+    def __init__(self):
+        self._samples = {}
+        self._loaded_at = None
+        self._lock = Lock()
+
+    def _read_log_samples(self) -> Dict[str, List[float]]:
+        samples = {}
+        try:
+            with get_bridge_log_path().open("rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - STATS_TAIL_BYTES))
+                lines = f.read().splitlines()
+        except OSError:
+            return samples
+
+        if size > STATS_TAIL_BYTES:
+            lines = lines[1:]  # first line is likely partial
+        for line in lines:
+            if b'"llm_latency"' not in line:
+                continue
+            try:
+                entry = json.loads(line)
+                latency_ms = float(entry["extra"]["llm_latency_ms"])
+            except (ValueError, KeyError, TypeError):
+                continue
+            samples.setdefault(entry.get("model"), []).append(latency_ms)
+        return {model: values[-STATS_WINDOW:] for model, values in samples.items()}
+
+    def _maybe_refresh(self) -> None:
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < STATS_REFRESH_SECONDS:
+            return
+        self._samples = self._read_log_samples()
+        self._loaded_at = now
+
+    def record(self, model: str, latency_ms: float) -> None:
+        """Add a sample seen by this process (until the next log refresh)."""
+        with self._lock:
+            values = self._samples.setdefault(model, [])
+            values.append(latency_ms)
+            del values[:-STATS_WINDOW]
+
+    def p95(self, model: str) -> Optional[float]:
+        """Observed p95 latency in ms, or None with too few samples."""
+        with self._lock:
+            self._maybe_refresh()
+            values = sorted(self._samples.get(model, []))
+        if len(values) < STATS_MIN_SAMPLES:
+            return None
+        return values[min(len(values) - 1, int(len(values) * 0.95))]
+
+
+latency_stats = LatencyStats()
+
+
+def route_model(mode: str, fast_model: str, strong_model: str, prompt_chars: int,
+                context_chars: int = 0, latency_slo_ms: Optional[int] = None) -> RouteDecision:
+    """
+    Choose the model for a request.
+
+    Args:
+        mode: "haiku", "opus" or "auto"
+        fast_model: Model used for "haiku" and as the auto fallback
+        strong_model: Model used for "opus"
+        prompt_chars: Length of the user's prompt
+        context_chars: Length of retrieved document context
+        latency_slo_ms: Latency target for this session
+
+    Returns:
+        RouteDecision
+    """
+    if mode == "opus":
+        return RouteDecision(strong_model, "manual")
+    if mode != "auto":
+        return RouteDecision(fast_model, "manual")
+
+    if prompt_chars < LONG_PROMPT_CHARS and context_chars < LARGE_CONTEXT_CHARS:
+        return RouteDecision(fast_model, "light_request")
+
+    slo_ms = latency_slo_ms or LATENCY_SLO_MS
+    strong_p95 = latency_stats.p95(strong_model)
+    if strong_p95 is not None and strong_p95 > slo_ms:
+        return RouteDecision(fast_model, "strong_p95_over_slo")
+
+    # Hedge late enough to give the strong model a chance, early enough that
+    # the fast model still finishes inside the SLO
+    fast_p95 = latency_stats.p95(fast_model)
+    hedge_after_ms = slo_ms - fast_p95 if fast_p95 is not None else slo_ms / 2
+    return RouteDecision(
+        strong_model,
+        "heavy_request",
+        fallback_model=fast_model,
+        hedge_after_ms=int(max(MIN_HEDGE_MS, hedge_after_ms))
+    )
+
+
+def _observe(model: str, latency_ms: float, source: str, role: str) -> None:
+    latency_stats.record(model, latency_ms)
+    log_bridge_event(
+        source=source,
+        event="llm_latency",
+        model=model,
+        extra={"llm_latency_ms": int(latency_ms), "role": role}
+    )
+
+
+def _log_hedge(route: RouteDecision, source: str, trigger: str) -> None:
+    print(f"⏱️ Hedging {route.model} with {route.fallback_model} ({trigger})")
+    log_bridge_event(
+        source=source,
+        event="model_hedge",
+        model=route.model,
+        detail=trigger,
+        extra=route.as_dict()
+    )
+
+
+def _timed_create(client, request_kwargs, source: str, role: str):
+    started = time.perf_counter()
+    response = client.messages.create(**request_kwargs)
+    latency_ms = (time.perf_counter() - started) * 1000
+    _observe(request_kwargs["model"], latency_ms, source, role)
+    return response, latency_ms
+
+
+def _submit_in_slot(client, request_kwargs, source: str, role: str, started: Optional[Event] = None):
+    """Run _timed_create() on the hedge pool, or return None when no thread is free."""
+    if not _hedge_slots.acquire(blocking=False):
+        return None
+
+    def run():
+        try:
+            if started is not None:
+                started.set()
+            return _timed_create(client, request_kwargs, source, role)
+        finally:
+            _hedge_slots.release()
+
+    try:
+        return _hedge_executor.submit(run)
+    except Exception:
+        _hedge_slots.release()
+        raise
+
+
+def create_with_fallback(client, request_kwargs: dict, route: RouteDecision, source: str = "app"):
+    """
+    Call messages.create for a routed request, hedging to the fallback model.
+
+    The hedge timer starts when the primary call starts. When the hedge pool
+    has no free thread the call runs unhedged on the request thread (or, for
+    the fallback, the primary is simply awaited), so busy workers never queue
+    behind each other. The losing call is left to finish in the background so
+    its latency is still recorded.
+
+    Returns:
+        (response, latency_ms, hedged)
+    """
+    if not route.fallback_model or route.fallback_model == route.model:
+        response, latency_ms = _timed_create(client, request_kwargs, source, "primary")
+        return response, latency_ms, False
+
+    started = Event()
+    primary = _submit_in_slot(client, request_kwargs, source, "primary", started)
+    if primary is None:
+        print(f"⏱️ Hedge pool busy, calling {route.model} unhedged")
+        response, latency_ms = _timed_create(client, request_kwargs, source, "primary")
+        return response, latency_ms, False
+
+    started.wait()
+    try:
+        response, latency_ms = primary.result(timeout=route.hedge_after_ms / 1000)
+        return response, latency_ms, False
+    except FuturesTimeout:
+        trigger = "timeout"
+    except Exception as e:
+        trigger = f"error: {e}"
+
+    fallback_kwargs = dict(request_kwargs, model=route.fallback_model)
+    if trigger != "timeout":
+        # The primary is done, so the fallback doesn't need a pool thread
+        _log_hedge(route, source, trigger)
+        response, latency_ms = _timed_create(client, fallback_kwargs, source, "fallback")
+        return response, latency_ms, True
+
+    fallback = _submit_in_slot(client, fallback_kwargs, source, "fallback")
+    if fallback is None:
+        print(f"⏱️ Hedge pool busy, waiting for {route.model}")
+        response, latency_ms = primary.result()
+        return response, latency_ms, False
+    _log_hedge(route, source, trigger)
+
+    errors = []
+    for future in as_completed([primary, fallback]):
+        try:
+            response, latency_ms = future.result()
+            return response, latency_ms, True
+        except Exception as e:
+            errors.append(e)
+    raise errors[0]
+
+
+async def _atimed_create(client, request_kwargs, source: str, role: str):
+    started = time.perf_counter()
+    response = await client.messages.create(**request_kwargs)
+    latency_ms = (time.perf_counter() - started) * 1000
+    _observe(request_kwargs["model"], latency_ms, source, role)
+    return response, latency_ms
+
+
+def _keep_running(task) -> None:
+    """Let a losing hedge task finish without warnings about lost results."""
+    _background_tasks.add(task)
+
+    def _done(t):
+        _background_tasks.discard(t)
+        if not t.cancelled():
+            t.exception()
+
+    task.add_done_callback(_done)
+
+
+async def acreate_with_fallback(client, request_kwargs: dict, route: RouteDecision, source: str = "app"):
+    """Async create_with_fallback() for an AsyncAnthropic client."""
+    if not route.fallback_model or route.fallback_model == route.model:
+        response, latency_ms = await _atimed_create(client, request_kwargs, source, "primary")
+        return response, latency_ms, False
+
+    primary = asyncio.ensure_future(_atimed_create(client, request_kwargs, source, "primary"))
+    done, _ = await asyncio.wait({primary}, timeout=route.hedge_after_ms / 1000)
+    if done and primary.exception() is None:
+        response, latency_ms = primary.result()
+        return response, latency_ms, False
+
+    _log_hedge(route, source, "timeout" if not done else f"error: {primary.exception()}")
+    fallback_kwargs = dict(request_kwargs, model=route.fallback_model)
+    fallback = asyncio.ensure_future(_atimed_create(client, fallback_kwargs, source, "fallback"))
+    _keep_running(primary)
+    _keep_running(fallback)
+
+    errors = []
+    for next_done in asyncio.as_completed([primary, fallback]):
+        try:
+            response, latency_ms = await next_done
+            return response, latency_ms, True
+        except Exception as e:
+            errors.append(e)
+    raise errors[0]
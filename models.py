@@ -3,6 +3,8 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 
+from thumbnails import thumbnail_variants
+
 db = SQLAlchemy()
 
 class User(db.Model):
@@ -39,6 +41,12 @@ class User(db.Model):
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    __table_args__ = (
+        # Session history (history cache, /api/chat/history)
+        db.Index('ix_chat_messages_session_created', 'session_id', 'created_at'),
+        # History pages (newest first, before_id cursor)
+        db.Index('ix_chat_messages_session_id_id', 'session_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.String(100), nullable=False, default='default')
@@ -75,7 +83,7 @@ class MessageAttachment(db.Model):
     __tablename__ = 'message_attachments'
 
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('chat_messages.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
@@ -84,6 +92,8 @@ class MessageAttachment(db.Model):
     thumbnail_path = db.Column(db.String(500))
     is_processed = db.Column(db.Boolean, default=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Shared object in blob_objects (content_store.py); NULL for files stored per upload
+    content_sha256 = db.Column(db.String(64), index=True)
 
     def to_dict(self):
         return {
@@ -93,6 +103,7 @@ class MessageAttachment(db.Model):
             'file_size': self.file_size,
             'mime_type': self.mime_type,
             'thumbnail_path': self.thumbnail_path,
+            'thumbnails': thumbnail_variants(self.thumbnail_path),
             'uploaded_at': self.uploaded_at.isoformat() if self.uploaded_at else None
         }
 
@@ -105,9 +116,9 @@ class MessageAttachment(db.Model):
         return f'/uploads/thumbnails/{self.thumbnail_path}' if self.thumbnail_path else None
 
     def delete_files(self):
-        """Delete the actual files from filesystem"""
+        """Delete the actual files from filesystem (a shared object is released through content_store instead)"""
         try:
-            if os.path.exists(self.file_path):
+            if not self.content_sha256 and os.path.exists(self.file_path):
                 os.remove(self.file_path)
             if self.thumbnail_path and os.path.exists(self.thumbnail_path):
                 os.remove(self.thumbnail_path)
@@ -204,6 +215,12 @@ class UserProfile(db.Model):
 
 class DocumentUpload(db.Model):
     __tablename__ = 'document_uploads'
+    __table_args__ = (
+        # A user's documents in a chat session, newest first
+        db.Index('ix_document_uploads_user_session_uploaded', 'user_id', 'session_id', 'uploaded_at'),
+        # Expired documents, oldest first (reaper.expire_documents)
+        db.Index('ix_document_uploads_expires_at', 'expires_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -216,8 +233,11 @@ class DocumentUpload(db.Model):
     chunk_count = db.Column(db.Integer, default=0)
     file_path = db.Column(db.String(500), nullable=False)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set from DOCUMENT_TTL_DAYS at ingest; NULL never expires
     expires_at = db.Column(db.DateTime)
     is_processed = db.Column(db.Boolean, default=False)
+    # Shared object in blob_objects (content_store.py); NULL for files stored per upload
+    content_sha256 = db.Column(db.String(64), index=True)
 
     # Relationships
     user = db.relationship('User', backref='document_uploads')
@@ -239,14 +259,45 @@ class DocumentUpload(db.Model):
         }
 
     def delete_file(self):
-        """Delete the actual file from filesystem"""
+        """Delete the actual file from filesystem (a shared object is released through content_store instead)"""
         try:
-            if os.path.exists(self.file_path):
+            if not self.content_sha256 and os.path.exists(self.file_path):
                 os.remove(self.file_path)
         except Exception as e:
             print(f"Error deleting document file: {e}")
 
 
+class BlobObject(db.Model):
+    """A stored file shared by every attachment/document with the same content (content_store.py)"""
+    __tablename__ = 'blob_objects'
+
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    location = db.Column(db.String(500), nullable=False)  # Blob URL or local path
+    # MessageAttachment/DocumentUpload rows (live or archived) with this content_sha256
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DeletionTombstone(db.Model):
+    """Storage to delete after its rows are gone, worked off by the deletion reaper (reaper.py)"""
+    __tablename__ = 'deletion_tombstones'
+    __table_args__ = (
+        # Due tombstones, oldest first
+        db.Index('ix_deletion_tombstones_due', 'next_attempt_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # 'vector', 'blob', 'file' or 'object'
+    target = db.Column(db.String(500), nullable=False)  # Chroma doc_id, Blob URL, local path or sha256
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
 class AdminMessage(db.Model):
     """Messages sent by users to the admin/Ask Chopper team"""
     __tablename__ = 'admin_messages'
@@ -283,6 +334,12 @@ class AdminMessage(db.Model):
 class SupportChat(db.Model):
     """Chat messages between users and admin support"""
     __tablename__ = 'support_chats'
+    __table_args__ = (
+        # Conversation reads and unread lookups / mark-as-read
+        db.Index('ix_support_chats_user_sender_read', 'user_id', 'sender_type', 'is_read'),
+        # Conversation pages (newest first, before_id cursor) and event replay
+        db.Index('ix_support_chats_user_id_id', 'user_id', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -304,3 +361,56 @@ class SupportChat(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
+class SupportUnreadCounter(db.Model):
+    """Maintained unread support message counts, kept in step with support_chats"""
+    __tablename__ = 'support_unread_counters'
+
+    # 'user:<id>' = admin replies unread by that user, 'admin' = user messages unread by admin
+    counter_key = db.Column(db.String(50), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=0)  # bumped on every change (ETag)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ChatMessageArchive(db.Model):
+    """Chat messages moved out of chat_messages by the retention archiver (retention.py)"""
+    __tablename__ = 'chat_messages_archive'
+    __table_args__ = (
+        db.Index('ix_chat_messages_archive_session', 'session_id'),
+        # Monthly partitions on PostgreSQL, created by retention.ensure_archive_partitions()
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    # Partition key is part of the primary key on PostgreSQL
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    session_id = db.Column(db.String(100), nullable=False)
+    message_type = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    formatted_content = db.Column(db.Text)
+    has_attachments = db.Column(db.Boolean, default=False)
+    openai_thread_id = db.Column(db.String(100))
+    openai_message_id = db.Column(db.String(100))
+    response_time_ms = db.Column(db.Integer)
+    thread_id = db.Column(db.String(100))
+    run_id = db.Column(db.String(100))
+    has_document_context = db.Column(db.Boolean, default=False)
+    attachments = db.Column(db.JSON)  # message_attachments rows of the message
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class SupportChatArchive(db.Model):
+    """Support chat messages moved out of support_chats by the retention archiver (retention.py)"""
+    __tablename__ = 'support_chats_archive'
+    __table_args__ = (
+        db.Index('ix_support_chats_archive_user', 'user_id'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    created_at = db.Column(db.DateTime, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    sender_type = db.Column(db.String(20), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    is_read = db.Column(db.Boolean, default=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,306 @@
+"""
+Parallel, Resumable Multipart Uploads for Ask-Chopper
+
+MultipartUploader sends a stream to Blob storage in fixed-size parts:
+
+    - Parts are read from the stream in order (so size and sha256 are
+      computed on the fly and non-seekable streams work) and uploaded on a
+      thread pool, BLOB_UPLOAD_CONCURRENCY at a time. At most that many
+      parts plus the one being read are held in memory.
+    - Every Blob call is retried with exponential backoff and jitter
+      (BLOB_PART_ATTEMPTS, BLOB_RETRY_BACKOFF) when the error is retryable.
+    - Finished parts are recorded in a small JSON state file per upload
+      (BLOB_UPLOAD_STATE_DIR). If an upload fails part-way, uploading the
+      same path again reuses the multipart upload and skips every part
+      whose sha256 matches the recorded one, instead of restarting.
+    - A file that fits in one part is sent with a single PUT.
+    - With an expected sha256, the digest is checked before the single PUT
+      or the multipart complete, so a mismatch never overwrites the path.
+
+The transport is pluggable (see blob_upload.py): VercelBlobTransport in
+production, LocalBlobTransport for tests and scripts/bench_blob_upload.py.
+"""
+
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from blob_upload import MIN_PART_SIZE, BlobTransport, BlobUploadError, ContentMismatchError, read_part
+
+PART_SIZE = max(MIN_PART_SIZE, int(float(os.environ.get("BLOB_PART_SIZE_MB", "8")) * 1024 * 1024))
+CONCURRENCY = max(1, int(os.environ.get("BLOB_UPLOAD_CONCURRENCY", "4")))
+PART_ATTEMPTS = max(1, int(os.environ.get("BLOB_PART_ATTEMPTS", "4")))
+RETRY_BACKOFF = float(os.environ.get("BLOB_RETRY_BACKOFF", "0.5"))
+RETRY_MAX_DELAY = 30.0
+
+# Serverless instances can only write under /tmp
+STATE_DIR = os.environ.get("BLOB_UPLOAD_STATE_DIR") or (
+    os.path.join(tempfile.gettempdir(), "chopper_blob_uploads") if os.environ.get("VERCEL")
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "blob_uploads")
+)
+# Blob discards unfinished multipart uploads, so older state can't be resumed
+STATE_TTL_SECONDS = float(os.environ.get("BLOB_UPLOAD_STATE_TTL_HOURS", "24")) * 3600
+
+
+def call_with_backoff(fn: Callable, *args, attempts: int = PART_ATTEMPTS, backoff: float = RETRY_BACKOFF,
+                      description: str = "Blob call", **kwargs):
+    """
+    Call fn, retrying retryable BlobUploadErrors with exponential backoff.
+
+    The n-th retry waits backoff * 2**(n-1) seconds (capped at
+    RETRY_MAX_DELAY), scaled by a random 50-100% so parallel parts that
+    failed together don't retry together.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except BlobUploadError as e:
+            if not e.retryable or attempt == attempts:
+                raise
+            delay = min(RETRY_MAX_DELAY, backoff * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            print(f"WARNING: {description} failed (attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+class UploadStateStore:
+    """
+    Part state of unfinished multipart uploads, one JSON file per upload.
+
+    Files are replaced atomically. A store that can't be written (read-only
+    filesystem) only disables resuming; uploads still work.
+    """
+
+    def __init__(self, directory: str = STATE_DIR, ttl_seconds: float = STATE_TTL_SECONDS):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        """State saved under key, or None if there is none or it expired."""
+        try:
+            with open(self._file(key), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("key") != key or time.time() - state.get("created_at", 0) > self.ttl_seconds:
+            self.discard(key)
+            return None
+        return state
+
+    def save(self, key: str, state: Dict[str, Any]) -> None:
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._file(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"WARNING: Could not save upload state for {state.get('path')}: {e}")
+
+    def discard(self, key: str) -> None:
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def prune(self) -> int:
+        """Remove expired state files. Returns how many were removed."""
+        removed = 0
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return 0
+        cutoff = time.time() - self.ttl_seconds
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+
+class MultipartUploader:
+    """
+    Uploads streams to Blob storage in parallel parts with retry and resume.
+
+    Args:
+        transport: Blob API client
+        part_size: Bytes per part (and the single-PUT limit); at least MIN_PART_SIZE
+            for real Blob storage
+        concurrency: Parts uploaded at the same time
+        attempts: Tries per Blob call
+        backoff: First retry delay in seconds
+        state_store: Where part state is kept for resuming (None disables resume)
+    """
+
+    def __init__(self, transport: BlobTransport, part_size: int = PART_SIZE, concurrency: int = CONCURRENCY,
+                 attempts: int = PART_ATTEMPTS, backoff: float = RETRY_BACKOFF,
+                 state_store: Optional[UploadStateStore] = None):
+        self.transport = transport
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.state_store = state_store
+
+    def _call(self, description: str, fn: Callable, *args):
+        return call_with_backoff(fn, *args, attempts=self.attempts, backoff=self.backoff, description=description)
+
+    def _state_key(self, path: str, content_type: str) -> str:
+        return f"{path}|{content_type}|{self.part_size}"
+
+    def _start(self, path: str, content_type: str) -> Dict[str, Any]:
+        """Resume the saved multipart upload for path, or create a new one."""
+        key = self._state_key(path, content_type)
+        state = self.state_store.load(key) if self.state_store else None
+        if state:
+            print(f"Resuming upload of {path} ({len(state['parts'])} parts already uploaded)")
+            return state
+
+        upload_id, upload_key = self._call(f"Multipart create for {path}", self.transport.create_multipart,
+                                           path, content_type)
+        state = {
+            "key": key,
+            "path": path,
+            "upload_id": upload_id,
+            "upload_key": upload_key,
+            "created_at": time.time(),
+            "parts": {},
+        }
+        if self.state_store:
+            self.state_store.save(key, state)
+        return state
+
+    def upload(self, stream, path: str, content_type: str,
+               sha256: Optional[str] = None) -> Tuple[str, int, str]:
+        """
+        Upload a stream to Blob storage.
+
+        Args:
+            stream: Readable binary stream, read from its current position to the end
+            path: Blob pathname
+            content_type: MIME type stored with the blob
+            sha256: Expected digest; raises ContentMismatchError before anything
+                is written under path if the data doesn't match
+
+        Returns:
+            Tuple of (blob_url, size, sha256 hex digest)
+
+        Raises:
+            BlobUploadError if a call still fails after its retries; finished parts
+            stay recorded so the next upload of the same path resumes
+        """
+        key = self._state_key(path, content_type)
+        resuming = bool(self.state_store and self.state_store.load(key))
+        start = stream.tell() if stream.seekable() else None
+        try:
+            return self._upload(stream, path, content_type, sha256)
+        except ContentMismatchError:
+            raise
+        except BlobUploadError as e:
+            # The saved upload may be gone on Blob's side (expired or completed): start over once
+            if e.retryable or not resuming or start is None:
+                raise
+            print(f"WARNING: Could not resume upload of {path}, restarting: {e}")
+            self.state_store.discard(key)
+            stream.seek(start)
+            return self._upload(stream, path, content_type, sha256)
+
+    @staticmethod
+    def _check_digest(path: str, digest, sha256: Optional[str]) -> None:
+        if sha256 and digest.hexdigest() != sha256:
+            raise ContentMismatchError(f"Content of {path} doesn't match sha256 {sha256}")
+
+    def _upload(self, stream, path: str, content_type: str,
+                sha256: Optional[str] = None) -> Tuple[str, int, str]:
+        digest = hashlib.sha256()
+        part = read_part(stream, self.part_size)
+        digest.update(part)
+        size = len(part)
+
+        # One byte of look-ahead tells a single-part file from a multipart one
+        lookahead = stream.read(1)
+        if not lookahead:
+            self._check_digest(path, digest, sha256)
+            blob = self._call(f"Upload of {path}", self.transport.put, path, part, content_type)
+            return blob["url"], size, digest.hexdigest()
+
+        state = self._start(path, content_type)
+        etags: Dict[int, str] = {}
+        pending = {}
+
+        def record(done) -> None:
+            # Runs on this thread only, so state saves never race
+            error = None
+            for future in done:
+                part_number, part_sha = pending.pop(future)
+                try:
+                    etags[part_number] = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                state["parts"][str(part_number)] = {"etag": etags[part_number], "sha256": part_sha}
+                if self.state_store:
+                    self.state_store.save(state["key"], state)
+            if error:
+                raise error
+
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="blob-part")
+        try:
+            part_number = 1
+            while part:
+                part_sha = hashlib.sha256(part).hexdigest()
+                saved = state["parts"].get(str(part_number))
+                if saved and saved["sha256"] == part_sha:
+                    etags[part_number] = saved["etag"]
+                else:
+                    future = pool.submit(
+                        self._call, f"Part {part_number} of {path}", self.transport.upload_part,
+                        path, state["upload_id"], state["upload_key"], part_number, part, content_type
+                    )
+                    pending[future] = (part_number, part_sha)
+                part = None
+
+                # Bound memory: wait for a slot before reading the next part
+                while len(pending) >= self.concurrency:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    record(done)
+
+                part_number += 1
+                part = read_part(stream, self.part_size, lookahead)
+                lookahead = b""
+                digest.update(part)
+                size += len(part)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                record(done)
+        except BaseException:
+            # Keep the parts that were already in flight and finished, so a retry skips them
+            pool.shutdown(wait=True, cancel_futures=True)
+            finished = [f for f in pending if not f.cancelled() and f.exception() is None]
+            record(finished)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+
+        # Uploaded parts stay recorded, so a retry with the right data reuses the matching ones
+        self._check_digest(path, digest, sha256)
+        parts = [{"partNumber": n, "etag": etags[n]} for n in sorted(etags)]
+        blob = self._call(f"Multipart complete for {path}", self.transport.complete_multipart,
+                          path, state["upload_id"], state["upload_key"], parts, content_type)
+        if self.state_store:
+            self.state_store.discard(state["key"])
+        return blob["url"], size, digest.hexdigest()
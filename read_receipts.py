@@ -0,0 +1,55 @@
+"""
+Read Receipts for Ask-Chopper
+
+Marks support messages read with one set-based UPDATE per conversation
+instead of loading every unread SupportChat row and setting is_read on each.
+
+Bulk updates skip ORM flush events, so the unread counter change and the
+unread event that support_counters/support_events would otherwise derive
+from the flush are applied here, in the same transaction as the UPDATE.
+"""
+
+from models import db, SupportChat
+from support_counters import apply_counter_deltas, counter_key_for
+from support_events import queue_unread_events
+
+# Reader -> sender_type of the messages they receive
+RECEIVED_FROM = {
+    "user": "admin",
+    "admin": "user",
+}
+
+
+def mark_read_statement(user_id: int, sender_type: str):
+    """UPDATE marking a conversation's unread messages from `sender_type` read."""
+    table = SupportChat.__table__
+    return table.update().where(
+        table.c.user_id == user_id,
+        table.c.sender_type == sender_type,
+        table.c.is_read == db.false()
+    ).values(is_read=True)
+
+
+def mark_conversation_read(user_id: int, reader: str) -> int:
+    """
+    Mark every unread message the reader has received in a conversation as read, and commit.
+
+    Args:
+        user_id: User whose support conversation is being read
+        reader: 'user' (reading admin replies) or 'admin' (reading the user's messages)
+
+    Returns:
+        Number of messages marked read
+    """
+    sender_type = RECEIVED_FROM[reader]
+    connection = db.session.connection()
+
+    result = connection.execute(mark_read_statement(user_id, sender_type))
+    marked = result.rowcount
+    if not marked:
+        return 0
+
+    values = apply_counter_deltas(connection, {counter_key_for(sender_type, user_id): -marked})
+    queue_unread_events(db.session, values)
+    db.session.commit()
+    return marked
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Delete the Chroma chunks and files of deleted and expired documents (see reaper.py).
+
+Usage:
+    python3 reap_deletions.py status
+    python3 reap_deletions.py run [--batch-size 500] [--max-batches N]
+    python3 reap_deletions.py expire [--dry-run] [--batch-size 200] [--max-batches N]
+                                     [--rate 20] [--backfill]
+"""
+
+import argparse
+import sys
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from app import app, db
+import blob_storage
+import reaper
+import storage
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Deferred storage deletes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("status", help="Show expired documents and pending tombstones per kind")
+
+    run_parser = commands.add_parser("run", help="Reap every due tombstone")
+    run_parser.add_argument("--batch-size", type=int, default=reaper.REAPER_BATCH_SIZE)
+    run_parser.add_argument("--max-batches", type=int)
+
+    expire_parser = commands.add_parser("expire", help="Delete documents past their expires_at")
+    expire_parser.add_argument("--batch-size", type=int, default=reaper.EXPIRY_BATCH_SIZE)
+    expire_parser.add_argument("--max-batches", type=int)
+    expire_parser.add_argument("--rate", type=float, default=reaper.EXPIRY_RATE,
+                               help="Documents per second at most (0 = no limit); default: DOCUMENT_EXPIRY_RATE")
+    expire_parser.add_argument("--dry-run", action="store_true", help="Only count expired documents")
+    expire_parser.add_argument("--backfill", action="store_true",
+                               help="First give documents without expires_at one (uploaded_at + DOCUMENT_TTL_DAYS)")
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with app.app_context():
+        try:
+            if args.command == "status":
+                expiry = reaper.expiry_status()
+                ttl = f"{expiry['ttl_days']:g} days" if expiry['ttl_days'] > 0 else "disabled"
+                print(f"documents (ttl: {ttl})")
+                print(f"  expired:     {expiry['expired']}")
+                print(f"  without ttl: {expiry['without_ttl']}")
+                print(f"  next expiry: {expiry['next_expiry'] or '-'}")
+                pending = reaper.status()
+                if not pending:
+                    print("✅ No deletes pending")
+                for kind, info in sorted(pending.items()):
+                    print(f"{kind}")
+                    print(f"  pending: {info['pending']}")
+                    print(f"  due:     {info['due']}")
+                    print(f"  retried: {info['retried']}")
+                    print(f"  oldest:  {info['oldest']}")
+
+            elif args.command == "run":
+                result = reaper.reap_all(batch_size=args.batch_size, max_batches=args.max_batches)
+                print(f"✅ Reaped {result['deleted']} of {result['claimed']} tombstones, "
+                      f"{result['failed']} failed (retried later)")
+                pruned = storage.local_storage().prune_links()
+                if pruned:
+                    print(f"✅ Pruned {pruned} unused hard-link index entries")
+                pruned = blob_storage.prune_upload_state()
+                if pruned:
+                    print(f"✅ Removed {pruned} expired multipart upload state files")
+                return result["failed"] == 0
+
+            elif args.command == "expire":
+                if args.backfill and not args.dry_run:
+                    print(f"✅ Assigned expires_at to {reaper.assign_missing_expiry(args.batch_size)} documents")
+                result = reaper.expire_documents(
+                    batch_size=args.batch_size, max_batches=args.max_batches,
+                    rate=args.rate, dry_run=args.dry_run
+                )
+                label = "Would expire" if args.dry_run else "Expired"
+                print(f"✅ {label} {result['documents']} documents ({result['bytes']} bytes) "
+                      f"in {result['batches']} batches, {result['failed']} storage deletes failed "
+                      f"(retried by run)")
+                return result["failed"] == 0
+            return True
+
+        except Exception as e:
+            print(f"\n❌ Reaper {args.command} failed: {e}")
+            db.session.rollback()
+            return False
+
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,424 @@
+"""
+Deferred Storage Deletes for Ask-Chopper
+
+Deleting a document means deleting its row, its chunks in Chroma and its
+file (a Blob URL, a local file, or a reference to a shared object, see
+content_store.py). Only the row has to go in the request: the rest is
+recorded as tombstones (deletion_tombstones) in the same transaction and
+deleted by the reaper, so "clear documents" returns at once however many
+files a session has.
+
+Tombstone kinds and how they are reaped:
+    vector - Chroma doc_id; chunks deleted in batches (chroma_client.delete_documents)
+    blob   - Blob URL; deleted in batches (blob_storage.delete_files)
+    file   - local path; removed (storage.LocalStorage.delete_many)
+    object - sha256 of a shared object; one reference released
+             (content_store.release), in the same transaction that removes
+             the tombstone so a reference is never released twice
+
+reap() claims due tombstones by pushing their next_attempt_at forward
+(a lease), so several workers or a cron run can reap at once without
+doing the same work. Failures are retried with exponential backoff
+(REAPER_RETRY_SECONDS doubling, capped at six hours) and stay visible in
+status() until they succeed.
+
+Modes (DELETION_REAPER_MODE):
+    background - a reaper thread per worker, woken as soon as tombstones
+                 are committed, and every REAPER_INTERVAL_SECONDS (default)
+    inline     - reaped in the request after the commit (default on Vercel,
+                 where threads don't outlive the response)
+Either way `python3 reap_deletions.py run` reaps what is left over.
+
+Documents also expire: build_document_record() sets expires_at to
+DOCUMENT_TTL_DAYS after the upload, and expire_documents() (cron:
+`python3 reap_deletions.py expire`) turns expired rows into tombstones
+batch by batch and reaps them, at most DOCUMENT_EXPIRY_RATE documents a
+second so Chroma and Blob aren't flooded.
+"""
+
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+
+import blob_storage
+import chroma_client
+import content_store
+import storage
+from bridge_log import log_bridge_event
+from models import db, DeletionTombstone, DocumentUpload
+
+KINDS = ("vector", "blob", "file", "object")
+MODES = ("background", "inline")
+REAPER_MODE = os.environ.get(
+    "DELETION_REAPER_MODE", "inline" if os.environ.get("VERCEL") else "background"
+).strip().lower()
+REAPER_INTERVAL_SECONDS = float(os.environ.get("REAPER_INTERVAL_SECONDS", "60"))
+REAPER_BATCH_SIZE = int(os.environ.get("REAPER_BATCH_SIZE", "500"))
+RETRY_SECONDS = float(os.environ.get("REAPER_RETRY_SECONDS", "30"))
+RETRY_MAX_SECONDS = 6 * 3600
+# A claimed tombstone is left alone this long before another reaper may retry it
+CLAIM_SECONDS = 300
+# Document ids per DELETE statement
+DELETE_ID_CHUNK = 500
+
+# Days a document is kept after upload (0 = forever)
+DOCUMENT_TTL_DAYS = float(os.environ.get("DOCUMENT_TTL_DAYS", "30"))
+EXPIRY_BATCH_SIZE = int(os.environ.get("DOCUMENT_EXPIRY_BATCH_SIZE", "200"))
+# Expired documents deleted per second (0 = no limit)
+EXPIRY_RATE = float(os.environ.get("DOCUMENT_EXPIRY_RATE", "20"))
+
+
+def document_tombstones(document: Any) -> List[Dict[str, str]]:
+    """
+    Tombstones for everything stored for a DocumentUpload (or a row with
+    its chroma_doc_id, file_path and content_sha256 columns).
+    """
+    tombstones = []
+    if document.chroma_doc_id:
+        tombstones.append({"kind": "vector", "target": document.chroma_doc_id})
+    if document.content_sha256:
+        tombstones.append({"kind": "object", "target": document.content_sha256})
+    elif document.file_path and document.file_path.startswith(("http://", "https://")):
+        tombstones.append({"kind": "blob", "target": document.file_path})
+    elif document.file_path:
+        tombstones.append({"kind": "file", "target": document.file_path})
+    return tombstones
+
+
+def document_expires_at(uploaded_at: Optional[datetime] = None) -> Optional[datetime]:
+    """When a document uploaded at `uploaded_at` (default now) expires; None without a TTL."""
+    if DOCUMENT_TTL_DAYS <= 0:
+        return None
+    return (uploaded_at or datetime.utcnow()) + timedelta(days=DOCUMENT_TTL_DAYS)
+
+
+def tombstone_documents(documents: List[Any]) -> List[int]:
+    """
+    Delete DocumentUpload rows and record tombstones for their chunks and
+    files, in one commit.
+
+    Args:
+        documents: DocumentUpload objects or rows with id, chroma_doc_id,
+            file_path and content_sha256
+
+    Returns:
+        Ids of the committed tombstones
+    """
+    tombstones = [tombstone for document in documents for tombstone in document_tombstones(document)]
+    ids = [document.id for document in documents]
+    try:
+        for start in range(0, len(ids), DELETE_ID_CHUNK):
+            db.session.execute(
+                delete(DocumentUpload).where(DocumentUpload.id.in_(ids[start:start + DELETE_ID_CHUNK])),
+                execution_options={"synchronize_session": False}
+            )
+        tombstone_ids = []
+        if tombstones:
+            tombstone_ids = db.session.scalars(
+                insert(DeletionTombstone).returning(DeletionTombstone.id, sort_by_parameter_order=True),
+                tombstones
+            ).all()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return tombstone_ids
+
+
+def _retry_at(now: datetime, attempts: int) -> datetime:
+    return now + timedelta(seconds=min(RETRY_MAX_SECONDS, RETRY_SECONDS * 2 ** max(0, attempts - 1)))
+
+
+def _claim(limit: int, ids: Optional[Iterable[int]], now: datetime) -> List[Any]:
+    """Lease up to `limit` due tombstones (oldest first). Returns (id, kind, target, attempts) rows."""
+    due = select(DeletionTombstone.id).where(DeletionTombstone.next_attempt_at <= now)
+    if ids is not None:
+        due = due.where(DeletionTombstone.id.in_(list(ids)))
+    due = due.order_by(DeletionTombstone.id).limit(limit)
+    with db.engine.begin() as conn:
+        return conn.execute(
+            update(DeletionTombstone)
+            .where(DeletionTombstone.id.in_(due), DeletionTombstone.next_attempt_at <= now)
+            .values(next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS),
+                    attempts=DeletionTombstone.attempts + 1)
+            .returning(DeletionTombstone.id, DeletionTombstone.kind,
+                       DeletionTombstone.target, DeletionTombstone.attempts)
+        ).all()
+
+
+def _batch_deleter(kind: str):
+    """Function deleting a list of targets of one kind; returns the targets that failed."""
+    return {
+        "vector": chroma_client.delete_documents,
+        "blob": blob_storage.delete_files,
+        "file": storage.local_storage().delete_many,
+    }.get(kind)
+
+
+def reap(limit: int = REAPER_BATCH_SIZE, ids: Optional[Iterable[int]] = None) -> Dict[str, int]:
+    """
+    Delete the storage behind up to `limit` due tombstones.
+
+    Args:
+        limit: Tombstones claimed in this pass
+        ids: Only these tombstones (inline mode reaps what the request scheduled)
+
+    Returns:
+        Dict of claimed, deleted and failed counts
+    """
+    now = datetime.utcnow()
+    claimed = _claim(limit, ids, now)
+    if not claimed:
+        return {"claimed": 0, "deleted": 0, "failed": 0}
+
+    by_kind = defaultdict(list)
+    for row in claimed:
+        by_kind[row.kind].append(row)
+
+    done: List[int] = []
+    failures: Dict[int, str] = {}
+    for kind, rows in by_kind.items():
+        if kind == "object":
+            for row in rows:
+                try:
+                    with db.engine.begin() as conn:
+                        content_store.release(row.target, conn=conn)
+                        conn.execute(delete(DeletionTombstone).where(DeletionTombstone.id == row.id))
+                except Exception as e:
+                    failures[row.id] = str(e)
+                    continue
+                done.append(row.id)
+            continue
+
+        deleter = _batch_deleter(kind)
+        if deleter is None:
+            failures.update((row.id, f"Unknown tombstone kind {kind!r}") for row in rows)
+            continue
+        try:
+            failed_targets = set(deleter([row.target for row in rows]))
+        except Exception as e:
+            failures.update((row.id, str(e)) for row in rows)
+            continue
+        for row in rows:
+            if row.target in failed_targets:
+                failures[row.id] = f"{kind} delete failed"
+            else:
+                done.append(row.id)
+
+    with db.engine.begin() as conn:
+        if done:
+            conn.execute(delete(DeletionTombstone).where(DeletionTombstone.id.in_(done)))
+        for row in claimed:
+            if row.id in failures:
+                conn.execute(
+                    update(DeletionTombstone)
+                    .where(DeletionTombstone.id == row.id)
+                    .values(last_error=failures[row.id][:2000], next_attempt_at=_retry_at(now, row.attempts))
+                )
+
+    result = {"claimed": len(claimed), "deleted": len(done), "failed": len(failures)}
+    log_bridge_event(
+        source="reaper",
+        event="deletion_reap",
+        status="error" if failures else "ok",
+        extra={**result, "kinds": {kind: len(rows) for kind, rows in by_kind.items()},
+               "ms": round((datetime.utcnow() - now).total_seconds() * 1000, 1)}
+    )
+    return result
+
+
+def reap_all(batch_size: int = REAPER_BATCH_SIZE, max_batches: Optional[int] = None) -> Dict[str, int]:
+    """reap() until nothing due is left (or max_batches). Returns the summed counts."""
+    totals = {"claimed": 0, "deleted": 0, "failed": 0}
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        result = reap(batch_size)
+        batches += 1
+        for key in totals:
+            totals[key] += result[key]
+        if result["claimed"] < batch_size:
+            break
+    return totals
+
+
+def expire_documents(batch_size: int = EXPIRY_BATCH_SIZE, max_batches: Optional[int] = None,
+                     rate: float = EXPIRY_RATE, dry_run: bool = False,
+                     now: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Delete documents whose expires_at has passed: rows, Chroma chunks and files.
+
+    Each batch of expired rows is turned into tombstones (tombstone_documents)
+    and reaped right away; deletes that fail stay as tombstones and are
+    retried by the reaper.
+
+    Args:
+        batch_size: Documents per batch
+        max_batches: Stop after this many batches
+        rate: Documents per second at most, by sleeping between batches (0 = no limit)
+        dry_run: Only count the expired documents
+        now: Expiry cutoff (default now)
+
+    Returns:
+        Dict of documents, bytes, batches, deleted, failed and seconds
+    """
+    now = now or datetime.utcnow()
+    expired = DocumentUpload.expires_at <= now
+    if dry_run:
+        documents, size = db.session.execute(
+            select(func.count(), func.coalesce(func.sum(DocumentUpload.file_size), 0)).where(expired)
+        ).one()
+        db.session.rollback()
+        return {"documents": documents, "bytes": int(size), "batches": 0, "deleted": 0, "failed": 0, "seconds": 0.0}
+
+    stats = {"documents": 0, "bytes": 0, "batches": 0, "deleted": 0, "failed": 0}
+    started = time.monotonic()
+    while max_batches is None or stats["batches"] < max_batches:
+        documents = db.session.execute(
+            select(DocumentUpload.id, DocumentUpload.chroma_doc_id, DocumentUpload.file_path,
+                   DocumentUpload.content_sha256, DocumentUpload.file_size)
+            .where(expired)
+            .order_by(DocumentUpload.expires_at, DocumentUpload.id)
+            .limit(batch_size)
+        ).all()
+        if not documents:
+            break
+
+        tombstone_ids = tombstone_documents(documents)
+        result = reap(limit=len(tombstone_ids), ids=tombstone_ids) if tombstone_ids else {"deleted": 0, "failed": 0}
+        stats["batches"] += 1
+        stats["documents"] += len(documents)
+        stats["bytes"] += sum(document.file_size or 0 for document in documents)
+        stats["deleted"] += result["deleted"]
+        stats["failed"] += result["failed"]
+        print(f"🗑️  Batch {stats['batches']}: expired {len(documents)} documents, "
+              f"{result['deleted']} storage deletes, {result['failed']} failed")
+
+        if len(documents) < batch_size:
+            break
+        if rate > 0:
+            # Sleep until this run's average is back under `rate` documents a second
+            time.sleep(max(0.0, stats["documents"] / rate - (time.monotonic() - started)))
+
+    stats["seconds"] = round(time.monotonic() - started, 2)
+    log_bridge_event(
+        source="reaper",
+        event="documents_expired",
+        status="error" if stats["failed"] else "ok",
+        extra={**stats, "cutoff": now.isoformat(), "ttl_days": DOCUMENT_TTL_DAYS}
+    )
+    return stats
+
+
+def assign_missing_expiry(batch_size: int = EXPIRY_BATCH_SIZE) -> int:
+    """
+    Give documents uploaded before TTLs existed an expires_at of uploaded_at + DOCUMENT_TTL_DAYS.
+
+    Returns:
+        Number of documents updated
+    """
+    if DOCUMENT_TTL_DAYS <= 0:
+        return 0
+    updated = 0
+    while True:
+        rows = db.session.execute(
+            select(DocumentUpload.id, DocumentUpload.uploaded_at)
+            .where(DocumentUpload.expires_at.is_(None))
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return updated
+        now = datetime.utcnow()
+        db.session.execute(
+            update(DocumentUpload),
+            [{"id": row.id, "expires_at": document_expires_at(row.uploaded_at or now)} for row in rows]
+        )
+        db.session.commit()
+        updated += len(rows)
+
+
+def expiry_status(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Documents expired (not yet deleted), without an expires_at, and the next expiry."""
+    now = now or datetime.utcnow()
+    expired, without_ttl, next_expiry = db.session.execute(
+        select(
+            func.sum((DocumentUpload.expires_at <= now).cast(db.Integer)),
+            func.sum(DocumentUpload.expires_at.is_(None).cast(db.Integer)),
+            func.min(DocumentUpload.expires_at).filter(DocumentUpload.expires_at > now),
+        )
+    ).one()
+    return {"expired": int(expired or 0), "without_ttl": int(without_ttl or 0),
+            "next_expiry": next_expiry, "ttl_days": DOCUMENT_TTL_DAYS}
+
+
+def status(now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    """Pending tombstones per kind: total, due now, retried, oldest."""
+    now = now or datetime.utcnow()
+    rows = db.session.execute(
+        select(
+            DeletionTombstone.kind,
+            func.count(),
+            func.sum((DeletionTombstone.next_attempt_at <= now).cast(db.Integer)),
+            func.sum((DeletionTombstone.attempts > 0).cast(db.Integer)),
+            func.min(DeletionTombstone.created_at),
+        ).group_by(DeletionTombstone.kind)
+    ).all()
+    return {
+        kind: {"pending": total, "due": int(due or 0), "retried": int(retried or 0), "oldest": oldest}
+        for kind, total, due, retried, oldest in rows
+    }
+
+
+class DeletionReaper:
+    """
+    Runs reap() for a Flask app after tombstones are committed.
+
+    Args:
+        app: Flask app (the reaper thread needs its app context)
+        mode: 'background' or 'inline'
+        interval: Seconds between background passes when nothing wakes the thread
+    """
+
+    def __init__(self, app, mode: str = REAPER_MODE, interval: float = REAPER_INTERVAL_SECONDS):
+        self.app = app
+        self.mode = mode if mode in MODES else "background"
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def dispatch(self, tombstone_ids: List[int]) -> None:
+        """Reap newly committed tombstones: now (inline) or on the reaper thread."""
+        if not tombstone_ids:
+            return
+        if self.mode == "inline":
+            try:
+                reap(limit=len(tombstone_ids), ids=tombstone_ids)
+            except Exception as e:
+                # Left for the next run of reap_deletions.py
+                print(f"ERROR: Inline deletion reaping failed: {e}")
+            return
+        self._start()
+        self._wake.set()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="deletion-reaper", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    result = reap_all()
+                if result["claimed"]:
+                    print(f"Deletion reaper: {result['deleted']} deleted, {result['failed']} failed")
+            except Exception as e:
+                print(f"ERROR: Deletion reaper pass failed: {e}")
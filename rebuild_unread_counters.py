@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Rebuild support unread counters from support_chats.
+Run this after bulk edits to support_chats or if counters have drifted.
+"""
+
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+from app import app, db
+from support_counters import rebuild_unread_counters
+
+def rebuild_counters():
+    """Recompute every unread counter"""
+    with app.app_context():
+        try:
+            print("Rebuilding support unread counters...\n")
+
+            counts = rebuild_unread_counters()
+            for key, count in sorted(counts.items()):
+                print(f"✅ {key}: {count}")
+
+            print(f"\n✅ Rebuilt {len(counts)} counters")
+            return True
+
+        except Exception as e:
+            print(f"\n❌ Error rebuilding counters: {e}")
+            db.session.rollback()
+            return False
+
+if __name__ == '__main__':
+    import sys
+    success = rebuild_counters()
+    sys.exit(0 if success else 1)
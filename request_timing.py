@@ -0,0 +1,135 @@
+"""
+Request Timing for Ask-Chopper
+
+Lightweight spans for breaking a request's latency down by stage (DB queries,
+blob upload, extraction, chunking, embedding, vector add/query, prompt build,
+LLM call, commit).
+
+Spans record into the RequestTimings collector bound to the current context.
+Outside a request (scripts, the Telegram bot) no collector is bound and spans
+are no-ops. Work handed to a thread pool keeps recording into the request's
+collector when submitted with submit_with_timings().
+"""
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from threading import Lock
+from typing import Dict, Optional
+
+_current_timings: ContextVar = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Accumulated span durations for one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._spans = {}
+        self._lock = Lock()
+
+    def add(self, name: str, elapsed_ms: float) -> None:
+        with self._lock:
+            total_ms, count = self._spans.get(name, (0.0, 0))
+            self._spans[name] = (total_ms + elapsed_ms, count + 1)
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        """Span totals as {name: {"ms": total, "count": n}}, plus request total."""
+        with self._lock:
+            spans = {
+                name: {"ms": round(total_ms, 1), "count": count}
+                for name, (total_ms, count) in self._spans.items()
+            }
+        spans["total"] = {"ms": round((time.perf_counter() - self.started) * 1000, 1), "count": 1}
+        return spans
+
+    def server_timing_header(self) -> str:
+        """Render spans as a Server-Timing header value."""
+        parts = []
+        for name, values in self.as_dict().items():
+            entry = f"{name};dur={values['ms']}"
+            if values["count"] > 1:
+                entry += f';desc="{values["count"]} calls"'
+            parts.append(entry)
+        return ", ".join(parts)
+
+
+def start_request_timings():
+    """Bind a fresh collector to the current context. Returns a reset token."""
+    return _current_timings.set(RequestTimings())
+
+
+def end_request_timings(token) -> None:
+    """Unbind the collector bound by start_request_timings()."""
+    _current_timings.reset(token)
+
+
+def get_request_timings() -> Optional[RequestTimings]:
+    """Get the collector bound to the current context, if any."""
+    return _current_timings.get()
+
+
+def current_timings_dict() -> Optional[Dict[str, Dict[str, float]]]:
+    """Span totals for the current request, or None outside a request."""
+    timings = _current_timings.get()
+    return timings.as_dict() if timings else None
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block under `name` in the current request's collector."""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, (time.perf_counter() - started) * 1000)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def submit_with_timings(executor, fn, *args, **kwargs):
+    """Submit fn to an executor so its spans record into the caller's request."""
+    return executor.submit(copy_context().run, fn, *args, **kwargs)
+
+
+def instrument_sqlalchemy() -> None:
+    """Record every SQL statement executed during a request under the "db" span."""
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if getattr(instrument_sqlalchemy, "_installed", False):
+        return
+    instrument_sqlalchemy._installed = True
+
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_timings.get() is not None:
+            conn.info.setdefault("request_timing_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(Engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timings = _current_timings.get()
+        starts = conn.info.get("request_timing_query_start")
+        if timings is not None and starts:
+            timings.add("db", (time.perf_counter() - starts.pop()) * 1000)
+
+    @event.listens_for(Engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        starts = conn.info.get("request_timing_query_start") if conn is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,592 @@
+"""
+Chat Retention and Archival for Ask-Chopper
+
+Moves conversations nobody has touched for a while out of the hot tables,
+so chat_messages and its (session_id, created_at) index stay small enough
+to be cache-resident. Policies are per table and archive whole groups:
+
+    chat_messages  - chat sessions whose newest message is older than
+                     RETENTION_CHAT_MESSAGES_DAYS (default 90, 0 = never);
+                     each message's message_attachments rows go with it
+    support_chats  - support conversations with nothing unread whose newest
+                     message is older than RETENTION_SUPPORT_CHATS_DAYS
+                     (default 0 = never), so unread counters are unaffected
+
+Archive formats (RETENTION_FORMAT):
+
+    jsonl    - gzip-compressed JSON lines under RETENTION_ARCHIVE_DIR,
+               <table>/<YYYY-MM>/ by message month, one file per batch (default)
+    parquet  - zstd-compressed Parquet files in the same layout (needs pyarrow)
+    table    - chat_messages_archive / support_chats_archive, range-partitioned
+               by month on PostgreSQL (partitions are created as needed)
+
+Groups are archived RETENTION_BATCH_SIZE at a time. Each batch writes its
+archive and then deletes exactly the archived row ids in one transaction.
+Files are fsynced and listed in <table>/manifest.jsonl before the delete;
+table archives are inserted in the delete's transaction. A batch that
+fails between writing files and committing is archived again by the next
+run, and restore() skips rows that already exist.
+"""
+
+import gzip
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import case, delete, func, insert, select
+
+from bridge_log import log_bridge_event
+from history_cache import invalidate_session_history
+from models import (
+    db, ChatMessage, ChatMessageArchive, MessageAttachment, SupportChat, SupportChatArchive
+)
+
+FORMATS = ("jsonl", "parquet", "table")
+ARCHIVE_FORMAT = os.environ.get("RETENTION_FORMAT", "jsonl").strip().lower() or "jsonl"
+ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR", "archive")
+BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", "200"))
+
+# Ids per IN list, well under SQLite's bound parameter limit
+ID_CHUNK = 500
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """Archive groups of `table` (by `group_column`) idle for more than `days` days."""
+    table: str
+    days: int
+    group_column: str
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+
+_SOURCES = {
+    'chat_messages': (ChatMessage, ChatMessageArchive, 'session_id'),
+    'support_chats': (SupportChat, SupportChatArchive, 'user_id'),
+}
+
+_ATTACHMENT_COLUMNS = tuple(MessageAttachment.__table__.columns)
+
+
+def get_policies() -> Dict[str, RetentionPolicy]:
+    """Retention policy per table, from RETENTION_<TABLE>_DAYS."""
+    return {
+        table: RetentionPolicy(
+            table, int(os.environ.get(f"RETENTION_{table.upper()}_DAYS", default_days)), group_column
+        )
+        for table, group_column, default_days in (
+            ('chat_messages', 'session_id', "90"),
+            ('support_chats', 'user_id', "0"),
+        )
+    }
+
+
+def _check_format(fmt: str) -> str:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown archive format '{fmt}'. Use {', '.join(FORMATS)}.")
+    return fmt
+
+
+def _chunks(values: List[Any], size: int = ID_CHUNK) -> Iterator[List[Any]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(month: datetime) -> datetime:
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _datetime_columns(table) -> set:
+    return {column.name for column in table.columns if isinstance(column.type, db.DateTime)}
+
+
+# ---------------------------------------------------------------------------
+# Reading the hot tables
+# ---------------------------------------------------------------------------
+
+def candidate_groups(policy: RetentionPolicy, cutoff: datetime, after: Optional[Any] = None,
+                     limit: int = BATCH_SIZE) -> List[Any]:
+    """Next `limit` groups (in key order, after `after`) whose newest row is older than `cutoff`."""
+    model, _, group_name = _SOURCES[policy.table]
+    group = getattr(model, group_name)
+
+    query = select(group)
+    if after is not None:
+        query = query.where(group > after)
+    query = query.group_by(group).having(func.max(model.created_at) < cutoff)
+    if model is SupportChat:
+        unread = case((func.coalesce(SupportChat.is_read, False) == False, 1), else_=0)  # noqa: E712
+        query = query.having(func.sum(unread) == 0)
+
+    return list(db.session.execute(query.order_by(group).limit(limit)).scalars())
+
+
+def load_rows(policy: RetentionPolicy, groups: List[Any], cutoff: datetime) -> List[Dict[str, Any]]:
+    """
+    Rows of `groups` older than `cutoff` as column dicts, oldest id first.
+
+    Chat messages carry their attachment rows under 'attachments'. Rows
+    written after the groups were picked stay in the hot table.
+    """
+    model, _, group_name = _SOURCES[policy.table]
+    rows = [
+        row._asdict() for row in db.session.execute(
+            select(*model.__table__.columns)
+            .where(getattr(model, group_name).in_(groups), model.created_at < cutoff)
+            .order_by(model.id)
+        )
+    ]
+
+    if model is ChatMessage:
+        attachments = {}
+        for ids in _chunks([row['id'] for row in rows]):
+            for attachment in db.session.execute(
+                select(*_ATTACHMENT_COLUMNS)
+                .where(MessageAttachment.message_id.in_(ids))
+                .order_by(MessageAttachment.id)
+            ):
+                attachments.setdefault(attachment.message_id, []).append(attachment._asdict())
+        for row in rows:
+            row['attachments'] = attachments.get(row['id'], [])
+    return rows
+
+
+def _delete_rows(policy: RetentionPolicy, ids: List[int]) -> None:
+    model = _SOURCES[policy.table][0]
+    for chunk in _chunks(ids):
+        if model is ChatMessage:
+            # The archived copies keep content_sha256, so shared files stay referenced (content_store.py)
+            db.session.execute(
+                delete(MessageAttachment).where(MessageAttachment.message_id.in_(chunk)),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.execute(
+            delete(model).where(model.id.in_(chunk)),
+            execution_options={'synchronize_session': False}
+        )
+
+
+# ---------------------------------------------------------------------------
+# Archive files
+# ---------------------------------------------------------------------------
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't serialize {type(value).__name__}")
+
+
+def _fsync_write(path: str, write) -> None:
+    """Write a file through a temporary name so a crash never leaves half an archive."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_jsonl(path: str, rows: List[Dict[str, Any]]) -> None:
+    def write(f):
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for row in rows:
+                gz.write(json.dumps(row, default=_json_default).encode('utf-8') + b"\n")
+    _fsync_write(path, write)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("RETENTION_FORMAT=parquet needs pyarrow (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _write_parquet(path: str, rows: List[Dict[str, Any]]) -> None:
+    pa, pq = _import_pyarrow()
+    # Attachments as JSON text keep the schema identical across files
+    flat = [
+        {**row, 'attachments': json.dumps(row['attachments'], default=_json_default)} if 'attachments' in row else row
+        for row in rows
+    ]
+    _fsync_write(path, lambda f: pq.write_table(pa.Table.from_pylist(flat), f, compression='zstd'))
+
+
+def _read_archive_file(path: str) -> List[Dict[str, Any]]:
+    if path.endswith('.parquet'):
+        _, pq = _import_pyarrow()
+        rows = pq.read_table(path).to_pylist()
+        for row in rows:
+            if isinstance(row.get('attachments'), str):
+                row['attachments'] = json.loads(row['attachments'])
+        return rows
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _write_archive_files(policy: RetentionPolicy, rows: List[Dict[str, Any]], fmt: str,
+                         run_stamp: str, batch_number: int) -> None:
+    """Write a batch's rows to per-month files and list its groups in the manifest."""
+    table_dir = os.path.join(ARCHIVE_DIR, policy.table)
+    extension = 'parquet' if fmt == 'parquet' else 'jsonl.gz'
+
+    by_month = {}
+    for row in rows:
+        created_at = row['created_at'] or row.get('archived_at') or datetime.utcnow()
+        by_month.setdefault(created_at.strftime('%Y-%m'), []).append(row)
+
+    manifest = []
+    archived_at = datetime.utcnow().isoformat()
+    for month, month_rows in sorted(by_month.items()):
+        month_dir = os.path.join(table_dir, month)
+        os.makedirs(month_dir, exist_ok=True)
+        name = f"{policy.table}-{run_stamp}-{batch_number:04d}.{extension}"
+        path = os.path.join(month_dir, name)
+        if fmt == 'parquet':
+            _write_parquet(path, month_rows)
+        else:
+            _write_jsonl(path, month_rows)
+
+        counts = {}
+        for row in month_rows:
+            counts[row[policy.group_column]] = counts.get(row[policy.group_column], 0) + 1
+        manifest.extend(
+            {'group': group, 'file': os.path.join(month, name), 'rows': count, 'archived_at': archived_at}
+            for group, count in counts.items()
+        )
+
+    _append_manifest(policy.table, manifest)
+
+
+def _read_manifest(table: str) -> List[Dict[str, Any]]:
+    path = os.path.join(ARCHIVE_DIR, table, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _append_manifest(table: str, entries: List[Dict[str, Any]]) -> None:
+    with open(os.path.join(ARCHIVE_DIR, table, MANIFEST_NAME), 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _manifest_files(table: str, group: Any) -> List[str]:
+    """Archive files holding `group`'s rows, since it was last restored."""
+    files = []
+    for entry in _read_manifest(table):
+        if entry['group'] != group:
+            continue
+        if entry.get('restored_at'):
+            files = []
+        elif entry['file'] not in files:
+            files.append(entry['file'])
+    return [os.path.join(ARCHIVE_DIR, table, name) for name in files]
+
+
+def _manifest_row_count(table: str) -> int:
+    """Rows the manifest lists in archive files, leaving out groups restored since."""
+    counts = {}
+    for entry in _read_manifest(table):
+        group = entry['group']
+        counts[group] = 0 if entry.get('restored_at') else counts.get(group, 0) + entry['rows']
+    return sum(counts.values())
+
+
+# ---------------------------------------------------------------------------
+# Archive tables
+# ---------------------------------------------------------------------------
+
+def _is_postgres() -> bool:
+    return db.engine.dialect.name == "postgresql"
+
+
+def ensure_archive_partitions(archive_table: str, months: List[datetime]) -> List[str]:
+    """
+    Create the DEFAULT partition and one partition per month of `months` (PostgreSQL only).
+
+    Month partitions must exist before rows for that month are archived:
+    PostgreSQL refuses to create a partition whose range already has rows
+    in the DEFAULT partition.
+
+    Returns:
+        Names of the partitions ensured
+    """
+    if not _is_postgres():
+        return []
+    db.session.execute(db.text(
+        f"CREATE TABLE IF NOT EXISTS {archive_table}_default PARTITION OF {archive_table} DEFAULT"
+    ))
+    names = []
+    for month in sorted({_month_start(m) for m in months}):
+        name = f"{archive_table}_y{month.year}m{month.month:02d}"
+        db.session.execute(db.text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {archive_table} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_next_month(month):%Y-%m-%d}')"
+        ))
+        names.append(name)
+    return names
+
+
+def list_archive_partitions(archive_table: str) -> List[str]:
+    """Partitions of an archive table (PostgreSQL only)."""
+    if not _is_postgres():
+        return []
+    return list(db.session.execute(db.text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :table ORDER BY child.relname"
+    ), {'table': archive_table}).scalars())
+
+
+def _insert_archive_rows(policy: RetentionPolicy, rows: List[Dict[str, Any]]) -> None:
+    archive_model = _SOURCES[policy.table][1]
+    columns = {column.name for column in archive_model.__table__.columns}
+    archived_at = datetime.utcnow()
+    records = []
+    for row in rows:
+        record = {key: value for key, value in row.items() if key in columns}
+        if 'attachments' in record:
+            record['attachments'] = json.loads(json.dumps(record['attachments'], default=_json_default))
+        # Partition key can't be NULL; messages without a timestamp file under the archive date
+        record['created_at'] = row['created_at'] or archived_at
+        record['archived_at'] = archived_at
+        records.append(record)
+
+    ensure_archive_partitions(archive_model.__tablename__, [record['created_at'] for record in records])
+    db.session.execute(insert(archive_model.__table__), records)
+
+
+# ---------------------------------------------------------------------------
+# Archive / restore
+# ---------------------------------------------------------------------------
+
+def archive(tables: Optional[List[str]] = None, fmt: Optional[str] = None, dry_run: bool = False,
+            batch_size: int = BATCH_SIZE, max_batches: Optional[int] = None,
+            now: Optional[datetime] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Archive idle groups of each table under its retention policy.
+
+    Args:
+        tables: Tables to archive; defaults to every table with an enabled policy
+        fmt: 'jsonl', 'parquet' or 'table'; defaults to RETENTION_FORMAT
+        dry_run: Only count what would be archived
+        batch_size: Groups per batch (one transaction each)
+        max_batches: Stop each table after this many batches
+        now: Reference time for the cutoffs (defaults to utcnow)
+
+    Returns:
+        {table: {'groups', 'rows', 'batches'}}
+    """
+    fmt = _check_format(fmt or ARCHIVE_FORMAT)
+    policies = get_policies()
+    now = now or datetime.utcnow()
+    run_stamp = now.strftime('%Y%m%dT%H%M%S')
+    results = {}
+
+    for table in tables or [name for name, policy in policies.items() if policy.enabled]:
+        if table not in policies:
+            raise ValueError(f"No retention policy for table '{table}'. Use {', '.join(policies)}.")
+        policy = policies[table]
+        stats = {'groups': 0, 'rows': 0, 'batches': 0}
+        results[table] = stats
+        if not policy.enabled:
+            continue
+        cutoff = now - timedelta(days=policy.days)
+
+        after = None
+        while max_batches is None or stats['batches'] < max_batches:
+            groups = candidate_groups(policy, cutoff, after=after, limit=batch_size)
+            if not groups:
+                break
+            rows = load_rows(policy, groups, cutoff)
+            stats['batches'] += 1
+            stats['groups'] += len(groups)
+            stats['rows'] += len(rows)
+
+            # Key order also pages past groups that keep rows (newer or undated ones)
+            after = groups[-1]
+            if dry_run:
+                db.session.rollback()
+                continue
+
+            try:
+                if fmt == 'table':
+                    _insert_archive_rows(policy, rows)
+                else:
+                    _write_archive_files(policy, rows, fmt, run_stamp, stats['batches'])
+                _delete_rows(policy, [row['id'] for row in rows])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+            if table == 'chat_messages':
+                # Bulk deletes bypass the history cache's flush tracking
+                for session_id in groups:
+                    invalidate_session_history(session_id)
+            print(f"📦 {table}: batch {stats['batches']} archived {len(groups)} groups, {len(rows)} rows")
+
+        log_bridge_event(
+            source="retention",
+            event="retention_dry_run" if dry_run else "retention_archive",
+            extra={"table": table, "format": fmt, "days": policy.days, "cutoff": cutoff.isoformat(), **stats}
+        )
+    return results
+
+
+def restore(table: str, group: Any) -> int:
+    """
+    Move one archived group (a chat session or a user's support chat) back into its table.
+
+    Rows come from the archive table and from every archive file the manifest
+    lists for the group since it was last restored; rows whose id already
+    exists are skipped. Restoring adds a restored_at entry for the group to
+    the manifest (the files are kept).
+
+    Args:
+        table: 'chat_messages' or 'support_chats'
+        group: session_id for chat_messages, user_id for support_chats
+
+    Returns:
+        Number of rows restored
+    """
+    if table not in _SOURCES:
+        raise ValueError(f"Unknown table '{table}'. Use {', '.join(_SOURCES)}.")
+    model, archive_model, group_name = _SOURCES[table]
+    group = int(group) if group_name == 'user_id' else group
+
+    rows = {}
+    files = _manifest_files(table, group)
+    for path in files:
+        datetime_columns = _datetime_columns(model.__table__)
+        for row in _read_archive_file(path):
+            if row[group_name] != group:
+                continue
+            for key in datetime_columns:
+                if isinstance(row.get(key), str):
+                    row[key] = datetime.fromisoformat(row[key])
+            rows[row['id']] = row
+
+    archived = db.session.execute(
+        select(*archive_model.__table__.columns).where(getattr(archive_model, group_name) == group)
+    ).all()
+    for row in archived:
+        rows[row.id] = row._asdict()
+
+    existing = set()
+    for ids in _chunks(sorted(rows)):
+        existing.update(db.session.execute(select(model.id).where(model.id.in_(ids))).scalars())
+
+    columns = {column.name for column in model.__table__.columns}
+    attachment_datetimes = _datetime_columns(MessageAttachment.__table__)
+    records, attachments = [], []
+    for message_id in sorted(set(rows) - existing):
+        row = rows[message_id]
+        records.append({key: value for key, value in row.items() if key in columns})
+        for attachment in row.get('attachments') or []:
+            attachment = dict(attachment)
+            for key in attachment_datetimes:
+                if isinstance(attachment.get(key), str):
+                    attachment[key] = datetime.fromisoformat(attachment[key])
+            attachments.append(attachment)
+
+    try:
+        if records:
+            db.session.execute(insert(model.__table__), records)
+        if attachments:
+            attachment_ids = [attachment['id'] for attachment in attachments]
+            present = set()
+            for ids in _chunks(attachment_ids):
+                present.update(db.session.execute(
+                    select(MessageAttachment.id).where(MessageAttachment.id.in_(ids))
+                ).scalars())
+            missing = [attachment for attachment in attachments if attachment['id'] not in present]
+            if missing:
+                db.session.execute(insert(MessageAttachment.__table__), missing)
+        if archived:
+            db.session.execute(
+                delete(archive_model).where(getattr(archive_model, group_name) == group),
+                execution_options={'synchronize_session': False}
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if files:
+        # The group's files stay on disk, but they no longer count as archived
+        _append_manifest(table, [{'group': group, 'restored_at': datetime.utcnow().isoformat()}])
+    if table == 'chat_messages':
+        invalidate_session_history(group)
+    log_bridge_event(
+        source="retention",
+        event="retention_restore",
+        session_id=group if table == 'chat_messages' else None,
+        user_id=group if table == 'support_chats' else None,
+        extra={"table": table, "rows": len(records), "attachments": len(attachments)}
+    )
+    return len(records)
+
+
+def status(now: Optional[datetime] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Hot and archived row counts, groups due for archiving and partitions, per table.
+
+    Archived rows are counted per format: 'archived_table_rows' in the archive
+    table (None if it doesn't exist), 'archived_file_rows' from the manifest
+    of the archive files, and their sum as 'archived_rows'.
+    """
+    now = now or datetime.utcnow()
+    inspector = db.inspect(db.engine)
+    report = {}
+    for table, policy in get_policies().items():
+        model, archive_model, _ = _SOURCES[table]
+        due = 0
+        if policy.enabled:
+            cutoff = now - timedelta(days=policy.days)
+            after = None
+            while True:
+                groups = candidate_groups(policy, cutoff, after=after, limit=1000)
+                if not groups:
+                    break
+                due += len(groups)
+                after = groups[-1]
+        table_rows = (
+            db.session.query(func.count(archive_model.id)).scalar()
+            if inspector.has_table(archive_model.__tablename__) else None
+        )
+        file_rows = _manifest_row_count(table)
+        report[table] = {
+            'days': policy.days,
+            'hot_rows': db.session.query(func.count(model.id)).scalar(),
+            'groups_due': due,
+            'archived_rows': (table_rows or 0) + file_rows,
+            'archived_table_rows': table_rows,
+            'archived_file_rows': file_rows,
+            'partitions': list_archive_partitions(archive_model.__tablename__),
+        }
+    return report
+
+
+def vacuum_hot_tables() -> None:
+    """VACUUM (ANALYZE) the archived tables so freed space is reused (PostgreSQL only)."""
+    if not _is_postgres():
+        return
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM (ANALYZE) chat_messages, message_attachments, support_chats")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark the admin support inbox query.
+
+Seeds a database with support conversations, then compares the previous
+per-user approach (2 queries per user + Python sort) with the single
+aggregated query in support_inbox.py: first page, and walking every page.
+
+Usage:
+    python3 scripts/bench_admin_inbox.py --users 2000 --messages 10
+    python3 scripts/bench_admin_inbox.py --database-url postgresql://... --users 5000
+
+Seeded rows are tagged with @inbox-bench.local emails and removed with
+--cleanup. Never point this at a production database.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_EMAIL_DOMAIN = "@inbox-bench.local"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Admin inbox benchmark")
+    parser.add_argument("--database-url", default="file:/tmp/chopper_inbox_bench.db",
+                        help="DATABASE_URL for the benchmark database")
+    parser.add_argument("--users", type=int, default=2000, help="Users with support conversations")
+    parser.add_argument("--messages", type=int, default=10, help="Support messages per user")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--cleanup", action="store_true", help="Delete seeded rows and exit")
+    return parser.parse_args()
+
+
+args = parse_args()
+os.environ["DATABASE_URL"] = args.database_url
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app  # noqa: E402
+from models import db, User, SupportChat  # noqa: E402
+from support_inbox import get_admin_inbox  # noqa: E402
+
+
+def cleanup():
+    bench_users = db.session.query(User.id).filter(User.email.like(f"%{BENCH_EMAIL_DOMAIN}"))
+    SupportChat.query.filter(SupportChat.user_id.in_(bench_users)).delete(synchronize_session=False)
+    User.query.filter(User.email.like(f"%{BENCH_EMAIL_DOMAIN}")).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def seed(users, messages):
+    existing = User.query.filter(User.email.like(f"%{BENCH_EMAIL_DOMAIN}")).count()
+    if existing >= users:
+        print(f"Reusing {existing} seeded users")
+        return
+    cleanup()
+
+    print(f"Seeding {users} users x {messages} support messages...")
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    template_user = User(first_name="x", surname="x", email="x", phone_number="0", age=30)
+    template_user.set_password("bench-password")
+    password_hash = template_user.password_hash
+
+    db.session.execute(User.__table__.insert(), [
+        {
+            "first_name": f"Bench{i}",
+            "surname": "User",
+            "email": f"user{i}{BENCH_EMAIL_DOMAIN}",
+            "phone_number": "0000000000",
+            "age": 30,
+            "password_hash": password_hash,
+            "is_admin": False,
+            "created_at": now,
+        }
+        for i in range(users)
+    ])
+    user_ids = [row.id for row in db.session.query(User.id).filter(User.email.like(f"%{BENCH_EMAIL_DOMAIN}"))]
+
+    batch = []
+    for user_id in user_ids:
+        started = now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+        for n in range(messages):
+            sender = "user" if n % 2 == 0 else "admin"
+            batch.append({
+                "user_id": user_id,
+                "sender_type": sender,
+                "message": f"Bench message {n} from {sender}",
+                "is_read": rng.random() < 0.7,
+                "created_at": started + timedelta(seconds=n * 30),
+            })
+        if len(batch) >= 10000:
+            db.session.execute(SupportChat.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(SupportChat.__table__.insert(), batch)
+    db.session.commit()
+
+
+def legacy_inbox():
+    """The dashboard's previous per-user implementation."""
+    users_with_chats = db.session.query(User).join(SupportChat).distinct().all()
+    user_data = []
+    for user in users_with_chats:
+        unread_count = SupportChat.query.filter_by(user_id=user.id, sender_type='user', is_read=False).count()
+        last_message = SupportChat.query.filter_by(user_id=user.id).order_by(SupportChat.created_at.desc()).first()
+        user_data.append({'user': user, 'unread_count': unread_count, 'last_message': last_message})
+    user_data.sort(key=lambda x: (-(x['unread_count']),
+                                  -(x['last_message'].created_at.timestamp() if x['last_message'] else 0)))
+    total_unread = SupportChat.query.filter_by(sender_type='user', is_read=False).count()
+    return user_data, total_unread
+
+
+def all_pages(page_size):
+    rows = []
+    cursor = None
+    while True:
+        page = get_admin_inbox(limit=page_size, cursor=cursor)
+        rows.extend(page['rows'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return rows
+
+
+def measure(label, fn, query_counter):
+    db.session.expunge_all()
+    query_counter[0] = 0
+    started = time.perf_counter()
+    result = fn()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"{label:<28} {elapsed_ms:>10.1f} ms {query_counter[0]:>8} queries")
+    return result
+
+
+def main():
+    with app.app_context():
+        if args.cleanup:
+            cleanup()
+            print("Removed seeded rows")
+            return
+
+        seed(args.users, args.messages)
+
+        query_counter = [0]
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count_queries(*_):
+            query_counter[0] += 1
+
+        print(f"\n{'approach':<28} {'time':>13} {'queries':>8}")
+        legacy_rows, legacy_unread = measure("legacy (all users)", legacy_inbox, query_counter)
+        first_page = measure(f"aggregated (page of {args.page_size})",
+                             lambda: get_admin_inbox(limit=args.page_size), query_counter)
+        walked = measure("aggregated (all pages)", lambda: all_pages(args.page_size), query_counter)
+
+        legacy_order = [(row['user'].id, row['unread_count']) for row in legacy_rows]
+        walked_order = [(row['user'].id, row['unread_count']) for row in walked]
+        print(f"\nconversations: legacy={len(legacy_rows)} aggregated={first_page['conversation_count']}")
+        print(f"total unread:  legacy={legacy_unread} aggregated={first_page['total_unread']}")
+        print(f"same unread counts per user: {sorted(legacy_order) == sorted(walked_order)}")
+
+
+if __name__ == "__main__":
+    main()
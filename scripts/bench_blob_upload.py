@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Benchmark the multipart Blob uploader.
+
+Uploads a generated file through LocalBlobTransport, which writes to a
+temporary directory and simulates per-request latency and per-connection
+bandwidth, at several concurrency levels. Then interrupts an upload
+part-way and resumes it, counting the parts sent again.
+
+Usage:
+    python3 scripts/bench_blob_upload.py --size-mb 50 --concurrency 1,2,4,8
+    python3 scripts/bench_blob_upload.py --latency 0.08 --bandwidth-mbps 20 --failure-rate 0.1
+    python3 scripts/bench_blob_upload.py --base-url http://127.0.0.1:9000   # mock Blob HTTP server
+
+Never point --base-url at the real Blob API.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from blob_upload import BlobUploadError, LocalBlobTransport, VercelBlobTransport  # noqa: E402
+from multipart_upload import MultipartUploader, UploadStateStore  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multipart Blob upload benchmark")
+    parser.add_argument("--size-mb", type=float, default=50, help="Size of the uploaded file")
+    parser.add_argument("--part-size-mb", type=float, default=8)
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Comma-separated concurrency levels")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--bandwidth-mbps", type=float, default=40, help="Per-connection upload speed (0: unlimited)")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Chance that a part upload fails")
+    parser.add_argument("--base-url", help="Use VercelBlobTransport against this mock Blob API instead")
+    return parser.parse_args()
+
+
+class InterruptingTransport:
+    """Wraps a transport and fails for good after `limit` part uploads, like a dropped connection."""
+
+    def __init__(self, transport, limit):
+        self._transport = transport
+        self._lock = threading.Lock()
+        self.limit = limit
+        self.parts_started = 0
+        self.parts_sent = 0
+
+    def upload_part(self, *args, **kwargs):
+        with self._lock:
+            if self.limit is not None and self.parts_started >= self.limit:
+                raise BlobUploadError("Simulated interruption")
+            self.parts_started += 1
+        etag = self._transport.upload_part(*args, **kwargs)
+        with self._lock:
+            self.parts_sent += 1
+        return etag
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+
+def make_file(directory, size):
+    path = os.path.join(directory, "source.bin")
+    block = os.urandom(MB)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(MB, remaining)])
+            remaining -= MB
+    with open(path, "rb") as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    return path, expected
+
+
+def make_transport(args, root):
+    if args.base_url:
+        return VercelBlobTransport("bench-token", base_url=args.base_url)
+    return LocalBlobTransport(root, latency=args.latency, bandwidth_mbps=args.bandwidth_mbps or None,
+                              failure_rate=args.failure_rate, seed=42)
+
+
+def main():
+    args = parse_args()
+    size = int(args.size_mb * MB)
+    part_size = int(args.part_size_mb * MB)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    work_dir = tempfile.mkdtemp(prefix="chopper_upload_bench_")
+
+    try:
+        source, expected = make_file(work_dir, size)
+        if args.base_url:
+            network = f"Blob API at {args.base_url}"
+        else:
+            network = (f"latency {args.latency * 1000:.0f} ms, bandwidth {args.bandwidth_mbps or 'unlimited'} "
+                       f"Mbit/s per connection, failure rate {args.failure_rate:.0%}")
+        print(f"File: {size / MB:.0f} MB, parts: {part_size / MB:.0f} MB, {network}")
+        print(f"{'concurrency':>12} {'seconds':>9} {'MB/s':>8} {'speedup':>8}")
+
+        baseline = None
+        for level in levels:
+            transport = make_transport(args, os.path.join(work_dir, "blobs"))
+            uploader = MultipartUploader(transport, part_size=part_size, concurrency=level, backoff=0.05)
+            with open(source, "rb") as f:
+                started = time.perf_counter()
+                _, uploaded, digest = uploader.upload(f, f"bench/c{level}.bin", "application/octet-stream")
+                elapsed = time.perf_counter() - started
+            assert uploaded == size and digest == expected, "uploaded data does not match the source"
+            baseline = baseline or elapsed
+            print(f"{level:>12} {elapsed:>9.2f} {size / MB / elapsed:>8.1f} {baseline / elapsed:>7.1f}x")
+
+        # Interrupt an upload half-way, then upload the same path again
+        total_parts = -(-size // part_size)
+        transport = InterruptingTransport(make_transport(args, os.path.join(work_dir, "blobs")), total_parts // 2)
+        uploader = MultipartUploader(transport, part_size=part_size, concurrency=max(levels), backoff=0.05,
+                                     state_store=UploadStateStore(os.path.join(work_dir, "state")))
+        with open(source, "rb") as f:
+            try:
+                uploader.upload(f, "bench/resume.bin", "application/octet-stream")
+            except BlobUploadError:
+                pass
+        sent_before = transport.parts_sent
+        transport.limit = None
+        with open(source, "rb") as f:
+            _, uploaded, digest = uploader.upload(f, "bench/resume.bin", "application/octet-stream")
+        assert uploaded == size and digest == expected, "resumed upload does not match the source"
+        print(f"\nResume: {total_parts} parts, {sent_before} sent before the interruption, "
+              f"{transport.parts_sent - sent_before} sent on resume")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Benchmark document ingest memory: peak allocations per upload.
+
+Compares the ingest path (as /chat-with-document runs it) with the code it
+replaced:
+
+    previous  the previous extract_text(): file.read() into bytes, a new
+              BytesIO for pdfplumber/docx, bytes.decode() for text
+    extract   document_processor.extract_text() on an open_reader() of the
+              upload: memory-mapped, parsed or decoded in place
+    store     content_store.hash_stream() + LocalStorage.save_stream() on a
+              second reader (chunked copies, no database)
+    ingest    extract + store, both readers over the same upload
+
+The upload is spooled the way Werkzeug does (SpooledTemporaryFile,
+500 KB in memory) before measuring. Each method runs in a fresh Python
+process; "peak alloc" is tracemalloc's peak of Python allocations during
+the method and "peak RSS" the growth of the process' high-water mark over
+its baseline after imports. The extracted text itself is part of both (a
+str of the upload's length in characters, two bytes each once it holds
+a non-Latin-1 character). Pages of a memory-mapped upload count towards
+RSS while they are read, but they are the page cache's and the kernel can
+drop them, where the previous bytes copy had to stay resident.
+
+A text document of --size-mb (default 50) is generated unless --file is
+given (PDF and DOCX need pdfplumber / python-docx installed).
+
+Usage:
+    python3 scripts/bench_ingest_memory.py
+    python3 scripts/bench_ingest_memory.py --file ~/Documents/report.pdf --runs 3
+"""
+
+import argparse
+import json
+import mimetypes
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+METHODS = ("previous", "extract", "store", "ingest")
+SPOOL_MAX_SIZE = 500 * 1024  # Werkzeug's in-memory limit for form uploads
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Document ingest memory benchmark")
+    parser.add_argument("--file", help="Document to ingest (default: a generated text file)")
+    parser.add_argument("--size-mb", type=int, default=50, help="Size of the generated text file")
+    parser.add_argument("--runs", type=int, default=3, help="Ingests per method")
+    parser.add_argument("--method", choices=METHODS, help=argparse.SUPPRESS)  # worker process
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    # VmHWM starts over at exec; ru_maxrss can carry the parent's peak across fork + exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_text_file(directory, size_mb):
+    path = os.path.join(directory, f"document_{size_mb}mb.txt")
+    # Mostly ASCII with some multi-byte characters, like real notes and code
+    line = ("Quarterly revenue grew 12% — naïve forecasts missed it; see §4.2 and the appendix. " * 4 + "\n").encode()
+    with open(path, "wb") as f:
+        for _ in range(size_mb * 1024 * 1024 // len(line) + 1):
+            f.write(line)
+        f.truncate(size_mb * 1024 * 1024)
+    return path
+
+
+def spool_upload(path):
+    """The upload as Werkzeug hands it to the app: a SpooledTemporaryFile."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, spool, COPY_CHUNK_SIZE)
+    spool.seek(0)
+    return spool
+
+
+def extract_previous(upload, mime_type):
+    import io
+    import document_processor
+
+    upload.seek(0)
+    content = upload.read()
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    if mime_type == "application/pdf":
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(content)) as pdf:
+            return "\n\n".join(page.extract_text() or "" for page in pdf.pages)
+    if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        from docx import Document
+        return "\n\n".join(para.text for para in Document(io.BytesIO(content)).paragraphs)
+    return document_processor._extract_text(content)
+
+
+def store(upload, filename, mime_type, storage_dir):
+    import content_store
+    from blob_upload import open_reader
+    from storage import LocalStorage
+
+    backend = LocalStorage(SimpleNamespace(config={"UPLOAD_FOLDER": storage_dir}), hardlinks=False)
+    with open_reader(upload) as reader:
+        sha256, _ = content_store.hash_stream(reader)
+        return backend.save_stream(reader, content_store.object_name(sha256, filename),
+                                   mime_type, sha256=sha256).size
+
+
+def run_method(method, upload, filename, mime_type, storage_dir):
+    import document_processor
+    from blob_upload import open_reader
+
+    if method == "previous":
+        return len(extract_previous(upload, mime_type))
+    if method == "store":
+        return store(upload, filename, mime_type, storage_dir)
+    with open_reader(upload, filename, mime_type) as reader:
+        text = document_processor.extract_text(reader, mime_type)
+    if method == "ingest":
+        store(upload, filename, mime_type, storage_dir)
+    return len(text)
+
+
+def worker(args):
+    import content_store  # noqa: F401  (imports count towards the baseline, not the method)
+    import document_processor  # noqa: F401
+    import storage  # noqa: F401
+
+    filename = os.path.basename(args.file)
+    mime_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    upload = spool_upload(args.file)
+    storage_dir = tempfile.mkdtemp(prefix="chopper_ingest_bench_")
+    # Silence the processor's DEBUG prints
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        baseline = peak_rss_mb()
+        timings, peaks = [], []
+        output = 0
+        for _ in range(args.runs):
+            tracemalloc.start()
+            started = time.perf_counter()
+            output = run_method(args.method, upload, filename, mime_type, storage_dir)
+            timings.append((time.perf_counter() - started) * 1000)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024 / 1024)
+            tracemalloc.stop()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        shutil.rmtree(storage_dir, ignore_errors=True)
+    timings.sort()
+    print(json.dumps({
+        "median_ms": timings[len(timings) // 2],
+        "peak_alloc_mb": max(peaks),
+        "peak_mb": peak_rss_mb() - baseline,
+        "output": output,
+    }))
+
+
+def main():
+    args = parse_args()
+    if args.method:
+        worker(args)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="chopper_ingest_bench_") as directory:
+        path = args.file or make_text_file(directory, args.size_mb)
+        print(f"\n{os.path.basename(path)}: {os.path.getsize(path) / 1024 / 1024:.1f} MB, {args.runs} runs")
+        print(f"{'method':>10} {'median ms':>10} {'peak alloc MB':>14} {'peak RSS MB':>12}")
+        for method in METHODS:
+            result = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--method", method,
+                 "--file", path, "--runs", str(args.runs)],
+                capture_output=True, text=True, check=True
+            )
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            print(f"{method:>10} {stats['median_ms']:>10.1f} {stats['peak_alloc_mb']:>14.1f} "
+                  f"{stats['peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Benchmark thumbnail generation: time and peak memory per image.
+
+Compares the thumbnailing in thumbnails.py with the code it replaced:
+
+    full-decode  Image.open + load() + thumbnail(150, LANCZOS): every pixel decoded
+    previous     the previous create_thumbnail(): Image.open + thumbnail(150, LANCZOS)
+    previous-set previous approach once per size and format of the thumbnail set
+    single       thumbnails.make_thumbnail(150)
+    set          thumbnails.render_thumbnails() (every THUMBNAIL_SIZES box, JPEG/PNG + WebP)
+
+Each method runs in a fresh Python process, so its peak RSS is measured
+on its own. Test images are generated (a 12 MP photo-like JPEG and a
+2560x1600 PNG screenshot) unless --image is given.
+
+Usage:
+    python3 scripts/bench_thumbnails.py
+    python3 scripts/bench_thumbnails.py --image ~/Pictures/IMG_0001.jpg --runs 20
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+METHODS = ("full-decode", "previous", "previous-set", "single", "set")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Thumbnail benchmark")
+    parser.add_argument("--image", action="append", help="Image to thumbnail (repeatable)")
+    parser.add_argument("--runs", type=int, default=10, help="Thumbnails per method and image")
+    parser.add_argument("--method", choices=METHODS, help=argparse.SUPPRESS)  # worker process
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    # VmHWM starts over at exec; ru_maxrss can carry the parent's peak across fork + exec
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def make_test_images(directory):
+    from PIL import Image, ImageDraw
+
+    photo_path = os.path.join(directory, "photo_12mp.jpg")
+    # Noise over a gradient compresses and decodes like a real photo
+    photo = Image.merge("RGB", [
+        Image.effect_noise((4032, 3024), 40).point(lambda v, shift=shift: (v + shift) % 256)
+        for shift in (0, 60, 120)
+    ])
+    photo = Image.blend(photo, Image.linear_gradient("L").resize((4032, 3024)).convert("RGB"), 0.5)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees, as phones write it
+    photo.save(photo_path, "JPEG", quality=90, exif=exif.tobytes())
+
+    screenshot_path = os.path.join(directory, "screenshot.png")
+    screenshot = Image.new("RGB", (2560, 1600), (245, 245, 245))
+    draw = ImageDraw.Draw(screenshot)
+    for row in range(0, 1600, 40):
+        draw.rectangle((40, row + 8, 40 + (row * 7) % 2400, row + 28), fill=(30, 90, 200))
+    screenshot.save(screenshot_path, "PNG")
+    return [photo_path, screenshot_path]
+
+
+def thumbnail_previous(path, size, fmt):
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format=fmt, optimize=True, quality=85)
+        return buffer.getvalue()
+
+
+def run_method(method, path):
+    from PIL import Image
+    import thumbnails
+
+    if method == "full-decode":
+        with Image.open(path) as img:
+            img.load()
+            img.thumbnail((150, 150), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            img.save(buffer, format=img.format or "JPEG", optimize=True, quality=85)
+            return len(buffer.getvalue())
+    if method == "previous":
+        with Image.open(path) as img:
+            fmt = img.format
+        return len(thumbnail_previous(path, 150, fmt))
+    if method == "previous-set":
+        with Image.open(path) as img:
+            fmt = img.format
+        return sum(
+            len(thumbnail_previous(path, size, output))
+            for size in thumbnails.THUMBNAIL_SIZES for output in (fmt, "WEBP")
+        )
+    if method == "single":
+        return len(thumbnails.make_thumbnail(path, 150)[0])
+    return sum(len(render["data"]) for render in thumbnails.render_thumbnails(path))
+
+
+def worker(args):
+    import PIL.Image  # noqa: F401  (imports count towards the baseline, not the method)
+    import thumbnails  # noqa: F401
+
+    baseline = peak_rss_mb()
+    timings = []
+    output_bytes = 0
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        output_bytes = run_method(args.method, args.image[0])
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    print(json.dumps({
+        "median_ms": timings[len(timings) // 2],
+        "peak_mb": peak_rss_mb() - baseline,
+        "output_kb": output_bytes / 1024,
+    }))
+
+
+def main():
+    args = parse_args()
+    if args.method:
+        worker(args)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="chopper_thumb_bench_") as directory:
+        images = args.image or make_test_images(directory)
+        for image in images:
+            from PIL import Image
+            with Image.open(image) as img:
+                print(f"\n{os.path.basename(image)}: {img.width}x{img.height} {img.format}, "
+                      f"{os.path.getsize(image) / 1024 / 1024:.1f} MB, {args.runs} runs")
+            print(f"{'method':>14} {'median ms':>10} {'peak RSS MB':>12} {'output KB':>10}")
+            for method in METHODS:
+                result = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--method", method,
+                     "--image", image, "--runs", str(args.runs)],
+                    capture_output=True, text=True, check=True
+                )
+                stats = json.loads(result.stdout.strip().splitlines()[-1])
+                print(f"{method:>14} {stats['median_ms']:>10.1f} {stats['peak_mb']:>12.1f} "
+                      f"{stats['output_kb']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
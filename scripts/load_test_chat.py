@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Load test for the /chat endpoint.
+
+Compares how many chat turns one server process can hold in flight when the
+LLM is slow, e.g. the WSGI app (python3 app.py / gunicorn) against the async
+ASGI mode (uvicorn asgi:application), while sampling the server's memory.
+
+1. Start a mock Anthropic API that answers after a fixed delay:
+
+    python3 scripts/load_test_chat.py mock-llm --port 9100 --latency 5
+
+2. Start the server under test pointed at the mock:
+
+    ANTHROPIC_BASE_URL=http://127.0.0.1:9100 ANTHROPIC_API_KEY=test \\
+        gunicorn -w 1 --threads 8 -b 127.0.0.1:8000 app:app
+    ANTHROPIC_BASE_URL=http://127.0.0.1:9100 ANTHROPIC_API_KEY=test \\
+        uvicorn asgi:application --port 8000 --workers 1
+
+3. Run the load (the account must already exist):
+
+    python3 scripts/load_test_chat.py run --url http://127.0.0.1:8000 \\
+        --email load@test.dev --password secret123 \\
+        --concurrency 10,50,200 --requests 400 --pid <server pid>
+
+Each concurrency level reports throughput, latency percentiles, errors and the
+server's peak RSS (summed over the pid and its children).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+
+def serve_mock_llm(port: int, latency: float) -> None:
+    """Serve a minimal Anthropic Messages API that replies after `latency` seconds."""
+
+    class MockMessagesHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("content-length", 0))
+            request_body = json.loads(self.rfile.read(length) or b"{}")
+            time.sleep(latency)
+            body = json.dumps({
+                "id": "msg_mock",
+                "type": "message",
+                "role": "assistant",
+                "model": request_body.get("model", "mock"),
+                "content": [{"type": "text", "text": "Mock reply."}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 10, "output_tokens": 3},
+            }).encode()
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            return
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockMessagesHandler)
+    server.daemon_threads = True
+    print(f"Mock Anthropic API on http://127.0.0.1:{port} (latency {latency}s)")
+    server.serve_forever()
+
+
+def process_tree_rss_kb(pid: int) -> int:
+    """Resident memory of a process and its children in KB (Linux /proc)."""
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+async def sample_rss(pid: int, stop: asyncio.Event, samples: list) -> None:
+    while not stop.is_set():
+        samples.append(process_tree_rss_kb(pid))
+        await asyncio.sleep(0.2)
+
+
+async def run_level(base_url: str, cookies, concurrency: int, total: int, pid: int = None) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    rss_samples = []
+    stop = asyncio.Event()
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, cookies=cookies, timeout=300, limits=limits) as client:
+
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/chat", data={"message": f"load test {i}"})
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        sampler = asyncio.create_task(sample_rss(pid, stop, rss_samples)) if pid else None
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        if sampler:
+            await sampler
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_s": round(pct(0.50), 3),
+        "p95_s": round(pct(0.95), 3),
+        "max_s": round(latencies[-1], 3),
+        "peak_rss_mb": round(max(rss_samples) / 1024, 1) if rss_samples else None,
+    }
+
+
+async def run_load(args) -> None:
+    async with httpx.AsyncClient(base_url=args.url, follow_redirects=False) as client:
+        response = await client.post("/login", data={"email": args.email, "password": args.password})
+        if response.status_code != 302 or "session" not in client.cookies:
+            raise SystemExit(f"Login failed (status {response.status_code})")
+        cookies = client.cookies
+
+    for level in [int(c) for c in args.concurrency.split(",")]:
+        result = await run_level(args.url, cookies, level, max(args.requests, level), args.pid)
+        print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat endpoint load test")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    mock = sub.add_parser("mock-llm", help="Serve a slow mock Anthropic API")
+    mock.add_argument("--port", type=int, default=9100)
+    mock.add_argument("--latency", type=float, default=5.0, help="Seconds per LLM call")
+
+    run = sub.add_parser("run", help="Run load against a server")
+    run.add_argument("--url", default=os.environ.get("FLASK_URL", "http://localhost:8000"))
+    run.add_argument("--email", required=True)
+    run.add_argument("--password", required=True)
+    run.add_argument("--concurrency", default="10,50,100", help="Comma-separated concurrency levels")
+    run.add_argument("--requests", type=int, default=200, help="Requests per level")
+    run.add_argument("--pid", type=int, help="Server pid to sample RSS from")
+
+    args = parser.parse_args()
+    if args.command == "mock-llm":
+        serve_mock_llm(args.port, args.latency)
+    else:
+        asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+File Storage Backends for Ask-Chopper
+
+Attachments, documents, thumbnails and content-addressed objects are
+written through a StorageBackend, picked by STORAGE_BACKEND:
+
+    blob  - Vercel Blob (blob_storage.BlobStorage); the default when
+            BLOB_READ_WRITE_TOKEN is set
+    local - LocalStorage under UPLOAD_FOLDER; the default otherwise, and
+            meant for self-hosted deployments as well as development
+
+Locations are what the backend returns and the rows keep in file_path: a
+Blob URL, or an absolute local path. backend_for() finds the backend of a
+stored location, so rows written under one backend can still be deleted
+after switching to the other.
+
+LocalStorage:
+    - A name like attachments/report_20261019_120000_1a2b3c4d.pdf is stored
+      under two levels of hash-sharded directories
+      (attachments/<2 hex>/<2 hex>/report_...pdf), so no directory grows
+      past a few files per 65,536 shards. Names that already have their
+      own subdirectories (objects/ab/<sha256>.pdf) are stored as they are.
+    - Files are written to a temporary file beside the target, fsynced and
+      renamed over it, and the directory is fsynced, so a crash leaves
+      either the whole file or none of it.
+    - With LOCAL_STORAGE_HARDLINKS on, every stored file is also linked
+      into .links/<2 hex>/<sha256>. A later file with the same content is
+      stored as another hard link to it instead of a copy. Stored files
+      are never written in place (only replaced by rename), so linked
+      names can't change each other. prune_links() drops index entries
+      whose files have all been deleted.
+"""
+
+import hashlib
+import os
+import threading
+from io import BytesIO
+from typing import BinaryIO, List, NamedTuple, Optional, Sequence
+
+from blob_upload import COPY_CHUNK_SIZE
+
+BACKENDS = ("local", "blob")
+LOCAL_STORAGE_FSYNC = os.environ.get("LOCAL_STORAGE_FSYNC", "true").lower() == "true"
+LOCAL_STORAGE_HARDLINKS = os.environ.get("LOCAL_STORAGE_HARDLINKS", "true").lower() == "true"
+LINKS_DIR = ".links"
+
+
+class StorageError(Exception):
+    """A file could not be stored as requested."""
+
+
+class StoredFile(NamedTuple):
+    """A file written by StorageBackend.save_stream()."""
+    location: str  # Blob URL or absolute local path
+    size: int
+    sha256: str
+
+
+def is_remote(location: str) -> bool:
+    """True for Blob URLs, False for local paths."""
+    return location.startswith(("http://", "https://"))
+
+
+class StorageBackend:
+    """Where uploaded files are stored."""
+
+    name = ""
+
+    def save_stream(self, stream: BinaryIO, name: str, content_type: str = "application/octet-stream",
+                    sha256: Optional[str] = None, shard: Optional[str] = None) -> StoredFile:
+        """
+        Store a stream, read from its current position to the end, under `name`.
+
+        Args:
+            stream: Binary stream
+            name: Storage name (category/filename)
+            content_type: MIME type of the data
+            sha256: Expected digest; raises StorageError (keeping what was
+                stored under `name` before) if the data doesn't match
+            shard: Key for local shard directories instead of the file name,
+                so related files (a thumbnail's sizes) share a directory
+
+        Returns:
+            StoredFile(location, size, sha256)
+        """
+        raise NotImplementedError
+
+    def save_bytes(self, data: bytes, name: str, content_type: str = "application/octet-stream",
+                   shard: Optional[str] = None) -> str:
+        """Store bytes under `name`. Returns the location."""
+        raise NotImplementedError
+
+    def delete(self, location: str) -> bool:
+        """Delete a stored file. Returns False if it could not be deleted (a missing file counts as deleted)."""
+        raise NotImplementedError
+
+    def delete_many(self, locations: Sequence[str]) -> List[str]:
+        """Delete stored files. Returns the locations that could not be deleted."""
+        raise NotImplementedError
+
+    def local_path(self, location: str) -> Optional[str]:
+        """A path on this machine holding the file without downloading it, or None."""
+        raise NotImplementedError
+
+    def exists(self, location: str) -> bool:
+        """Whether a stored file is (still) there."""
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files on local disk under the app's UPLOAD_FOLDER (see module docstring).
+
+    Args:
+        app: Flask app whose UPLOAD_FOLDER is the root (read on every call)
+        fsync: fsync files and directories before a write returns
+        hardlinks: Store files with already stored content as hard links
+    """
+
+    name = "local"
+
+    def __init__(self, app, fsync: bool = LOCAL_STORAGE_FSYNC, hardlinks: bool = LOCAL_STORAGE_HARDLINKS):
+        self.app = app
+        self.fsync = fsync
+        self.hardlinks = hardlinks
+
+    @property
+    def root(self) -> str:
+        return self.app.config["UPLOAD_FOLDER"]
+
+    def path_for(self, name: str, shard: Optional[str] = None) -> str:
+        """Absolute path for a storage name (see module docstring for the sharding)."""
+        parts = name.strip("/").split("/")
+        if len(parts) == 2:
+            key = hashlib.sha1((shard or parts[1]).encode("utf-8")).hexdigest()
+            parts = [parts[0], key[:2], key[2:4], parts[1]]
+        return os.path.join(self.root, *parts)
+
+    def _link_path(self, sha256: str) -> str:
+        return os.path.join(self.root, LINKS_DIR, sha256[:2], sha256)
+
+    def _sync_dir(self, directory: str) -> None:
+        if not self.fsync or not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_temp(self, stream: BinaryIO, tmp_path: str) -> tuple:
+        digest = hashlib.sha256()
+        size = 0
+        with open(tmp_path, "wb") as f:
+            while True:
+                chunk = stream.read(COPY_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                size += len(chunk)
+                f.write(chunk)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        return size, digest.hexdigest()
+
+    def _link_existing(self, sha256: str, path: str) -> bool:
+        """Store `path` as a hard link to an already stored file with this content."""
+        try:
+            os.link(self._link_path(sha256), path)
+            return True
+        except FileExistsError:
+            # The name is being stored again; replace it like any other write
+            return False
+        except OSError:
+            # No such content yet, or links unsupported here (another filesystem)
+            return False
+
+    def _index(self, sha256: str, path: str) -> None:
+        link_path = self._link_path(sha256)
+        try:
+            os.makedirs(os.path.dirname(link_path), exist_ok=True)
+            os.link(path, link_path)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            print(f"WARNING: Could not index {path} for hard links: {e}")
+
+    def save_stream(self, stream: BinaryIO, name: str, content_type: str = "application/octet-stream",
+                    sha256: Optional[str] = None, shard: Optional[str] = None) -> StoredFile:
+        path = self.path_for(name, shard)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            size, digest = self._write_temp(stream, tmp_path)
+            if sha256 and digest != sha256:
+                raise StorageError(f"Content of {name} changed while it was stored")
+            if self.hardlinks and self._link_existing(digest, path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+                if self.hardlinks:
+                    self._index(digest, path)
+            self._sync_dir(directory)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return StoredFile(path, size, digest)
+
+    def save_bytes(self, data: bytes, name: str, content_type: str = "application/octet-stream",
+                   shard: Optional[str] = None) -> str:
+        return self.save_stream(BytesIO(data), name, content_type, shard=shard).location
+
+    def delete(self, location: str) -> bool:
+        try:
+            os.remove(location)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error deleting local file {location}: {e}")
+            return False
+        return True
+
+    def delete_many(self, locations: Sequence[str]) -> List[str]:
+        return [location for location in dict.fromkeys(locations) if not self.delete(location)]
+
+    def local_path(self, location: str) -> Optional[str]:
+        return location
+
+    def exists(self, location: str) -> bool:
+        return os.path.exists(location)
+
+    def prune_links(self) -> int:
+        """Remove hard-link index entries no stored file shares any more. Returns how many."""
+        pruned = 0
+        links_root = os.path.join(self.root, LINKS_DIR)
+        try:
+            prefixes = os.listdir(links_root)
+        except OSError:
+            return 0
+        for prefix in prefixes:
+            directory = os.path.join(links_root, prefix)
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_nlink <= 1:
+                        os.remove(path)
+                        pruned += 1
+                except OSError:
+                    continue
+        return pruned
+
+
+def init_app(app) -> StorageBackend:
+    """
+    Create the app's storage backends and pick the configured one.
+
+    Returns:
+        The backend new files are written to
+    """
+    import blob_storage
+
+    default = "blob" if blob_storage.is_blob_configured() else "local"
+    mode = (os.environ.get("STORAGE_BACKEND") or default).strip().lower()
+    if mode not in BACKENDS:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND '{mode}'. Use {', '.join(BACKENDS)}.")
+    if mode == "blob" and not blob_storage.is_blob_configured():
+        raise RuntimeError("STORAGE_BACKEND=blob needs BLOB_READ_WRITE_TOKEN.")
+
+    local = LocalStorage(app)
+    backend = blob_storage.blob_backend if mode == "blob" else local
+    app.extensions["storage"] = {"default": backend, "local": local}
+    return backend
+
+
+def get_storage() -> StorageBackend:
+    """The current app's backend for new files."""
+    from flask import current_app
+    return current_app.extensions["storage"]["default"]
+
+
+def local_storage() -> LocalStorage:
+    """The current app's LocalStorage (for local locations whatever the configured backend)."""
+    from flask import current_app
+    return current_app.extensions["storage"]["local"]
+
+
+def backend_for(location: str) -> StorageBackend:
+    """The backend a stored location belongs to."""
+    if is_remote(location):
+        import blob_storage
+        return blob_storage.blob_backend
+    return local_storage()
@@ -0,0 +1,241 @@
+"""
+Support Unread Counters for Ask-Chopper
+
+Keeps unread support message counts in the support_unread_counters table so
+the polling endpoints read one row by primary key instead of running
+COUNT(*) over support_chats.
+
+Counters:
+    user:<id>  - admin replies not yet read by that user
+    admin      - user messages not yet read by the admin
+
+Counters are adjusted inside the same transaction as the SupportChat
+insert/update/delete that changes them (ORM flush events). Bulk
+Query.update()/delete() calls bypass flush events, so code doing bulk writes
+on support_chats must call apply_counter_deltas() itself. Drift can be
+repaired with rebuild_unread_counters.py.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event, func, inspect, select, text
+from sqlalchemy.orm import Session
+
+from models import db, SupportChat, SupportUnreadCounter
+
+ADMIN_COUNTER_KEY = "admin"
+
+# session.info key: counter values changed by the current flush (read by support_events)
+CHANGED_COUNTERS_KEY = "support_counters_changed"
+
+# Marker row written by a rebuild; until it exists counters may be incomplete
+_BUILT_MARKER_KEY = "__built__"
+
+_built = False
+_build_lock = Lock()
+
+
+def user_counter_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def counter_key_for(sender_type: Optional[str], user_id: Optional[int]) -> Optional[str]:
+    """Which counter an unread message from `sender_type` counts toward."""
+    if sender_type == "admin" and user_id is not None:
+        return user_counter_key(user_id)
+    if sender_type == "user":
+        return ADMIN_COUNTER_KEY
+    return None
+
+
+def _upsert_sql(dialect_name: str):
+    if dialect_name not in ("postgresql", "sqlite"):
+        return None
+    return text(
+        "INSERT INTO support_unread_counters (counter_key, unread_count, version, updated_at) "
+        "VALUES (:key, :delta, 1, :now) "
+        "ON CONFLICT (counter_key) DO UPDATE SET "
+        "unread_count = support_unread_counters.unread_count + excluded.unread_count, "
+        "version = support_unread_counters.version + 1, "
+        "updated_at = excluded.updated_at"
+    )
+
+
+def apply_counter_deltas(connection, deltas: Dict[str, int]) -> Dict[str, int]:
+    """
+    Add deltas to counters on the given connection (inside the caller's transaction).
+
+    Args:
+        connection: SQLAlchemy connection in the transaction doing the writes
+        deltas: Map of counter key to change in unread count
+
+    Returns:
+        Map of changed counter key to its new unread count
+    """
+    now = datetime.utcnow()
+    upsert = _upsert_sql(connection.dialect.name)
+    table = SupportUnreadCounter.__table__
+
+    for key, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        if upsert is not None:
+            connection.execute(upsert, {"key": key, "delta": delta, "now": now})
+            continue
+        result = connection.execute(
+            table.update().where(table.c.counter_key == key).values(
+                unread_count=table.c.unread_count + delta,
+                version=table.c.version + 1,
+                updated_at=now
+            )
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(
+                counter_key=key, unread_count=delta, version=1, updated_at=now
+            ))
+
+    changed = [key for key, delta in deltas.items() if delta]
+    if not changed:
+        return {}
+    rows = connection.execute(
+        select(table.c.counter_key, table.c.unread_count).where(table.c.counter_key.in_(changed))
+    )
+    return {key: max(0, count) for key, count in rows}
+
+
+def _unread_contribution(sender_type, user_id, is_read) -> Tuple[Optional[str], int]:
+    # Matches the COUNT queries this replaces: only is_read = False counts
+    if is_read is False:
+        return counter_key_for(sender_type, user_id), 1
+    return None, 0
+
+
+def _previous_value(state, attr: str):
+    history = state.attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attr)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_support_chat_writes(session, flush_context):
+    deltas = defaultdict(int)
+
+    for obj in session.new:
+        if isinstance(obj, SupportChat):
+            key, n = _unread_contribution(obj.sender_type, obj.user_id, obj.is_read)
+            if key:
+                deltas[key] += n
+
+    for obj in session.dirty:
+        if not isinstance(obj, SupportChat):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[attr].history.has_changes() for attr in ("is_read", "sender_type", "user_id")):
+            continue
+        old_key, old_n = _unread_contribution(
+            _previous_value(state, "sender_type"),
+            _previous_value(state, "user_id"),
+            _previous_value(state, "is_read")
+        )
+        new_key, new_n = _unread_contribution(obj.sender_type, obj.user_id, obj.is_read)
+        if old_key:
+            deltas[old_key] -= old_n
+        if new_key:
+            deltas[new_key] += new_n
+
+    for obj in session.deleted:
+        if isinstance(obj, SupportChat):
+            state = inspect(obj)
+            key, n = _unread_contribution(
+                _previous_value(state, "sender_type"),
+                _previous_value(state, "user_id"),
+                _previous_value(state, "is_read")
+            )
+            if key:
+                deltas[key] -= n
+
+    if any(deltas.values()):
+        values = apply_counter_deltas(session.connection(), deltas)
+        session.info.setdefault(CHANGED_COUNTERS_KEY, {}).update(values)
+
+
+def rebuild_unread_counters() -> Dict[str, int]:
+    """
+    Recompute every counter from support_chats and commit.
+
+    Returns:
+        Map of counter key to unread count
+    """
+    global _built
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        # Writers block on their counter upsert until the rebuild commits, then
+        # apply their delta on top of the rebuilt value
+        connection.execute(text("LOCK TABLE support_unread_counters IN EXCLUSIVE MODE"))
+
+    rows = db.session.query(
+        SupportChat.sender_type, SupportChat.user_id, func.count(SupportChat.id)
+    ).filter(
+        SupportChat.is_read == db.false()
+    ).group_by(SupportChat.sender_type, SupportChat.user_id).all()
+
+    counts = defaultdict(int)
+    for sender_type, user_id, count in rows:
+        key = counter_key_for(sender_type, user_id)
+        if key:
+            counts[key] += count
+    counts.setdefault(ADMIN_COUNTER_KEY, 0)
+
+    # Keep versions increasing so cached ETags never match rebuilt values
+    max_version = db.session.query(func.max(SupportUnreadCounter.version)).scalar() or 0
+    now = datetime.utcnow()
+    SupportUnreadCounter.query.delete(synchronize_session=False)
+    db.session.bulk_insert_mappings(SupportUnreadCounter, [
+        {"counter_key": key, "unread_count": count, "version": max_version + 1, "updated_at": now}
+        for key, count in list(counts.items()) + [(_BUILT_MARKER_KEY, 0)]
+    ])
+    db.session.commit()
+    _built = True
+    return dict(counts)
+
+
+def _ensure_built() -> None:
+    """Build counters on first use if they have never been rebuilt."""
+    global _built
+    if _built:
+        return
+    with _build_lock:
+        if _built:
+            return
+        if db.session.get(SupportUnreadCounter, _BUILT_MARKER_KEY) is None:
+            print("Support unread counters missing - rebuilding from support_chats")
+            rebuild_unread_counters()
+        _built = True
+
+
+def get_unread_counter(key: str) -> Tuple[int, int]:
+    """
+    Read a counter by primary key.
+
+    Args:
+        key: Counter key (user_counter_key(id) or ADMIN_COUNTER_KEY)
+
+    Returns:
+        (unread_count, version); (0, 0) if the counter has never been touched
+    """
+    _ensure_built()
+    row = db.session.query(
+        SupportUnreadCounter.unread_count, SupportUnreadCounter.version
+    ).filter_by(counter_key=key).first()
+    if row is None:
+        return 0, 0
+    return max(0, row.unread_count), row.version
+
+
+def counter_etag(key: str, unread_count: int, version: int) -> str:
+    """ETag for a counter response; changes whenever the count does."""
+    return f"{key}-{unread_count}-{version}"
@@ -0,0 +1,493 @@
+"""
+Support Chat Events for Ask-Chopper
+
+Pushes new support messages and unread-count changes to connected clients
+over Server-Sent Events, replacing client polling.
+
+Writes are captured from SQLAlchemy flush events and fanned out by an
+in-process hub to every open stream. How events reach the other worker
+processes depends on SUPPORT_EVENTS_BACKEND:
+
+    postgres - NOTIFY inside the writing transaction (delivered on commit),
+               one LISTEN connection per process (default on PostgreSQL)
+    poll     - one background query per process every
+               SUPPORT_EVENTS_POLL_SECONDS while streams are open
+               (default on SQLite)
+    memory   - in-process only (single worker)
+
+Streams carry a since-id cursor (the SupportChat id, also sent as the SSE
+event id) so a reconnecting client replays only what it missed. Ids are
+assigned at insert but become visible at commit, so a lower id can arrive
+after a higher one: streams skip messages by the ids they recently sent,
+not by the highest, and the poller looks ID_LOOKBACK ids behind its cursor.
+"""
+
+import json
+import os
+import queue
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, SupportChat, SupportUnreadCounter
+from support_counters import (
+    ADMIN_COUNTER_KEY, CHANGED_COUNTERS_KEY, user_counter_key, get_unread_counter
+)
+
+NOTIFY_CHANNEL = "support_events"
+POLL_SECONDS = float(os.environ.get("SUPPORT_EVENTS_POLL_SECONDS", "1"))
+KEEPALIVE_SECONDS = 15
+# Streams end after this long; EventSource reconnects with Last-Event-ID
+STREAM_SECONDS = int(os.environ.get("SUPPORT_EVENTS_STREAM_SECONDS", "300"))
+REPLAY_LIMIT = 200
+# How far behind its cursor the poller looks for messages committed late
+ID_LOOKBACK = 100
+# Message ids a stream (or the poller) remembers having sent
+SEEN_IDS_LIMIT = 1000
+# Postgres NOTIFY payloads must stay under 8000 bytes
+MAX_NOTIFY_BYTES = 7000
+
+_MESSAGES_KEY = "support_events_messages"
+_OUTBOX_KEY = "support_events_outbox"
+
+
+def message_event(msg_id: int, user_id: int, sender_type: str, message: str,
+                  created_at: Optional[datetime], is_read: Optional[bool]) -> Dict[str, Any]:
+    return {
+        "type": "message",
+        "id": msg_id,
+        "user_id": user_id,
+        "sender_type": sender_type,
+        "message": message,
+        "is_read": is_read,
+        "created_at": created_at.isoformat() if created_at else None
+    }
+
+
+def unread_event(key: str, unread_count: int) -> Dict[str, Any]:
+    return {"type": "unread", "key": key, "unread_count": unread_count}
+
+
+class RecentIds:
+    """The most recently seen message ids, oldest forgotten first."""
+
+    def __init__(self, limit: int = SEEN_IDS_LIMIT):
+        self._ids = OrderedDict()
+        self._limit = limit
+
+    def add(self, msg_id: int) -> bool:
+        """Remember an id. Returns False if it was already seen."""
+        if msg_id in self._ids:
+            return False
+        self._ids[msg_id] = None
+        if len(self._ids) > self._limit:
+            self._ids.popitem(last=False)
+        return True
+
+
+class Subscription:
+    """One open event stream: which events it wants and how to hand them over."""
+
+    def __init__(self, deliver: Callable[[Dict[str, Any]], None], user_id: Optional[int] = None,
+                 admin: bool = False, conversation_user_id: Optional[int] = None):
+        self.deliver = deliver
+        self.user_id = user_id
+        self.admin = admin
+        self.conversation_user_id = conversation_user_id
+
+    def matches(self, evt: Dict[str, Any]) -> bool:
+        if evt["type"] == "unread":
+            if self.admin:
+                return evt["key"] == ADMIN_COUNTER_KEY
+            return evt["key"] == user_counter_key(self.user_id)
+        if self.admin:
+            return self.conversation_user_id is None or evt["user_id"] == self.conversation_user_id
+        return evt["user_id"] == self.user_id
+
+
+class SupportEventHub:
+    """Fans events out to the subscriptions open in this process."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = Lock()
+        self._transport_started = False
+        self._resume_after_id = None
+
+    def subscribe(self, subscription: Subscription, app=None) -> Subscription:
+        with self._lock:
+            self._subscriptions.add(subscription)
+            if not self._transport_started and app is not None:
+                self._transport_started = True
+                _start_transport(app, self)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions)
+
+    def note_seen_id(self, last_id: int) -> None:
+        """Record the newest id a just-opened stream already has (poll resume point)."""
+        with self._lock:
+            if self._resume_after_id is None or last_id < self._resume_after_id:
+                self._resume_after_id = last_id
+
+    def take_resume_id(self) -> Optional[int]:
+        with self._lock:
+            last_id, self._resume_after_id = self._resume_after_id, None
+        return last_id
+
+    def publish(self, events: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for evt in events:
+            for subscription in subscriptions:
+                if subscription.matches(evt):
+                    try:
+                        subscription.deliver(evt)
+                    except Exception as e:
+                        print(f"WARNING: support event delivery failed: {e}")
+
+
+hub = SupportEventHub()
+
+
+def get_backend_name() -> str:
+    default = "postgres" if db.engine.dialect.name == "postgresql" else "poll"
+    return (os.environ.get("SUPPORT_EVENTS_BACKEND", "").strip() or default).lower()
+
+
+# ---------------------------------------------------------------------------
+# Cross-worker transports
+# ---------------------------------------------------------------------------
+
+def _start_transport(app, target_hub: SupportEventHub) -> None:
+    with app.app_context():
+        backend = get_backend_name()
+        dsn = db.engine.url.render_as_string(hide_password=False)
+    if backend == "postgres":
+        target = _listen_postgres
+        args = (dsn, target_hub)
+    elif backend == "poll":
+        target = _poll_database
+        args = (app, target_hub)
+    else:
+        return
+    threading.Thread(target=target, args=args, name=f"support-events-{backend}", daemon=True).start()
+
+
+def _listen_postgres(dsn: str, target_hub: SupportEventHub) -> None:
+    """LISTEN for support events and publish them to this process' streams."""
+    import psycopg2
+
+    dsn = dsn.replace("postgresql+psycopg2://", "postgresql://", 1)
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while True:
+                if select.select([conn], [], [], KEEPALIVE_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                events = []
+                while conn.notifies:
+                    notification = conn.notifies.pop(0)
+                    try:
+                        events.append(json.loads(notification.payload))
+                    except ValueError:
+                        continue
+                if events:
+                    target_hub.publish(events)
+        except Exception as e:
+            print(f"WARNING: support events LISTEN connection failed: {e}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+def _ids_through(last_id: int) -> RecentIds:
+    """The ids the poller treats as published when its cursor is at last_id."""
+    published = RecentIds()
+    for (msg_id,) in db.session.query(SupportChat.id).filter(
+        SupportChat.id > last_id - ID_LOOKBACK, SupportChat.id <= last_id
+    ).order_by(SupportChat.id):
+        published.add(msg_id)
+    return published
+
+
+def _poll_database(app, target_hub: SupportEventHub) -> None:
+    """Query for new messages and counter changes while any stream is open."""
+    last_id = None
+    last_counter_change = None
+    counter_versions = {}
+    published = RecentIds()
+    while True:
+        time.sleep(POLL_SECONDS)
+        if not target_hub.has_subscribers():
+            last_id = None
+            continue
+        try:
+            with app.app_context():
+                # Go back to the oldest point a newly opened stream has seen
+                resume_id = target_hub.take_resume_id()
+                if last_id is None:
+                    last_id = resume_id
+                    if last_id is None:
+                        last_id = db.session.query(db.func.max(SupportChat.id)).scalar() or 0
+                    published = _ids_through(last_id)
+                    last_counter_change = datetime.utcnow()
+                    counter_versions = {}
+                    continue
+                if resume_id is not None and resume_id < last_id:
+                    # Publish what came after it again; streams that had it skip it
+                    last_id = resume_id
+                    published = _ids_through(last_id)
+
+                events = []
+                rows = db.session.query(
+                    SupportChat.id, SupportChat.user_id, SupportChat.sender_type,
+                    SupportChat.message, SupportChat.created_at, SupportChat.is_read
+                ).filter(SupportChat.id > last_id - ID_LOOKBACK).order_by(SupportChat.id).limit(REPLAY_LIMIT).all()
+                for row in rows:
+                    # Rows behind the cursor were either published already or committed late
+                    if not published.add(row.id):
+                        continue
+                    events.append(message_event(*row))
+                    last_id = max(last_id, row.id)
+
+                # Look back a little: updated_at is stamped before the writer commits
+                counters = db.session.query(
+                    SupportUnreadCounter.counter_key,
+                    SupportUnreadCounter.unread_count,
+                    SupportUnreadCounter.version,
+                    SupportUnreadCounter.updated_at
+                ).filter(SupportUnreadCounter.updated_at > last_counter_change - timedelta(seconds=5)).all()
+                for key, count, version, updated_at in counters:
+                    last_counter_change = max(last_counter_change, updated_at)
+                    if counter_versions.get(key) == version:
+                        continue
+                    counter_versions[key] = version
+                    events.append(unread_event(key, max(0, count)))
+            if events:
+                target_hub.publish(events)
+        except Exception as e:
+            print(f"WARNING: support events poll failed: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Capturing writes
+# ---------------------------------------------------------------------------
+
+@event.listens_for(Session, "after_flush")
+def _collect_support_messages(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, SupportChat):
+            session.info.setdefault(_MESSAGES_KEY, []).append(message_event(
+                obj.id, obj.user_id, obj.sender_type, obj.message, obj.created_at, obj.is_read
+            ))
+
+
+def _notify_payload(evt: Dict[str, Any]) -> str:
+    payload = json.dumps(evt)
+    if len(payload.encode()) <= MAX_NOTIFY_BYTES:
+        return payload
+    # Clients refetch the conversation for truncated messages
+    trimmed = dict(evt, message=evt["message"][:1000], truncated=True)
+    return json.dumps(trimmed)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _queue_support_events(session, flush_context):
+    events = session.info.pop(_MESSAGES_KEY, [])
+    events += [unread_event(key, count) for key, count in session.info.pop(CHANGED_COUNTERS_KEY, {}).items()]
+    if events:
+        _queue_events(session, events)
+
+
+def queue_unread_events(session, counter_values: Dict[str, int]) -> None:
+    """
+    Queue unread events for counters changed outside a flush (bulk updates).
+
+    Args:
+        session: Session whose transaction changed the counters; events go out on commit
+        counter_values: Map of counter key to new unread count (from apply_counter_deltas)
+    """
+    if counter_values:
+        _queue_events(session, [unread_event(key, count) for key, count in counter_values.items()])
+
+
+def _queue_events(session, events: List[Dict[str, Any]]) -> None:
+    if get_backend_name() == "postgres":
+        # Delivered to every listener (this process included) only if the transaction commits
+        connection = session.connection()
+        for evt in events:
+            connection.execute(
+                db.text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": NOTIFY_CHANNEL, "payload": _notify_payload(evt)}
+            )
+        return
+    session.info.setdefault(_OUTBOX_KEY, []).extend(events)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_support_events(session):
+    events = session.info.pop(_OUTBOX_KEY, [])
+    if events:
+        hub.publish(events)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_support_events(session):
+    session.info.pop(_MESSAGES_KEY, None)
+    session.info.pop(_OUTBOX_KEY, None)
+
+
+# ---------------------------------------------------------------------------
+# Streams
+# ---------------------------------------------------------------------------
+
+def format_sse(evt: Dict[str, Any]) -> str:
+    lines = []
+    if evt["type"] == "message":
+        lines.append(f"id: {evt['id']}")
+    lines.append(f"event: {evt['type']}")
+    lines.append(f"data: {json.dumps(evt)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class SupportEventStream:
+    """
+    One client's event stream.
+
+    Opened inside a request (replays missed messages and the current unread
+    count), then consumed without touching the database, either by
+    iterating it (WSGI) or by an async server passing render() the events
+    its deliver callback received.
+    """
+
+    def __init__(self, subscription: Subscription, since_id: int, initial: List[Dict[str, Any]],
+                 events: Optional["queue.Queue"] = None):
+        self.subscription = subscription
+        self.last_id = since_id
+        self.sent_ids = RecentIds()
+        self.last_unread = None
+        self.initial = initial
+        self.events = events
+        self.deadline = time.monotonic() + STREAM_SECONDS
+
+    def render(self, evt: Dict[str, Any]) -> Optional[str]:
+        """SSE text for an event, or None if the client already has it."""
+        if evt["type"] == "message":
+            # Not `id <= last_id`: a message can commit after a higher id was sent
+            if not self.sent_ids.add(evt["id"]):
+                return None
+            self.last_id = max(self.last_id, evt["id"])
+        else:
+            # The poll transport re-reports counters this process already published
+            if evt["unread_count"] == self.last_unread:
+                return None
+            self.last_unread = evt["unread_count"]
+        return format_sse(evt)
+
+    def opening_chunks(self) -> List[str]:
+        chunks = ["retry: 3000\n\n"]
+        for evt in self.initial:
+            chunk = self.render(evt)
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def close(self) -> None:
+        hub.unsubscribe(self.subscription)
+
+    def __iter__(self):
+        try:
+            for chunk in self.opening_chunks():
+                yield chunk
+            while not self.expired():
+                try:
+                    evt = self.events.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                chunk = self.render(evt)
+                if chunk:
+                    yield chunk
+        finally:
+            self.close()
+
+
+def open_support_event_stream(app, since_id: int = 0, user_id: Optional[int] = None, admin: bool = False,
+                              conversation_user_id: Optional[int] = None,
+                              deliver: Optional[Callable[[Dict[str, Any]], None]] = None) -> SupportEventStream:
+    """
+    Subscribe to support events and load what the client missed.
+
+    Must run inside a request. Releases the request's database connection
+    before returning so the open stream doesn't hold one.
+
+    Args:
+        app: Flask app (used by the cross-worker transport thread)
+        since_id: Last SupportChat id the client has
+        user_id: Stream a user's own conversation
+        admin: Stream for the admin (all conversations, or one if conversation_user_id)
+        conversation_user_id: Limit an admin stream to one user's conversation
+        deliver: Thread-safe callback for events (async servers); defaults to a queue
+    """
+    events = None
+    if deliver is None:
+        events = queue.Queue()
+        deliver = events.put
+
+    # Subscribe before reading so nothing committed in between is lost
+    subscription = hub.subscribe(
+        Subscription(deliver, user_id=user_id, admin=admin, conversation_user_id=conversation_user_id),
+        app=app
+    )
+    try:
+        initial = []
+        if since_id:
+            query = db.session.query(
+                SupportChat.id, SupportChat.user_id, SupportChat.sender_type,
+                SupportChat.message, SupportChat.created_at, SupportChat.is_read
+            ).filter(SupportChat.id > since_id)
+            if not admin:
+                query = query.filter(SupportChat.user_id == user_id)
+            elif conversation_user_id is not None:
+                query = query.filter(SupportChat.user_id == conversation_user_id)
+            initial = [message_event(*row) for row in query.order_by(SupportChat.id).limit(REPLAY_LIMIT)]
+
+        if get_backend_name() == "poll":
+            seen_id = initial[-1]["id"] if initial else since_id
+            if not since_id:
+                seen_id = db.session.query(db.func.max(SupportChat.id)).scalar() or 0
+            hub.note_seen_id(seen_id)
+
+        key = ADMIN_COUNTER_KEY if admin else user_counter_key(user_id)
+        initial.append(unread_event(key, get_unread_counter(key)[0]))
+        db.session.close()
+    except Exception:
+        hub.unsubscribe(subscription)
+        raise
+
+    return SupportEventStream(subscription, since_id, initial, events)
@@ -0,0 +1,172 @@
+"""
+Support Inbox for Ask-Chopper
+
+Builds the admin support inbox (one row per user with support messages:
+unread count, latest message, totals) in a single query using window
+functions, ordered by unread count, then latest message time, then user id.
+
+Pages are keyset-paginated: each page returns an opaque cursor for the
+last row, and the next page continues strictly after it.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, case, func, or_, select
+
+from models import db, User, SupportChat
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InboxMessage:
+    """Latest-message preview for an inbox row (what the dashboard template reads)."""
+
+    def __init__(self, id: int, sender_type: str, message: str, created_at: Optional[datetime]):
+        self.id = id
+        self.sender_type = sender_type
+        self.message = message
+        self.created_at = created_at
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'sender_type': self.sender_type,
+            'message': self.message,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+def encode_cursor(unread_count: int, last_message_at: Optional[datetime], user_id: int) -> str:
+    payload = [unread_count, last_message_at.isoformat() if last_message_at else None, user_id]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, Optional[datetime], int]:
+    """Decode a cursor from encode_cursor(). Raises ValueError if malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        unread_count, last_message_at, user_id = json.loads(base64.urlsafe_b64decode(padded))
+        return (
+            int(unread_count),
+            datetime.fromisoformat(last_message_at) if last_message_at else None,
+            int(user_id)
+        )
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _inbox_query():
+    """Per-user inbox rows with totals across all conversations."""
+    unread_flag = case(
+        (and_(SupportChat.sender_type == 'user', SupportChat.is_read == db.false()), 1),
+        else_=0
+    )
+
+    # One row per message, ranked newest-first within each user
+    ranked = select(
+        SupportChat.id,
+        SupportChat.user_id,
+        SupportChat.created_at,
+        func.row_number().over(
+            partition_by=SupportChat.user_id,
+            order_by=(SupportChat.created_at.desc(), SupportChat.id.desc())
+        ).label('rn'),
+        func.sum(unread_flag).over(partition_by=SupportChat.user_id).label('unread_count')
+    ).subquery('ranked')
+
+    # One row per user: their newest message
+    latest = select(
+        ranked.c.user_id,
+        ranked.c.id.label('last_message_id'),
+        ranked.c.created_at.label('last_message_at'),
+        ranked.c.unread_count
+    ).where(ranked.c.rn == 1).subquery('latest')
+
+    # Totals over every conversation, computed before the page filter
+    return select(
+        latest,
+        func.count().over().label('conversation_count'),
+        func.sum(latest.c.unread_count).over().label('total_unread')
+    ).subquery('inbox')
+
+
+def get_admin_inbox(limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get one page of the admin support inbox.
+
+    Args:
+        limit: Page size (capped at MAX_PAGE_SIZE)
+        cursor: Cursor returned as next_cursor by the previous page
+
+    Returns:
+        Dict with 'rows' (each {'user', 'unread_count', 'last_message'}),
+        'next_cursor', 'conversation_count' and 'total_unread'. The totals
+        are None on a page past the end.
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    inbox = _inbox_query()
+
+    query = select(
+        User,
+        inbox.c.unread_count,
+        inbox.c.last_message_at,
+        inbox.c.conversation_count,
+        inbox.c.total_unread,
+        SupportChat.id,
+        SupportChat.sender_type,
+        SupportChat.message
+    ).join(
+        inbox, User.id == inbox.c.user_id
+    ).join(
+        SupportChat, SupportChat.id == inbox.c.last_message_id
+    )
+
+    if cursor:
+        after_unread, after_time, after_user_id = decode_cursor(cursor)
+        query = query.where(or_(
+            inbox.c.unread_count < after_unread,
+            and_(inbox.c.unread_count == after_unread, inbox.c.last_message_at < after_time),
+            and_(
+                inbox.c.unread_count == after_unread,
+                inbox.c.last_message_at == after_time,
+                inbox.c.user_id < after_user_id
+            )
+        ))
+
+    query = query.order_by(
+        inbox.c.unread_count.desc(),
+        inbox.c.last_message_at.desc(),
+        inbox.c.user_id.desc()
+    ).limit(limit + 1)
+
+    results = db.session.execute(query).all()
+    has_more = len(results) > limit
+    results = results[:limit]
+
+    rows: List[Dict[str, Any]] = []
+    for user, unread_count, last_message_at, _, _, message_id, sender_type, message in results:
+        rows.append({
+            'user': user,
+            'unread_count': int(unread_count or 0),
+            'last_message': InboxMessage(message_id, sender_type, message, last_message_at)
+        })
+
+    next_cursor = None
+    if has_more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(last['unread_count'], last['last_message'].created_at, last['user'].id)
+
+    first = results[0] if results else None
+    return {
+        'rows': rows,
+        'next_cursor': next_cursor,
+        'conversation_count': int(first.conversation_count) if first else None,
+        'total_unread': int(first.total_unread or 0) if first else None
+    }
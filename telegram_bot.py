@@ -7,6 +7,7 @@ from dotenv import load_dotenv
 from telegram import BotCommand, Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
 from bridge_log import log_bridge_event
+from model_router import MODEL_MODES, route_model, create_with_fallback
 
 load_dotenv()
 
@@ -40,6 +41,12 @@ def resolve_model_name(mode: str) -> str:
     return OPUS_MODEL if mode == "opus" else HAIKU_MODEL
 
 
+def describe_mode(mode: str) -> str:
+    if mode == "auto":
+        return f"auto (routes between {HAIKU_MODEL} and {OPUS_MODEL})"
+    return f"{mode} ({resolve_model_name(mode)})"
+
+
 def get_anthropic_client() -> Anthropic:
     api_key = os.environ.get("ANTHROPIC_API_KEY")
     if not api_key:
@@ -66,7 +73,7 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_allowed(update):
         return
     await update.message.reply_text(
-        f"[{BOT_NAME}]: Ready. Use /haiku or /opus to switch models, /model to check current mode, and then send any message."
+        f"[{BOT_NAME}]: Ready. Use /haiku, /opus or /auto to switch models, /model to check current mode, and then send any message."
     )
 
 
@@ -77,9 +84,11 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Commands:\n"
         "/haiku - Switch to Haiku model\n"
         "/opus - Switch to Opus model\n"
+        "/auto - Pick Haiku or Opus per message\n"
         "/model - Show current model mode\n"
         "/model haiku - Set Haiku model\n"
         "/model opus - Set Opus model\n"
+        "/model auto - Set automatic routing\n"
         "/commands - Show command list\n"
         "/start - Initialize bot"
     )
@@ -106,7 +115,7 @@ async def set_mode(update: Update, mode: str):
         model=model_name,
         detail=f"mode={mode}"
     )
-    await update.message.reply_text(f"[{BOT_NAME}]: Model set to {mode} ({model_name}).")
+    await update.message.reply_text(f"[{BOT_NAME}]: Model set to {describe_mode(mode)}.")
 
 
 async def haiku_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -121,21 +130,26 @@ async def opus_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await set_mode(update, "opus")
 
 
+async def auto_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await ensure_allowed(update):
+        return
+    await set_mode(update, "auto")
+
+
 async def model_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_allowed(update):
         return
     if context.args:
         arg = context.args[0].strip().lower()
-        if arg in {"haiku", "opus"}:
+        if arg in MODEL_MODES:
             await set_mode(update, arg)
             return
-        await update.message.reply_text(f"[{BOT_NAME}]: Unknown model '{arg}'. Use haiku or opus.")
+        await update.message.reply_text(f"[{BOT_NAME}]: Unknown model '{arg}'. Use haiku, opus or auto.")
         return
 
     prefs = load_model_prefs()
     mode = get_chat_mode(update.effective_chat.id, prefs)
-    model_name = resolve_model_name(mode)
-    await update.message.reply_text(f"[{BOT_NAME}]: Current model is {mode} ({model_name}).")
+    await update.message.reply_text(f"[{BOT_NAME}]: Current model is {describe_mode(mode)}.")
 
 
 def build_system_prompt() -> str:
@@ -153,7 +167,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     prefs = load_model_prefs()
     mode = get_chat_mode(update.effective_chat.id, prefs)
-    model_name = resolve_model_name(mode)
+    route = route_model(mode, HAIKU_MODEL, OPUS_MODEL, prompt_chars=len(update.message.text))
+    model_name = route.model
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id if update.effective_user else None
 
@@ -165,17 +180,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         chat_id=chat_id,
         model=model_name,
         message=update.message.text,
-        extra={"mode": mode}
+        extra={"mode": mode, "route": route.as_dict()}
     )
 
     client = get_anthropic_client()
+    hedged = False
     try:
-        response = client.messages.create(
-            model=model_name,
-            max_tokens=1200,
-            temperature=0.7,
-            system=build_system_prompt(),
-            messages=[{"role": "user", "content": update.message.text}],
+        response, _, hedged = create_with_fallback(
+            client,
+            {
+                "model": model_name,
+                "max_tokens": 1200,
+                "temperature": 0.7,
+                "system": build_system_prompt(),
+                "messages": [{"role": "user", "content": update.message.text}],
+            },
+            route,
+            source="telegram"
         )
     except Exception as exc:
         # If selected model is unavailable, fall back to Haiku automatically.
@@ -246,6 +267,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             extra={
                 "input_tokens": getattr(getattr(response, "usage", None), "input_tokens", None),
                 "output_tokens": getattr(getattr(response, "usage", None), "output_tokens", None),
+                "hedged": hedged,
             }
         )
         await update.message.reply_text(response_text)
@@ -269,6 +291,7 @@ async def set_telegram_commands(app):
             BotCommand("start", "Initialize the bot"),
             BotCommand("haiku", "Use Haiku model"),
             BotCommand("opus", "Use Opus model"),
+            BotCommand("auto", "Pick model per message"),
             BotCommand("model", "Show or set model"),
             BotCommand("commands", "Show command list"),
             BotCommand("help", "Show help"),
@@ -287,6 +310,7 @@ def main():
     app.add_handler(CommandHandler("commands", commands_cmd))
     app.add_handler(CommandHandler("haiku", haiku_cmd))
     app.add_handler(CommandHandler("opus", opus_cmd))
+    app.add_handler(CommandHandler("auto", auto_cmd))
     app.add_handler(CommandHandler("model", model_cmd))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
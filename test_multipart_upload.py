@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Test the multipart uploader against a local Blob stand-in.
+Verifies part retries, resuming from saved part state, and restarting
+once when the saved multipart upload is gone. No Blob token needed.
+"""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from blob_upload import BlobUploadError, LocalBlobTransport
+from multipart_upload import MultipartUploader, UploadStateStore
+
+PART_SIZE = 1024
+DATA = os.urandom(PART_SIZE * 4 + 100)  # 5 parts, the last one short
+PATH = "attachments/test-multipart.bin"
+
+
+class FailingTransport(LocalBlobTransport):
+    """LocalBlobTransport whose part uploads fail on request."""
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.failures = {}  # part number -> (times to fail, retryable)
+
+    def upload_part(self, path, upload_id, key, part_number, data, content_type):
+        times, retryable = self.failures.get(part_number, (0, True))
+        if times:
+            self.failures[part_number] = (times - 1, retryable)
+            with self._lock:
+                self.calls["upload"] += 1
+            raise BlobUploadError(f"Injected failure of part {part_number}", retryable=retryable)
+        return super().upload_part(path, upload_id, key, part_number, data, content_type)
+
+
+def make_uploader(root):
+    transport = FailingTransport(os.path.join(root, "blobs"))
+    state_store = UploadStateStore(os.path.join(root, "state"))
+    # One part at a time, so which parts finished before a failure is deterministic
+    uploader = MultipartUploader(transport, part_size=PART_SIZE, concurrency=1,
+                                 attempts=3, backoff=0, state_store=state_store)
+    return uploader, transport, state_store
+
+
+def stored_bytes(transport):
+    with open(os.path.join(transport.root, PATH), "rb") as f:
+        return f.read()
+
+
+def test_part_retry():
+    """A part that fails once is retried and the upload completes"""
+    root = tempfile.mkdtemp(prefix="chopper_mpu_test_")
+    try:
+        uploader, transport, _ = make_uploader(root)
+        transport.failures[2] = (1, True)
+
+        _, size, digest = uploader.upload(io.BytesIO(DATA), PATH, "application/octet-stream")
+
+        assert stored_bytes(transport) == DATA
+        assert (size, digest) == (len(DATA), hashlib.sha256(DATA).hexdigest())
+        assert transport.calls == {"put": 0, "create": 1, "upload": 6, "complete": 1}
+    finally:
+        shutil.rmtree(root)
+
+
+def test_resume_skips_uploaded_parts():
+    """An upload that fails part-way resumes with only the parts still missing"""
+    root = tempfile.mkdtemp(prefix="chopper_mpu_test_")
+    try:
+        uploader, transport, state_store = make_uploader(root)
+        transport.failures[3] = (3, True)  # every attempt fails
+
+        try:
+            uploader.upload(io.BytesIO(DATA), PATH, "application/octet-stream")
+            raise AssertionError("upload should have failed")
+        except BlobUploadError:
+            pass
+        state = state_store.load(uploader._state_key(PATH, "application/octet-stream"))
+        assert sorted(state["parts"]) == ["1", "2"]
+        assert transport.calls == {"put": 0, "create": 1, "upload": 5, "complete": 0}
+
+        uploader.upload(io.BytesIO(DATA), PATH, "application/octet-stream")
+
+        assert stored_bytes(transport) == DATA
+        # Parts 1 and 2 are skipped: no new multipart upload, three more part calls
+        assert transport.calls == {"put": 0, "create": 1, "upload": 8, "complete": 1}
+        assert state_store.load(state["key"]) is None
+    finally:
+        shutil.rmtree(root)
+
+
+def test_restart_when_saved_upload_is_gone():
+    """Resuming an upload Blob no longer knows restarts it once from the beginning"""
+    root = tempfile.mkdtemp(prefix="chopper_mpu_test_")
+    try:
+        uploader, transport, state_store = make_uploader(root)
+        transport.failures[3] = (1, False)  # not retryable: fails the upload at once
+
+        try:
+            uploader.upload(io.BytesIO(DATA), PATH, "application/octet-stream")
+            raise AssertionError("upload should have failed")
+        except BlobUploadError:
+            pass
+        assert transport.calls == {"put": 0, "create": 1, "upload": 3, "complete": 0}
+        # Blob discarded the unfinished upload
+        shutil.rmtree(os.path.join(transport.root, ".multipart"))
+
+        uploader.upload(io.BytesIO(DATA), PATH, "application/octet-stream")
+
+        assert stored_bytes(transport) == DATA
+        # The resumed upload fails on part 3, then starts over with all 5 parts
+        assert transport.calls == {"put": 0, "create": 2, "upload": 9, "complete": 1}
+        assert state_store.load(uploader._state_key(PATH, "application/octet-stream")) is None
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    import sys
+    for test in (test_part_retry, test_resume_skips_uploaded_parts, test_restart_when_saved_upload_is_gone):
+        test()
+        print(f"✅ {test.__doc__}")
+    sys.exit(0)
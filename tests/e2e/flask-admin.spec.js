@@ -10,4 +10,14 @@ test.describe('Admin Panel', () => {
     const response = await apiContext.get('/api/admin/unread-count');
     expect([200, 302, 401, 403]).toContain(response.status());
   });
+
+  test('GET /api/admin/blob-cache should be admin only', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/admin/blob-cache', { maxRedirects: 0 });
+    expect([302, 401, 403]).toContain(response.status());
+  });
+
+  test('GET /api/admin/events should be admin only', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/admin/events', { maxRedirects: 0 });
+    expect([302, 401, 403]).toContain(response.status());
+  });
 });
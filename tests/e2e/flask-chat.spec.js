@@ -23,4 +23,19 @@ test.describe('Chat Interface', () => {
       expect(Array.isArray(data) || typeof data === 'object').toBeTruthy();
     }
   });
+
+  test('GET /api/chat/history should return a page of messages', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/chat/history?limit=1');
+    expect(response.status()).toBe(200);
+    const data = await response.json();
+    expect(Array.isArray(data.messages)).toBeTruthy();
+    expect(data.messages.length).toBeLessThanOrEqual(1);
+    expect(typeof data.has_more).toBe('boolean');
+    expect(data).toHaveProperty('next_before_id');
+  });
+
+  test('GET /api/chat/history should reject a non-numeric before_id', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/chat/history?before_id=abc');
+    expect(response.status()).toBe(400);
+  });
 });
@@ -17,4 +17,21 @@ test.describe('Document API', () => {
     const response = await authenticatedPage.request.delete('/api/documents/clear');
     expect([200, 204]).toContain(response.status());
   });
+
+  test('GET /api/documents/<id>/file should 404 for a document the user does not own', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/documents/999999999/file');
+    expect(response.status()).toBe(404);
+    expect((await response.json()).error).toBeTruthy();
+  });
+
+  test('GET /api/attachments/<id>/file should 404 for an attachment the user does not own', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/attachments/999999999/file');
+    expect(response.status()).toBe(404);
+    expect((await response.json()).error).toBeTruthy();
+  });
+
+  test('GET /api/documents/<id>/file should require login', async ({ apiContext }) => {
+    const response = await apiContext.get('/api/documents/1/file', { maxRedirects: 0 });
+    expect([302, 401, 403]).toContain(response.status());
+  });
 });
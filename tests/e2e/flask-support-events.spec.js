@@ -0,0 +1,46 @@
+const { test, expect } = require('./fixtures/test-helpers');
+
+// The streams stay open for SUPPORT_EVENTS_STREAM_SECONDS, so read the first
+// chunk from the page and abort instead of waiting for the whole body
+async function readFirstEvent(page, path) {
+  return page.evaluate(async (url) => {
+    const controller = new AbortController();
+    const timer = setTimeout(() => controller.abort(), 10000);
+    try {
+      const response = await fetch(url, { signal: controller.signal });
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let text = '';
+      while (!text.includes('\n\n') || !text.includes('event:')) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        text += decoder.decode(value, { stream: true });
+      }
+      return {
+        status: response.status,
+        contentType: response.headers.get('content-type'),
+        cacheControl: response.headers.get('cache-control'),
+        text,
+      };
+    } finally {
+      clearTimeout(timer);
+      controller.abort();
+    }
+  }, path);
+}
+
+test.describe('Support Events', () => {
+  test('GET /api/support-chat/events should stream the unread count', async ({ authenticatedPage }) => {
+    const result = await readFirstEvent(authenticatedPage, '/api/support-chat/events');
+    expect(result.status).toBe(200);
+    expect(result.contentType).toContain('text/event-stream');
+    expect(result.cacheControl).toContain('no-cache');
+    expect(result.text).toContain('retry:');
+    expect(result.text).toContain('event: unread');
+  });
+
+  test('GET /api/support-chat/events should require login', async ({ apiContext }) => {
+    const response = await apiContext.get('/api/support-chat/events', { maxRedirects: 0 });
+    expect([302, 401, 403]).toContain(response.status());
+  });
+});
@@ -12,4 +12,26 @@ test.describe('Support Chat', () => {
     const response = await authenticatedPage.request.get('/api/support-chat/unread');
     expect(response.status()).toBe(200);
   });
+
+  test('GET /api/support-chat should return a page of messages', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/support-chat?limit=10');
+    expect(response.status()).toBe(200);
+    const data = await response.json();
+    expect(Array.isArray(data.messages)).toBeTruthy();
+    expect(typeof data.has_more).toBe('boolean');
+    expect(data).toHaveProperty('next_before_id');
+  });
+
+  test('GET /api/support-chat/unread should answer 304 on a matching ETag', async ({ authenticatedPage }) => {
+    const response = await authenticatedPage.request.get('/api/support-chat/unread');
+    expect(response.status()).toBe(200);
+    expect(typeof (await response.json()).unread_count).toBe('number');
+    const etag = response.headers()['etag'];
+    expect(etag).toBeTruthy();
+
+    const cached = await authenticatedPage.request.get('/api/support-chat/unread', {
+      headers: { 'If-None-Match': etag },
+    });
+    expect(cached.status()).toBe(304);
+  });
 });
@@ -0,0 +1,310 @@
+"""
+Background Thumbnail Generation for Ask-Chopper
+
+Image attachments get a thumbnail set off the request path: every size in
+THUMBNAIL_SIZES (default 150 and 400 px bounding boxes), each as JPEG or
+PNG and as WebP. The chat turn only queues a job
+once its rows are committed; a dispatcher thread feeds the queue to a
+process pool (THUMBNAIL_WORKERS), so decoding and LANCZOS resampling don't
+compete with request threads for the GIL.
+
+Decoding does as little work as the thumbnails need (see
+open_for_thumbnail() and shrink()): JPEGs are decoded in draft mode at a
+reduced scale, Image.reduce() box-averages down to about twice the target
+before the LANCZOS pass, smaller sizes are made from the next larger one,
+and metadata is dropped. scripts/bench_thumbnails.py compares this with a
+plain Image.thumbnail() call.
+
+Finished renders are handed to a callback on a finisher thread, which
+stores them and points MessageAttachment.thumbnail_path at the smallest
+size (see store_thumbnails() in app.py).
+
+Modes (THUMBNAIL_MODE):
+    background - queue + process pool (default)
+    inline     - render in the calling thread after the commit (default on
+                 Vercel, where work can't outlive the response)
+    off        - no thumbnails
+"""
+
+import atexit
+import io
+import math
+import multiprocessing
+import os
+import queue
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from PIL import Image, ImageOps, features
+
+MODES = ("background", "inline", "off")
+THUMBNAIL_MODE = os.environ.get(
+    "THUMBNAIL_MODE", "inline" if os.environ.get("VERCEL") else "background"
+).strip().lower()
+THUMBNAIL_SIZES = tuple(sorted(
+    int(size) for size in os.environ.get("THUMBNAIL_SIZES", "150,400").split(",") if size.strip()
+))
+THUMBNAIL_WORKERS = max(1, int(os.environ.get("THUMBNAIL_WORKERS", "2")))
+# Jobs waiting for a worker; beyond this new images go without thumbnails
+THUMBNAIL_QUEUE_SIZE = int(os.environ.get("THUMBNAIL_QUEUE_SIZE", "500"))
+THUMBNAIL_QUALITY = 85
+# Decode/reduce to at least this multiple of the target box before the LANCZOS pass
+REDUCING_GAP = 2.0
+
+_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+_VARIANT_RE = re.compile(r"^(?P<prefix>.*?)thumb_(?P<width>\d+)_(?P<stem>.+)\.(?P<ext>jpg|png|webp)$")
+
+
+@dataclass
+class ThumbnailJob:
+    """An image attachment waiting for its thumbnails."""
+    attachment_id: int
+    source_path: str
+    stem: str
+    temporary: bool = False  # remove source_path when done
+
+
+def thumbnail_filename(stem: str, width: int, fmt: str) -> str:
+    return f"thumb_{width}_{stem}.{_EXTENSIONS[fmt]}"
+
+
+def thumbnail_mime_type(fmt: str) -> str:
+    return _MIME_TYPES[fmt]
+
+
+def thumbnail_variants(thumbnail_path: Optional[str]) -> Dict[str, str]:
+    """
+    Paths of every variant in the set a thumbnail_path belongs to.
+
+    Keys are the width, plus '_webp' for WebP ('150', '150_webp', '400',
+    '400_webp'). Thumbnails made before sets existed return {}.
+    """
+    match = _VARIANT_RE.match(thumbnail_path or "")
+    if not match:
+        return {}
+    prefix, stem, ext = match.group("prefix"), match.group("stem"), match.group("ext")
+    variants = {}
+    for width in THUMBNAIL_SIZES:
+        variants[str(width)] = f"{prefix}thumb_{width}_{stem}.{ext}"
+        if webp_supported():
+            variants[f"{width}_webp"] = f"{prefix}thumb_{width}_{stem}.webp"
+    return variants
+
+
+def webp_supported() -> bool:
+    return features.check("webp")
+
+
+def open_for_thumbnail(source: Union[str, BinaryIO], box: int) -> Tuple[Image.Image, bool]:
+    """
+    Decode an image only as far as a `box` px thumbnail needs.
+
+    JPEGs use draft mode: libjpeg's DCT scaling decodes at the smallest
+    1/2, 1/4 or 1/8 scale that still covers REDUCING_GAP * box, so a 12 MP
+    photo is decoded as ~0.75 MP. The result is upright (EXIF orientation
+    applied), RGB or RGBA, and carries no metadata (EXIF, XMP, ICC profile,
+    comments), so none of it is copied into the thumbnails.
+
+    Returns:
+        Tuple of (image, has_alpha)
+    """
+    with Image.open(source) as img:
+        if img.format == "JPEG":
+            # draft() wants both sides covered, so ask for the box-fitted size, not a square
+            scale = min(1.0, box * REDUCING_GAP / max(img.size))
+            img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        img.load()
+        ImageOps.exif_transpose(img, in_place=True)
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        mode = "RGBA" if has_alpha else "RGB"
+        image = img if img.mode == mode else img.convert(mode)
+    image.info = {}
+    return image, has_alpha
+
+
+def shrink(image: Image.Image, box: int) -> Image.Image:
+    """
+    Fit an image in a box x box square (never upscaling).
+
+    Image.reduce() first averages blocks of pixels by the largest integer
+    factor that keeps the image at least REDUCING_GAP times the box, which
+    is far cheaper than LANCZOS over the full image; LANCZOS then resamples
+    the small remainder.
+    """
+    factor = int(max(image.width, image.height) / box / REDUCING_GAP)
+    result = image.reduce(factor) if factor >= 2 else image.copy()
+    result.thumbnail((box, box), Image.Resampling.LANCZOS, reducing_gap=None)
+    return result
+
+
+def encode_thumbnail(image: Image.Image, fmt: str) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "WEBP":
+        image.save(buffer, format=fmt, quality=THUMBNAIL_QUALITY, method=4)
+    else:
+        image.save(buffer, format=fmt, quality=THUMBNAIL_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def make_thumbnail(source: Union[str, BinaryIO], box: int = 150) -> Tuple[bytes, str]:
+    """
+    Single thumbnail, in whichever of JPEG and PNG is smaller (PNG if the image has transparency).
+
+    Returns:
+        Tuple of (image bytes, PIL format name)
+    """
+    image, has_alpha = open_for_thumbnail(source, box)
+    image = shrink(image, box)
+    if has_alpha:
+        return encode_thumbnail(image, "PNG"), "PNG"
+    candidates = [(encode_thumbnail(image, fmt), fmt) for fmt in ("JPEG", "PNG")]
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def render_thumbnails(source_path: str, sizes: Sequence[int] = THUMBNAIL_SIZES) -> List[Dict[str, Any]]:
+    """
+    Render the thumbnail set for one image. Runs in a pool process.
+
+    The image is decoded once for the largest size; each smaller size is
+    shrunk from the previous one. The default format is JPEG or PNG,
+    whichever encodes the largest size smaller (photos vs. flat graphics
+    and screenshots), or PNG for images with transparency; every size
+    also gets a WebP variant.
+
+    Returns:
+        List of {'width', 'format', 'data'} dicts, largest size first
+    """
+    current, has_alpha = open_for_thumbnail(source_path, max(sizes))
+    renders = []
+    fallback = "PNG" if has_alpha else None
+    for width in sorted(sizes, reverse=True):
+        current = shrink(current, width)
+        if fallback is None:
+            candidates = {fmt: encode_thumbnail(current, fmt) for fmt in ("JPEG", "PNG")}
+            fallback = min(candidates, key=lambda fmt: len(candidates[fmt]))
+            data = candidates[fallback]
+        else:
+            data = encode_thumbnail(current, fallback)
+        renders.append({"width": width, "format": fallback, "data": data})
+        if webp_supported():
+            renders.append({"width": width, "format": "WEBP", "data": encode_thumbnail(current, "WEBP")})
+    return renders
+
+
+class ThumbnailWorker:
+    """
+    Queue of thumbnail jobs rendered on a process pool.
+
+    Args:
+        finish: Called as finish(job, renders) on a finisher thread once a job
+            is rendered; stores the files and updates the attachment
+        mode: 'background', 'inline' or 'off'
+        workers: Render processes
+        queue_size: Jobs that may wait for a worker
+    """
+
+    def __init__(self, finish: Callable[[ThumbnailJob, List[Dict[str, Any]]], None],
+                 mode: str = THUMBNAIL_MODE, workers: int = THUMBNAIL_WORKERS,
+                 queue_size: int = THUMBNAIL_QUEUE_SIZE):
+        self.finish = finish
+        self.mode = mode if mode in MODES else "background"
+        self.workers = workers
+        self._queue: "queue.Queue[Optional[ThumbnailJob]]" = queue.Queue(maxsize=queue_size)
+        # Jobs handed to the pool but not finished; keeps the backlog in our bounded queue
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._lock = threading.Lock()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._finisher: Optional[ThreadPoolExecutor] = None
+        self._dispatcher: Optional[threading.Thread] = None
+
+    def submit(self, job: ThumbnailJob) -> bool:
+        """Queue a job (or run it now in inline mode). Returns False if it was dropped."""
+        if self.mode == "off":
+            self._cleanup(job)
+            return False
+        if self.mode == "inline":
+            try:
+                self._run(job, render_thumbnails(job.source_path))
+                return True
+            except Exception as e:
+                print(f"ERROR: Thumbnail generation failed for attachment {job.attachment_id}: {e}")
+                self._cleanup(job)
+                return False
+
+        self._start()
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            print(f"WARNING: Thumbnail queue full, skipping attachment {job.attachment_id}")
+            self._cleanup(job)
+            return False
+
+    def pending(self) -> int:
+        """Jobs waiting in the queue (not counting those being rendered)."""
+        return self._queue.qsize()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            # spawn: forking a threaded web server process is unsafe
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+            self._finisher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thumbnail-finish")
+            self._dispatcher = threading.Thread(target=self._dispatch, name="thumbnail-dispatch", daemon=True)
+            self._dispatcher.start()
+            atexit.register(self.shutdown)
+
+    def _dispatch(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            self._slots.acquire()
+            try:
+                future = self._pool.submit(render_thumbnails, job.source_path)
+            except Exception as e:
+                self._slots.release()
+                print(f"ERROR: Could not queue thumbnails for attachment {job.attachment_id}: {e}")
+                self._cleanup(job)
+                continue
+            future.add_done_callback(lambda f, job=job: self._finisher.submit(self._complete, job, f))
+
+    def _complete(self, job: ThumbnailJob, future) -> None:
+        try:
+            self._run(job, future.result())
+        except Exception as e:
+            print(f"ERROR: Thumbnail generation failed for attachment {job.attachment_id}: {e}")
+            self._cleanup(job)
+        finally:
+            self._slots.release()
+
+    def _run(self, job: ThumbnailJob, renders: List[Dict[str, Any]]) -> None:
+        try:
+            self.finish(job, renders)
+        finally:
+            self._cleanup(job)
+
+    def _cleanup(self, job: ThumbnailJob) -> None:
+        if job.temporary:
+            try:
+                os.remove(job.source_path)
+            except OSError:
+                pass
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Finish queued jobs (if wait) and stop the dispatcher and pools."""
+        with self._lock:
+            if self._dispatcher is None:
+                return
+            self._queue.put(None)
+            if wait:
+                self._dispatcher.join()
+            self._pool.shutdown(wait=wait)
+            self._finisher.shutdown(wait=wait)
+            self._dispatcher = None
@@ -0,0 +1,168 @@
+"""
+Unit-of-Work Commit Retry for Ask-Chopper
+
+Commits a session's transaction and, when the commit fails with a
+transient database error (dropped connection, failover, serialization
+failure, deadlock, SQLite lock), rolls back, lets the pool hand out a
+fresh connection and replays the transaction's inserts with backoff.
+
+Every ORM insert made in the current transaction is tracked from flush
+events. After a rollback those objects are transient again with their
+attributes (primary keys included) intact, so the replay re-adds the
+same rows with the same ids and foreign keys. If the failed commit
+actually reached the database (the connection dropped before the
+acknowledgement), the rows are found by primary key and nothing is
+written twice.
+
+Only units of work made of ORM inserts can be replayed. Transactions
+that also update or delete rows, or that ran bulk DML through the
+session, are rolled back and the error is raised as before.
+"""
+
+import os
+import random
+import sqlite3
+import time
+from typing import Any, List, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.orm import Session
+
+from bridge_log import log_bridge_event
+
+COMMIT_ATTEMPTS = int(os.environ.get("DB_COMMIT_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("DB_COMMIT_RETRY_DELAY", "0.2"))
+
+# SQLSTATEs worth retrying: connection exceptions (class 08), serialization
+# failure, deadlock, server shutdown / not yet accepting connections,
+# too many connections
+RETRYABLE_SQLSTATE_CLASSES = ("08",)
+RETRYABLE_SQLSTATES = {"40001", "40P01", "57P01", "57P02", "57P03", "53300"}
+
+# SQLITE_BUSY, SQLITE_LOCKED
+RETRYABLE_SQLITE_CODES = {5, 6}
+
+_INSERTS_KEY = "unit_of_work_inserts"
+_NOT_REPLAYABLE_KEY = "unit_of_work_not_replayable"
+
+
+def get_sqlstate(error: BaseException) -> Optional[str]:
+    """SQLSTATE of a DBAPI error (psycopg2 pgcode / psycopg sqlstate), if any."""
+    orig = getattr(error, "orig", error)
+    return getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """Whether a failed commit can be retried on a new connection."""
+    if isinstance(error, DisconnectionError):
+        return True
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+
+    orig = error.orig
+    if isinstance(orig, sqlite3.OperationalError):
+        code = getattr(orig, "sqlite_errorcode", None)
+        if code is not None:
+            return code in RETRYABLE_SQLITE_CODES
+        return "database is locked" in str(orig)
+
+    sqlstate = get_sqlstate(error)
+    if sqlstate:
+        return sqlstate in RETRYABLE_SQLSTATES or sqlstate[:2] in RETRYABLE_SQLSTATE_CLASSES
+    # psycopg2 reports a lost connection as OperationalError/InterfaceError without a SQLSTATE
+    orig_type = type(orig).__name__
+    return orig_type in ("OperationalError", "InterfaceError")
+
+
+@event.listens_for(Session, "after_begin")
+def _start_unit_of_work(session, transaction, connection):
+    if transaction.parent is None:
+        session.info.pop(_INSERTS_KEY, None)
+        session.info.pop(_NOT_REPLAYABLE_KEY, None)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_unit_of_work(session, flush_context):
+    session.info.setdefault(_INSERTS_KEY, []).extend(session.new)
+    if session.deleted or any(session.is_modified(obj) for obj in session.dirty):
+        session.info[_NOT_REPLAYABLE_KEY] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_bulk_statements(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info[_NOT_REPLAYABLE_KEY] = True
+
+
+def _pending_inserts(session) -> Optional[List[Any]]:
+    """Inserts to replay, or None if the unit of work can't be replayed."""
+    if session.info.get(_NOT_REPLAYABLE_KEY) or session.deleted:
+        return None
+    if any(session.is_modified(obj) for obj in session.dirty):
+        return None
+    inserts = list(session.info.get(_INSERTS_KEY, []))
+    inserts += [obj for obj in session.new if obj not in inserts]
+    return inserts
+
+
+def _already_committed(session, inserts: List[Any]) -> bool:
+    """Whether the rows of a failed commit are in the database after all."""
+    if not inserts:
+        return False
+    for obj in inserts:
+        identity = inspect(obj).mapper.primary_key_from_instance(obj)
+        if any(value is None for value in identity):
+            return False
+        if session.get(type(obj), identity[0] if len(identity) == 1 else tuple(identity)) is None:
+            return False
+    return True
+
+
+def commit_unit_of_work(session, attempts: int = COMMIT_ATTEMPTS, source: str = "app") -> None:
+    """
+    Commit, replaying the transaction's inserts on transient database errors.
+
+    Args:
+        session: Session to commit (db.session)
+        attempts: Maximum commit attempts
+        source: Bridge log source for retry events
+
+    Raises:
+        Exception: The last error if it isn't retryable, the unit of work
+            can't be replayed, or every attempt failed
+    """
+    for attempt in range(1, attempts + 1):
+        inserts = _pending_inserts(session)
+        try:
+            session.commit()
+            return
+        except Exception as e:
+            session.rollback()
+            if attempt == attempts or inserts is None or not is_retryable_error(e):
+                raise
+
+            sqlstate = get_sqlstate(e)
+            print(f"DB commit attempt {attempt} failed ({sqlstate or type(e).__name__}), "
+                  f"replaying {len(inserts)} insert(s): {e}")
+            log_bridge_event(
+                source=source,
+                event="db_commit_retry",
+                status="retry",
+                detail=str(e),
+                extra={"attempt": attempt, "sqlstate": sqlstate, "inserts": len(inserts)}
+            )
+
+            time.sleep(RETRY_BASE_DELAY * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+            try:
+                if _already_committed(session, inserts):
+                    session.rollback()
+                    return
+            except Exception as check_error:
+                session.rollback()
+                if not is_retryable_error(check_error):
+                    raise
+            session.add_all(inserts)
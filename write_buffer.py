@@ -0,0 +1,123 @@
+"""
+Per-Request Write Buffer for Ask-Chopper
+
+Collects the rows a request creates (ChatMessage, MessageAttachment,
+DocumentUpload) outside the session and persists them together at the end
+of the request: one flush, where SQLAlchemy writes each table's rows as a
+single multi-row INSERT (insertmanyvalues), and one commit.
+
+Buffered objects stay out of the session until then, so queries made
+during the request don't autoflush them one statement at a time and no
+transaction is held open while waiting on the model. Related rows are
+linked through relationships (attachment.message = user_msg) and the
+flush fills in the foreign keys.
+
+Failure policy (CHAT_WRITE_FAILURE_POLICY) once commit retries are
+exhausted:
+    log   - keep serving the response; the lost rows are written to the
+            bridge log as a write_buffer_failed event for recovery (default)
+    raise - re-raise so the request fails
+"""
+
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+from bridge_log import log_bridge_event
+from unit_of_work import commit_unit_of_work
+
+FAILURE_POLICIES = ("log", "raise")
+FAILURE_POLICY = os.environ.get("CHAT_WRITE_FAILURE_POLICY", "log").strip().lower()
+
+# Longest text value copied into the failure log per column
+_LOGGED_VALUE_CHARS = 4000
+
+
+def _describe_row(obj: Any) -> Dict[str, Any]:
+    """Column values of a buffered row for the failure log."""
+    row = {"table": obj.__table__.name}
+    for column in obj.__table__.columns:
+        value = getattr(obj, column.key, None)
+        if value is None:
+            continue
+        if isinstance(value, str) and len(value) > _LOGGED_VALUE_CHARS:
+            value = value[:_LOGGED_VALUE_CHARS] + "...<truncated>"
+        row[column.key] = value if isinstance(value, (str, int, float, bool)) else str(value)
+    return row
+
+
+class WriteBuffer:
+    """Rows created by one request, persisted in one transaction by persist()."""
+
+    def __init__(self):
+        self._rows: List[Any] = []
+        self._on_failure: List[Callable[[], None]] = []
+
+    def add(self, obj: Any) -> Any:
+        self._rows.append(obj)
+        return obj
+
+    def on_failure(self, callback: Callable[[], None]) -> None:
+        """Register compensation to run if the rows can't be persisted (e.g. remove indexed chunks)."""
+        self._on_failure.append(callback)
+
+    @property
+    def rows(self) -> List[Any]:
+        return list(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def persist(self, session, source: str = "app", policy: Optional[str] = None,
+                session_id: Optional[str] = None, user_id: Optional[Any] = None) -> bool:
+        """
+        Add the buffered rows to the session and commit them.
+
+        Args:
+            session: Session to write with (db.session)
+            source: Bridge log source
+            policy: 'log' or 'raise'; defaults to CHAT_WRITE_FAILURE_POLICY
+            session_id: Chat session for the failure log
+            user_id: User for the failure log
+
+        Returns:
+            True if the rows were committed, False if they were dropped under the 'log' policy
+        """
+        policy = policy or FAILURE_POLICY
+        if not self._rows:
+            return True
+
+        session.add_all(self._rows)
+        try:
+            commit_unit_of_work(session, source=source)
+            self._rows = []
+            self._on_failure = []
+            return True
+        except Exception as e:
+            session.rollback()
+            print(f"WARNING: Failed to persist {len(self._rows)} buffered row(s): {e}")
+            log_bridge_event(
+                source=source,
+                event="write_buffer_failed",
+                status="error",
+                session_id=session_id,
+                user_id=user_id,
+                detail=str(e),
+                extra={"policy": policy, "rows": [_describe_row(obj) for obj in self._rows]}
+            )
+            self._compensate()
+            if policy == "raise":
+                raise
+            return False
+
+    def discard(self) -> None:
+        """Drop the buffered rows unwritten (the request failed before persist()) and run the compensation."""
+        self._rows = []
+        self._compensate()
+
+    def _compensate(self) -> None:
+        callbacks, self._on_failure = self._on_failure, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as cleanup_error:
+                print(f"WARNING: write buffer compensation failed: {cleanup_error}")